@@ -0,0 +1,115 @@
+"""Compare the full decode and encode of a JPEG watermark with the re-encoding of the blocks under the watermark.
+
+Usage: python benchmarks/bench_jpeg_patch.py --count 5 --width 7744 --height 5184
+"""
+import argparse
+import os
+import sys
+import tempfile
+
+from common import default_font, make_photo, measure
+
+from PIL import Image, ImageChops
+
+from package.api.cache import clear_caches
+from package.api.encoding import EncoderSettings
+from package.api.image import CustomImage
+from package.api.jpeg import jpegtran_path
+
+
+TEXT = "pyWatermark"
+COLOR = "#ffffff"
+POSITION = "bottom right"
+
+
+def watermark(path, font, font_size, patch_jpeg, encoder=None):
+    """Watermark a JPEG file in the output folder.
+
+    :param path: The path of the image file.
+    :param font: The font file of the watermark.
+    :param font_size: The font size of the watermark.
+    :param patch_jpeg: True to re-encode only the blocks under the watermark.
+    :param encoder: The settings of the output encoding.
+    :type path: str
+    :type font: str
+    :type font_size: int
+    :type patch_jpeg: bool
+    :type encoder: EncoderSettings
+
+    :return: The watermarked image, its estimated peak memory and True if only the blocks were re-encoded.
+    :rtype: (WatermarkResult, int, bool)
+    """
+    with CustomImage(path, folder="patch" if patch_jpeg else "full", encoder=encoder, patch_jpeg=patch_jpeg) as image:
+        result = image.watermark_text(TEXT, COLOR, font, font_size, POSITION, stamp=True)
+        return result, image.peak_memory, image.patching
+
+
+def changed_outside(source_path, output_path, box):
+    """Measure the changes of the pixels outside the watermark.
+    The pixel next to the region is ignored, the upsampling of the chrominance blends it with the region.
+
+    :param source_path: The path of the source image file.
+    :param output_path: The path of the watermarked image file.
+    :param box: The region of the watermark.
+    :type source_path: str
+    :type output_path: str
+    :type box: (int, int, int, int)
+
+    :return: The largest difference of a channel outside the region.
+    :rtype: int
+    """
+    with Image.open(source_path) as source, Image.open(output_path) as output:
+        difference = ImageChops.difference(source.convert("RGB"), output.convert("RGB"))
+    difference.paste((0, 0, 0), (max(0, box[0] - 1), max(0, box[1] - 1), box[2] + 1, box[3] + 1))
+    return max(high for _, high in difference.getextrema())
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--font", help="The font file of the watermark, found automatically if omitted.")
+    parser.add_argument("--font-size", type=int, default=200)
+    parser.add_argument("--source", help="A JPEG photo to watermark instead of a synthetic one.")
+    parser.add_argument("--count", type=int, default=5, help="The number of runs of each path.")
+    parser.add_argument("--width", type=int, default=7744)
+    parser.add_argument("--height", type=int, default=5184)
+    args = parser.parse_args()
+    font = args.font or default_font()
+    if jpegtran_path() is None:
+        sys.exit("jpegtran with the -drop switch is not in the PATH, the blocks cannot be re-encoded alone.")
+
+    clear_caches()
+    # The patched image keeps the quality of the source, the full path is also measured at the source quality.
+    paths = (("full", False, None), ("full, keep", False, EncoderSettings(options={"JPEG": {"quality": "keep"}})),
+             ("patch", True, None))
+    with tempfile.TemporaryDirectory() as tmp:
+        path = args.source or make_photo(os.path.join(tmp, "source.jpg"), (args.width, args.height), "JPEG")
+        if args.source:
+            path = os.path.join(tmp, os.path.basename(args.source))
+            with open(args.source, "rb") as source, open(path, "wb") as copy:
+                copy.write(source.read())
+        results = {name: watermark(path, font, args.font_size, patch_jpeg, encoder)
+                   for name, patch_jpeg, encoder in paths}
+        if not results["patch"][2]:
+            sys.exit("The source cannot be patched, see package.api.jpeg.can_patch.")
+        times = {name: measure(lambda: watermark(path, font, args.font_size, patch_jpeg, encoder), args.count)
+                 for name, patch_jpeg, encoder in paths}
+
+        with Image.open(path) as source, Image.open(results["patch"][0].output) as output:
+            size = source.size
+            box = ImageChops.difference(source.convert("RGB"), output.convert("RGB")).getbbox()
+
+        megapixels, mebibytes = size[0] * size[1] / 1e6, os.path.getsize(path) / 2 ** 20
+        print(f"{size[0]}x{size[1]} JPEG ({megapixels:.1f} MP, {mebibytes:.1f} MiB), median of {args.count} runs, "
+              f"patched region {box[2] - box[0]}x{box[3] - box[1]}")
+        print(f"{'':<12}{'time (ms)':>12}{'memory (MiB)':>14}{'size (MiB)':>12}{'max change outside':>20}")
+        for name, _, _ in paths:
+            result, memory, _ = results[name]
+            print(f"{name:<12}{times[name] * 1000:>12.1f}{memory / 2 ** 20:>14.1f}"
+                  f"{result.bytes_written / 2 ** 20:>12.1f}{changed_outside(path, result.output, box):>20}")
+        for name in ("full", "full, keep"):
+            print(f"time saved per image against {name}: {(times[name] - times['patch']) * 1000:.1f} ms "
+                  f"({1 - times['patch'] / times[name]:.0%})")
+
+
+if __name__ == "__main__":
+    main()
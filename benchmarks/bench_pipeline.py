@@ -0,0 +1,199 @@
+"""Benchmark each stage of the watermark pipeline and compare it with a stored baseline.
+
+Usage:
+    python benchmarks/bench_pipeline.py --save-baseline        # record benchmarks/baselines/pipeline.json
+    python benchmarks/bench_pipeline.py                        # fail if a metric is slower than the baseline
+
+All the metrics are durations in seconds, lower is better.
+"""
+import argparse
+import json
+import os
+import platform
+import shutil
+import sys
+import tempfile
+
+from common import default_font, make_logo, make_photo, measure
+
+from package.api.batch import BatchProcessor
+from package.api.cache import clear_caches
+from package.api.image import CustomImage
+
+
+BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "baselines", "pipeline.json")
+
+
+def bench_image(path, logos, font, repeat):
+    """Time the stages of the watermark of one image.
+
+    :param path: The path of the image file.
+    :param logos: The paths of the PNG and JPEG logos.
+    :param font: The font file of the text.
+    :param repeat: The number of runs of each stage.
+    :type path: str
+    :type logos: dict
+    :type font: str
+    :type repeat: int
+
+    :return: The median duration of each stage.
+    :rtype: dict
+    """
+    metrics = {}
+
+    def construct():
+        CustomImage(path).close()
+
+    def decode():
+        with CustomImage(path) as image:
+            image.image
+
+    def latency():
+        with CustomImage(path) as image:
+            image.watermark_text("pyWatermark", "#ffffff", font, 120, "bottom right")
+
+    metrics["construct"] = measure(construct, repeat)
+    metrics["decode"] = measure(decode, repeat)
+    metrics["latency"] = measure(latency, repeat)
+
+    with CustomImage(path) as image:
+        image.image
+        metrics["save"] = measure(lambda: image.save(image.image), repeat)
+
+        # The encoding is measured on its own, the watermark stages only blend.
+        image.save = lambda watermarked: True
+        metrics["watermark_text"] = measure(
+            lambda: image.watermark_text("pyWatermark", "#ffffff", font, 120, "bottom right"), repeat)
+        metrics["watermark_text_tiled"] = measure(
+            lambda: image.watermark_text("pyWatermark", "#ffffff", font, 120, "tiled"), repeat)
+        for name, logo in logos.items():
+            metrics[f"watermark_image_{name}"] = measure(lambda: image.watermark_image(logo, "center"), repeat)
+
+        calls = 10000
+        metrics["watermark_position"] = measure(
+            lambda: [image.watermark_position("bottom right") for _ in range(calls)], repeat) / calls
+    return metrics
+
+
+def bench_batch(path, folder, count, workers, font):
+    """Time the throughput of the batch engine.
+
+    :param path: The path of the image file copied to build the batch.
+    :param folder: The folder of the batch.
+    :param count: The number of images of the batch.
+    :param workers: The number of worker processes.
+    :param font: The font file of the text.
+    :type path: str
+    :type folder: str
+    :type count: int
+    :type workers: int
+    :type font: str
+
+    :return: The duration per image of the batch.
+    :rtype: float
+    """
+    os.makedirs(folder)
+    paths = [shutil.copy(path, os.path.join(folder, f"{index}{os.path.splitext(path)[1]}")) for index in range(count)]
+    engine = BatchProcessor(workers=workers, incremental=False)
+
+    def run():
+        for result in engine.run(paths, wt_type="text", text="pyWatermark", color="#ffffff", font=font, size=120,
+                                 pos="bottom right"):
+            if not result.success:
+                raise RuntimeError(f"{result.path} failed : {result.error}")
+
+    return measure(run, 1) / count
+
+
+def compare(metrics, baseline, threshold):
+    """Compare the metrics with a baseline.
+
+    :param metrics: The current metrics.
+    :param baseline: The baseline metrics.
+    :param threshold: The tolerated slowdown, 0.25 for 25 %.
+    :type metrics: dict
+    :type baseline: dict
+    :type threshold: float
+
+    :return: The descriptions of the regressions.
+    :rtype: list
+    """
+    regressions = []
+    for name, value in sorted(metrics.items()):
+        reference = baseline.get(name)
+        if not reference:
+            continue
+        change = value / reference - 1
+        status = "REGRESSION" if change > threshold else "ok"
+        print(f"{name:<48}{reference * 1000:>12.3f}{value * 1000:>12.3f}{change:>+9.1%}  {status}")
+        if change > threshold:
+            regressions.append(f"{name}: {reference * 1000:.3f} ms -> {value * 1000:.3f} ms ({change:+.1%})")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sizes", nargs="+", default=["1024x768", "3000x2000"], help="The image sizes, WxH.")
+    parser.add_argument("--formats", nargs="+", default=["JPEG", "PNG"], help="The image formats.")
+    parser.add_argument("--font", help="The font file of the text, found automatically if omitted.")
+    parser.add_argument("--repeat", type=int, default=5, help="The number of runs of each stage.")
+    parser.add_argument("--batch", type=int, default=16, help="The number of images of the batch throughput runs.")
+    parser.add_argument("--workers", type=int, help="The number of worker processes of the batch runs.")
+    parser.add_argument("--baseline", default=BASELINE, help="The JSON file of the baseline.")
+    parser.add_argument("--save-baseline", action="store_true", help="Store the results as the new baseline.")
+    parser.add_argument("--threshold", type=float, default=0.25, help="The tolerated slowdown, 0.25 for 25 %%.")
+    parser.add_argument("--output", help="Write the results to this JSON file too.")
+    args = parser.parse_args()
+
+    font = args.font or default_font()
+    metrics = {}
+    with tempfile.TemporaryDirectory() as tmp:
+        logos = {"png_logo": make_logo(os.path.join(tmp, "logo.png"), alpha=True),
+                 "jpg_logo": make_logo(os.path.join(tmp, "logo.jpg"), alpha=False)}
+        for size in args.sizes:
+            width, height = (int(value) for value in size.lower().split("x"))
+            for fmt in args.formats:
+                clear_caches()
+                name = f"{fmt.lower()}-{width}x{height}"
+                path = make_photo(os.path.join(tmp, f"{name}.{fmt.lower()}"), (width, height), fmt)
+                for stage, value in bench_image(path, logos, font, args.repeat).items():
+                    metrics[f"{name}/{stage}"] = value
+                metrics[f"{name}/batch_per_image"] = bench_batch(path, os.path.join(tmp, f"batch-{name}"),
+                                                                 args.batch, args.workers, font)
+
+    report = {"machine": {"python": platform.python_version(), "platform": platform.platform(),
+                          "cpus": os.cpu_count()},
+              "metrics": metrics}
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2, sort_keys=True)
+
+    if args.save_baseline:
+        os.makedirs(os.path.dirname(args.baseline), exist_ok=True)
+        with open(args.baseline, "w") as f:
+            json.dump(report, f, indent=2, sort_keys=True)
+        for name, value in sorted(metrics.items()):
+            print(f"{name:<48}{value * 1000:>12.3f} ms")
+        print(f"Baseline saved to {args.baseline}")
+        return 0
+
+    if not os.path.exists(args.baseline):
+        for name, value in sorted(metrics.items()):
+            print(f"{name:<48}{value * 1000:>12.3f} ms")
+        print(f"No baseline at {args.baseline}, run with --save-baseline to create it.")
+        return 0
+
+    with open(args.baseline) as f:
+        baseline = json.load(f)["metrics"]
+    print(f"{'metric':<48}{'base (ms)':>12}{'now (ms)':>12}{'change':>9}")
+    regressions = compare(metrics, baseline, args.threshold)
+    if regressions:
+        print(f"\n{len(regressions)} metric(s) regressed by more than {args.threshold:.0%}:", file=sys.stderr)
+        for regression in regressions:
+            print(f"  {regression}", file=sys.stderr)
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,75 @@
+"""Compare the per-image drawing path of the watermark with the stamp mode.
+
+Usage: python benchmarks/bench_stamp.py --count 50 --width 4000 --height 3000
+"""
+import argparse
+import os
+import tempfile
+
+from common import default_font, make_photo, measure
+
+from PIL import Image, ImageDraw
+
+from package.api.cache import clear_caches, get_font
+from package.api.image import CustomImage
+from package.api.stamp import text_stamp
+
+
+TEXT = "pyWatermark"
+COLOR = "#ffffff"
+POSITION = "bottom right"
+MARGIN = 25
+
+
+def draw_overlay(image, font_type, font_size):
+    """Watermark an image the way the drawing path does, without saving it."""
+    image = image.copy()
+    drawing = ImageDraw.Draw(image)
+    font = get_font(font_type, font_size)
+    width, height = drawing.textsize(TEXT, font)
+    pos = (image.width - MARGIN - width, image.height - MARGIN - height)
+    drawing.text(pos, TEXT, fill=COLOR, font=font)
+    return image
+
+
+def stamp_overlay(image, font_type, font_size):
+    """Watermark an image the way the stamp mode does, without saving it."""
+    image = image.copy()
+    text_stamp(TEXT, COLOR, font_type, font_size, POSITION, MARGIN, image.size).apply(image)
+    return image
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--font", help="The font file of the watermark, found automatically if omitted.")
+    parser.add_argument("--font-size", type=int, default=200)
+    parser.add_argument("--count", type=int, default=20, help="The number of images of the batch.")
+    parser.add_argument("--width", type=int, default=4000)
+    parser.add_argument("--height", type=int, default=3000)
+    args = parser.parse_args()
+    font = args.font or default_font()
+
+    clear_caches()
+    with tempfile.TemporaryDirectory() as tmp:
+        path = make_photo(os.path.join(tmp, "source.jpg"), (args.width, args.height), "JPEG")
+        source = Image.open(path)
+        source.load()
+
+        overlay_draw = measure(lambda: draw_overlay(source, font, args.font_size), args.count)
+        overlay_stamp = measure(lambda: stamp_overlay(source, font, args.font_size), args.count)
+
+        with CustomImage(path) as image:
+            image.image
+            full_draw = measure(lambda: image.watermark_text(TEXT, COLOR, font, args.font_size, POSITION),
+                                args.count)
+            full_stamp = measure(lambda: image.watermark_text(TEXT, COLOR, font, args.font_size, POSITION,
+                                                              stamp=True), args.count)
+
+    print(f"{args.count} images of {args.width}x{args.height}, font size {args.font_size}")
+    print(f"{'':<16}{'draw (ms)':>12}{'stamp (ms)':>12}{'speedup':>10}")
+    for name, draw, stamp in (("overlay", overlay_draw, overlay_stamp), ("watermark_text", full_draw, full_stamp)):
+        print(f"{name:<16}{draw * 1000:>12.2f}{stamp * 1000:>12.2f}{draw / stamp:>9.1f}x")
+
+
+if __name__ == "__main__":
+    main()
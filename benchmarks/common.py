@@ -0,0 +1,85 @@
+"""Shared helpers of the benchmarks: import path, synthetic images and timing."""
+import os
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "src", "main", "python")))
+
+from PIL import Image, ImageDraw, ImageFont
+
+
+FONT_CANDIDATES = ("arial.ttf", "DejaVuSans.ttf", "Arial.ttf", "LiberationSans-Regular.ttf")
+
+
+def default_font():
+    """Get the first font file PIL can find on this machine.
+
+    :return: The font file name.
+    :rtype: str
+    """
+    for font in FONT_CANDIDATES:
+        try:
+            ImageFont.truetype(font, 10)
+            return font
+        except OSError:
+            continue
+    raise OSError(f"None of the fonts {FONT_CANDIDATES} were found, use --font.")
+
+
+def make_photo(path, size, fmt):
+    """Write a synthetic photo: a gradient with noise, which compresses like a real picture.
+
+    :param path: The path of the image file.
+    :param size: The size of the image.
+    :param fmt: The format of the image, JPEG or PNG.
+    :type path: str
+    :type size: (int, int)
+    :type fmt: str
+
+    :return: The path of the image file.
+    :rtype: str
+    """
+    gradient = Image.linear_gradient("L").resize(size)
+    noise = Image.effect_noise(size, 32)
+    image = Image.merge("RGB", (gradient, noise, gradient.transpose(Image.FLIP_LEFT_RIGHT)))
+    image.save(path, fmt, **({"quality": 90} if fmt == "JPEG" else {}))
+    return path
+
+
+def make_logo(path, size=(400, 200), alpha=True):
+    """Write a synthetic logo, with a transparent background or not.
+
+    :param path: The path of the logo file.
+    :param size: The size of the logo.
+    :param alpha: True for a PNG logo with transparency, False for an opaque JPEG logo.
+    :type path: str
+    :type size: (int, int)
+    :type alpha: bool
+
+    :return: The path of the logo file.
+    :rtype: str
+    """
+    logo = Image.new("RGBA" if alpha else "RGB", size, (0, 0, 0, 0) if alpha else (255, 255, 255))
+    ImageDraw.Draw(logo).ellipse((0, 0) + size, fill=(30, 90, 200, 180) if alpha else (30, 90, 200))
+    logo.save(path, "PNG" if alpha else "JPEG")
+    return path
+
+
+def measure(function, repeat):
+    """Run a function several times and get its median duration.
+
+    :param function: The function to time.
+    :param repeat: The number of runs.
+    :type function: callable
+    :type repeat: int
+
+    :return: The median duration in seconds.
+    :rtype: float
+    """
+    durations = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        durations.append(time.perf_counter() - start)
+    return statistics.median(durations)
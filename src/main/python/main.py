@@ -1,18 +1,49 @@
+import time
+
+START = time.perf_counter()
+
 from fbs_runtime.application_context import cached_property
 from fbs_runtime.application_context.PySide2 import ApplicationContext
-from PySide2 import QtGui
+from PySide2 import QtGui, QtWidgets
 
+import multiprocessing
 import sys
 
 from package.main_window import MainWindow
+from package.startup import StartupTimer, startup_timing_enabled
+
+IMPORTED = time.perf_counter()
 
 
 class AppContext(ApplicationContext):
     def run(self):
+        timer = None
+        if startup_timing_enabled():
+            timer = StartupTimer(START, until=("first_paint", "fonts_loaded"))
+            timer.marks["imports"] = IMPORTED - START
+            timer.mark("context")
+            timer.finished.connect(self.app.quit)
+
         main_window = MainWindow(ctx=self)
         main_window.resize(int(1920 / 4), int(1080 / 2))
+        if timer is not None:
+            timer.mark("window")
+            timer.watch(main_window)
+            main_window.fonts_loaded.connect(lambda: timer.mark("fonts_loaded"))
         main_window.show()
-        return self.app.exec_()
+        code = self.app.exec_()
+        if timer is not None:
+            timer.report()
+        return code
+
+    @cached_property
+    def stylesheet(self):
+        with open(self.get_resource("style.css"), "r") as f:
+            return f.read()
+
+    @cached_property
+    def img_folder(self):
+        return QtGui.QIcon(self.get_resource('images/folder.svg'))
 
     @cached_property
     def img_checked(self):
@@ -22,7 +53,12 @@ class AppContext(ApplicationContext):
     def img_unchecked(self):
         return QtGui.QIcon(self.get_resource('images/unchecked.png'))
 
+    @cached_property
+    def img_failed(self):
+        return self.app.style().standardIcon(QtWidgets.QStyle.SP_MessageBoxCritical)
+
 
 if __name__ == '__main__':
+    multiprocessing.freeze_support()
     appctxt = AppContext()
     sys.exit(appctxt.run())
@@ -0,0 +1,322 @@
+import collections
+import contextlib
+import functools
+import io
+import multiprocessing
+import os
+import queue
+import threading
+
+from package.api import encoding, instrumentation
+from package.api.image import CustomImage
+from package.api.manifest import ManifestStore, fingerprint
+from package.api.scheduler import MemoryScheduler, image_footprint
+from package.api.stamp import TILE_ANGLE, TILE_OPACITY
+
+
+_CANCELLED = object()
+
+
+JobResult = collections.namedtuple("JobResult", ("path", "success", "output_path", "skipped", "error",
+                                                "encode_time", "bytes_written", "peak_memory", "stats", "profile",
+                                                "data", "output_paths"),
+                                   defaults=(None, False, None, 0.0, 0, 0, None, None, None, None))
+JobResult.__doc__ = """The result of a watermark job.
+
+    Attributes:
+        **path** *(str)*: The path of the source image.
+
+        **success** *(bool)*: True if the image was watermarked, False if the job raised an exception.
+
+        **output_path** *(str)*: The path of the watermarked image, of the first rendition if there are several.
+
+        **skipped** *(bool)*: True if the output was already up to date.
+
+        **error** *(str)*: The error raised by the job.
+
+        **encode_time** *(float)*: The time spent to encode the watermarked images, in seconds.
+
+        **bytes_written** *(int)*: The size of the watermarked image files.
+
+        **peak_memory** *(int)*: The estimated peak memory of the pixel buffers of the job, in bytes.
+
+        **stats** *(dict)*: The stages timings and the bytes read and written by the job.
+
+        **profile** *(str)*: The cProfile and tracemalloc report of the job, if it was profiled.
+
+        **data** *(list)*: The output paths and the encoded watermarked images, one per rendition,
+        when the job was given the encoded source and the images are not written yet.
+
+        **output_paths** *(list)*: The paths of the watermarked images, one per rendition.
+    """
+
+
+def process_image(path, folder="output", margin=25, wt_type="text", pos="bottom right",
+                  text=None, font=None, size=None, color=None, logo=None, stamp=False, encoder=None, profile=False,
+                  angle=TILE_ANGLE, opacity=TILE_OPACITY, data=None, renditions=None, stream=False, layers=None,
+                  patch_jpeg=False):
+    """Watermark a single image.
+    This function is executed in the worker processes of the pool, it must stay at module level to be picklable.
+    When the encoded source is given, nothing is read nor written: the watermarked image is returned encoded
+    in the result, with the path it should be written to.
+
+    :param path: The path of the image file.
+    :param folder: The name of the output folder.
+    :param margin: The margin between the image border and the watermark.
+    :param wt_type: The type of the watermark ("text", "image" or "layers").
+    :param pos: The position name of the watermark.
+    :param text: The text of the watermark.
+    :param font: The font family, file name or path of the watermark.
+    :param size: The font size of the watermark.
+    :param color: The color of the watermark.
+    :param logo: The path of the image watermark.
+    :param stamp: True to paste a watermark pre-rendered once per image size.
+    :param encoder: The settings of the output encoding.
+    :param profile: True to profile the job with cProfile and tracemalloc.
+    :param angle: The rotation of the tiled watermark, in degrees.
+    :param opacity: The opacity of the tiled watermark, between 0 and 1.
+    :param data: The encoded source image, already read.
+    :param renditions: The output sizes of the image, written from a single decode, a single full size output if None.
+    :param stream: True to watermark the uncompressed sources band by band, without decoding them entirely.
+        Ignored when the encoded source is given.
+    :param layers: The watermark layers of the "layers" type, applied in a single pass.
+    :param patch_jpeg: True to re-encode only the blocks under the watermark of the JPEG sources, with jpegtran.
+        Ignored when the encoded source is given.
+    :type path: str
+    :type folder: str
+    :type margin: int
+    :type wt_type: str
+    :type pos: str
+    :type text: str
+    :type font: str
+    :type size: int
+    :type color: str
+    :type logo: str
+    :type stamp: bool
+    :type encoder: EncoderSettings
+    :type profile: bool
+    :type angle: float
+    :type opacity: float
+    :type data: bytes
+    :type renditions: list
+    :type stream: bool
+    :type layers: list
+    :type patch_jpeg: bool
+
+    :return: The result of the job.
+    :rtype: JobResult
+    """
+    with instrumentation.profile() if profile else contextlib.nullcontext({}) as report:
+        with CustomImage(path if data is None else data, margin=margin, folder=folder, encoder=encoder,
+                         renditions=renditions, stream=stream, patch_jpeg=patch_jpeg) as image:
+            if wt_type == "text":
+                result = image.watermark_text(text, color, font, size, pos, stamp=stamp,
+                                              angle=angle, opacity=opacity)
+            elif wt_type == "image":
+                result = image.watermark_image(logo, pos, stamp=stamp, angle=angle, opacity=opacity)
+            elif wt_type == "layers":
+                result = image.watermark_layers(layers)
+            else:
+                raise ValueError(f"Unknown watermark type : {wt_type}")
+    results = result if renditions else [result]
+    outputs = []
+    for rendition, result in zip(renditions or [None], results):
+        output_path = result.output
+        if isinstance(output_path, io.BytesIO):
+            root, ext = os.path.splitext(os.path.join(os.path.dirname(path), folder, os.path.basename(path)))
+            output_path = encoding.output_path_for(root + (rendition.suffix if rendition else "") + ext,
+                                                   result.format)
+        outputs.append((output_path, result))
+    data = [(output_path, result.data) for output_path, result in outputs] if data is not None else None
+    return JobResult(path, True, outputs[0][0], data=data,
+                     output_paths=[output_path for output_path, _ in outputs],
+                     encode_time=sum(result.encode_time for result in results),
+                     bytes_written=sum(result.bytes_written for result in results), peak_memory=image.peak_memory,
+                     stats=image.recorder.to_dict(), profile=f"{path}\n{report['text']}" if report else None)
+
+
+class BatchProcessor:
+    """The BatchProcessor class spreads the watermark jobs over a pool of processes.
+
+    Attributes:
+        **workers** *(int)*: The number of worker processes.
+
+        **incremental** *(bool)*: True to skip the images whose output is up to date.
+
+        **skipped** *(int)*: The number of images skipped by the last run.
+
+        **collector** *(StatsCollector)*: The aggregator of the jobs statistics.
+
+        **profile_every** *(int)*: Profile one job every this number of jobs, never if 0.
+
+        **scheduler** *(MemoryScheduler)*: The admission of the jobs under the memory budget.
+    """
+
+    def __init__(self, workers=None, max_pending=None, incremental=True, collector=None, profile_every=0,
+                 memory_budget=None):
+        """The constructor of the batch processor.
+
+        :param workers: The number of worker processes, the number of CPUs if None.
+        :param max_pending: The maximum number of jobs submitted and not finished yet, 4 per worker if None.
+        :param incremental: True to skip the images recorded in the manifest of their output folder
+            with the same size, modification time and watermark configuration.
+        :type workers: int
+        :type max_pending: int
+        :param collector: The aggregator of the jobs statistics.
+        :param profile_every: Profile one job every this number of jobs, never if 0.
+        :param memory_budget: The maximum estimated memory of the decoded pixels of the jobs in progress,
+            in bytes, no limit if None. The footprint of a job is estimated from the header of its image.
+        :type incremental: bool
+        :type collector: StatsCollector
+        :type profile_every: int
+        :type memory_budget: int
+        """
+        self.workers = workers or os.cpu_count() or 1
+        self.max_pending = max_pending or self.workers * 4
+        self.incremental = incremental
+        self.skipped = 0
+        self.collector = collector
+        self.profile_every = profile_every
+        self.scheduler = MemoryScheduler(memory_budget)
+        self._pool = None
+        self._results = None
+        self._lock = threading.Lock()
+        self._cancelled = threading.Event()
+
+    @property
+    def cancelled(self):
+        """True if the batch has been cancelled."""
+        return self._cancelled.is_set()
+
+    def run(self, paths, **options):
+        """Watermark the images and yield the results as soon as they are finished.
+        The paths are consumed lazily, so they can come from a generator of any length.
+        The options are the keyword arguments of :func:`process_image`.
+
+        :param paths: The paths of the image files.
+        :type paths: iterable
+
+        :return: A generator of the results in completion order.
+        :rtype: generator
+        """
+        paths = iter(paths)
+        results = queue.Queue()
+        self.skipped = 0
+        self.scheduler = scheduler = MemoryScheduler(self.scheduler.budget)
+        config = fingerprint(options)
+        manifests = ManifestStore(options.get("folder", "output")) if self.incremental else None
+        with self._lock:
+            if self.cancelled:
+                return
+            self._results = results
+            self._pool = multiprocessing.Pool(processes=self.workers)
+
+        pending = 0
+        submitted = 0
+        exhausted = False
+        waiting = None
+        try:
+            while True:
+                while not exhausted and pending < self.max_pending:
+                    if waiting is None:
+                        path = next(paths, None)
+                        if path is None:
+                            exhausted = True
+                            break
+                        if manifests is not None and manifests.get(path).is_up_to_date(path, config):
+                            self.skipped += 1
+                            yield JobResult(path, True, skipped=True)
+                            continue
+                        footprint = image_footprint(path, **options) if scheduler.budget is not None else 0
+                        waiting = (path, footprint)
+                    path, footprint = waiting
+                    if not scheduler.try_acquire(footprint):
+                        break
+                    waiting = None
+                    profile = bool(self.profile_every) and submitted % self.profile_every == 0
+                    with self._lock:
+                        if self.cancelled:
+                            return
+                        self._pool.apply_async(process_image, (path,), dict(options, profile=profile),
+                                               callback=functools.partial(self._job_done, scheduler, results, footprint),
+                                               error_callback=functools.partial(self._job_failed, scheduler,
+                                                                                results, footprint, path))
+                    pending += 1
+                    submitted += 1
+
+                if not pending:
+                    break
+                result = results.get()
+                if result is _CANCELLED:
+                    break
+                pending -= 1
+                if manifests is not None and result.success:
+                    manifests.get(result.path).record(result.path, config, result.output_paths)
+                if self.collector is not None and result.stats is not None:
+                    self.collector.add(result.stats, result.profile)
+                yield result
+        finally:
+            self._shutdown(terminate=bool(pending) or not exhausted)
+            if manifests is not None:
+                manifests.close()
+
+    def cancel(self):
+        """Cancel the batch.
+        The pending jobs are dropped and the worker processes are terminated, so the jobs in flight stop too.
+        """
+        with self._lock:
+            self._cancelled.set()
+            if self._pool is not None:
+                self._pool.terminate()
+            if self._results is not None:
+                self._results.put(_CANCELLED)
+
+    def _shutdown(self, terminate=False):
+        """Release the pool once the batch is over.
+
+        :param terminate: True to kill the jobs still running.
+        :type terminate: bool
+        """
+        with self._lock:
+            pool, self._pool, self._results = self._pool, None, None
+        if pool is None:
+            return
+        if terminate:
+            pool.terminate()
+        else:
+            pool.close()
+        pool.join()
+
+    @staticmethod
+    def _job_done(scheduler, results, footprint, result):
+        """Release the memory of a finished job and report its result.
+
+        :param scheduler: The scheduler which admitted the job.
+        :param results: The queue of the results.
+        :param footprint: The estimated memory of the job.
+        :param result: The result of the job.
+        :type scheduler: MemoryScheduler
+        :type results: queue.Queue
+        :type footprint: int
+        :type result: JobResult
+        """
+        scheduler.release(footprint)
+        results.put(result)
+
+    @staticmethod
+    def _job_failed(scheduler, results, footprint, path, error):
+        """Release the memory of a job which raised an exception and report it as a failure.
+
+        :param scheduler: The scheduler which admitted the job.
+        :param results: The queue of the results.
+        :param footprint: The estimated memory of the job.
+        :param path: The path of the image file.
+        :param error: The exception raised by the job.
+        :type scheduler: MemoryScheduler
+        :type results: queue.Queue
+        :type footprint: int
+        :type path: str
+        :type error: Exception
+        """
+        scheduler.release(footprint)
+        results.put(JobResult(path, False, error=str(error)))
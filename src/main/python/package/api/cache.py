@@ -0,0 +1,166 @@
+import collections
+import os
+import threading
+
+from PIL import Image, ImageDraw, ImageFont
+
+from package.api.fonts import find_font
+
+
+class LRUCache:
+    """The LRUCache class implements a thread-safe mapping with least recently used eviction.
+
+    Attributes:
+        **maxsize** *(int)*: The maximum number of entries kept in the cache.
+
+        **hits** *(int)*: The number of lookups served from the cache.
+
+        **misses** *(int)*: The number of lookups which had to build the value.
+    """
+
+    def __init__(self, maxsize=32):
+        """The constructor of the cache.
+
+        :param maxsize: The maximum number of entries kept in the cache.
+        :type maxsize: int
+        """
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._data = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._data)
+
+    def get(self, key, factory):
+        """Get the value of a key, build it with the factory on a miss.
+
+        :param key: The key of the value.
+        :param factory: The callable building the value.
+        :type key: tuple
+        :type factory: callable
+
+        :return: The cached value.
+        """
+        with self._lock:
+            if key in self._data:
+                self._data.move_to_end(key)
+                self.hits += 1
+                return self._data[key]
+            self.misses += 1
+
+        value = factory()
+        with self._lock:
+            self._data[key] = value
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+        return value
+
+    def clear(self):
+        """Remove all the entries and reset the counters."""
+        with self._lock:
+            self._data.clear()
+            self.hits = 0
+            self.misses = 0
+
+    def info(self):
+        """Get the statistics of the cache.
+
+        :return: The hits, misses, current size and maximum size of the cache.
+        :rtype: dict
+        """
+        with self._lock:
+            return {"hits": self.hits, "misses": self.misses, "size": len(self._data), "maxsize": self.maxsize}
+
+
+FONTS = LRUCache(maxsize=16)
+LOGOS = LRUCache(maxsize=8)
+TEXT_LAYERS = LRUCache(maxsize=32)
+STAMPS = LRUCache(maxsize=64)
+TILES = LRUCache(maxsize=4)
+
+
+def get_font(font_type, font_size):
+    """Get a parsed font, loaded once per font and size.
+    The families and file names are resolved with the font index, without probing the file system.
+
+    :param font_type: A family name, a file name or the path of the font file.
+    :param font_size: The size of the font.
+    :type font_type: str
+    :type font_size: int
+
+    :return: The font object from PIL.
+    :rtype: ImageFont.FreeTypeFont
+    """
+    return FONTS.get((font_type, font_size), lambda: ImageFont.truetype(find_font(font_type), font_size))
+
+
+def get_logo(watermark_path, scale=1.0):
+    """Get a decoded image watermark, decoded again only when the file is modified.
+    The scaled watermarks are resized from the decoded one, once per scale.
+    The returned image is shared, it must not be modified.
+
+    :param watermark_path: The path of the image watermark.
+    :param scale: The scale of the watermark, 1 for its original size.
+    :type watermark_path: str
+    :type scale: float
+
+    :return: The decoded image watermark.
+    :rtype: Image
+    """
+    def load():
+        if scale != 1:
+            logo = get_logo(watermark_path)
+            return logo.resize((max(1, round(logo.width * scale)), max(1, round(logo.height * scale))),
+                               Image.LANCZOS)
+        logo = Image.open(watermark_path)
+        logo.load()
+        return logo
+
+    return LOGOS.get((watermark_path, os.path.getmtime(watermark_path), scale), load)
+
+
+def get_text_layer(text, color, font_type, font_size):
+    """Get the text rendered once on a transparent layer.
+    The returned image is shared, it must not be modified.
+
+    :param text: The text to render.
+    :param color: The color of the text.
+    :param font_type: The path of the font file.
+    :param font_size: The size of the font.
+    :type text: str
+    :type color: (int, int, int)
+    :type font_type: str
+    :type font_size: int
+
+    :return: The RGBA layer holding the rendered text.
+    :rtype: Image
+    """
+    def render():
+        font = get_font(font_type, font_size)
+        size = ImageDraw.Draw(Image.new("L", (1, 1))).textsize(text, font)
+        mask = Image.new("L", size, 0)
+        ImageDraw.Draw(mask).text((0, 0), text, fill=255, font=font)
+        layer = Image.new("RGBA", size, color)
+        layer.putalpha(mask)
+        return layer
+
+    return TEXT_LAYERS.get((text, color, font_type, font_size), render)
+
+
+def cache_info():
+    """Get the statistics of the asset caches of the process.
+
+    :return: The statistics of the fonts, logos, text layers, stamps and tiled stamps caches.
+    :rtype: dict
+    """
+    return {"fonts": FONTS.info(), "logos": LOGOS.info(), "text_layers": TEXT_LAYERS.info(), "stamps": STAMPS.info(),
+            "tiles": TILES.info()}
+
+
+def clear_caches():
+    """Empty the asset caches of the process."""
+    for cache in (FONTS, LOGOS, TEXT_LAYERS, STAMPS, TILES):
+        cache.clear()
@@ -0,0 +1,180 @@
+import os
+import time
+
+from PIL import Image
+
+
+FORMAT_EXTENSIONS = {
+    "JPEG": (".jpg", ".jpeg", ".jpe"),
+    "PNG": (".png",),
+    "WEBP": (".webp",),
+    "TIFF": (".tif", ".tiff"),
+    "BMP": (".bmp",),
+    "GIF": (".gif",),
+}
+
+METADATA_FORMATS = ("JPEG", "PNG", "WEBP")
+
+ALPHA_FORMATS = ("PNG", "WEBP", "TIFF", "GIF")
+
+QUALITY_FORMATS = ("JPEG", "WEBP")
+
+
+class EncoderSettings:
+    """The EncoderSettings class describes how the watermarked images are encoded.
+
+    Attributes:
+        **format** *(str)*: The output format, None to keep the format of the source.
+
+        **options** *(dict)*: The save options of PIL per format, e.g. ``{"JPEG": {"quality": 90}}``.
+
+        **keep_exif** *(bool)*: True to copy the EXIF data of the source.
+
+        **keep_icc** *(bool)*: True to copy the ICC profile of the source.
+    """
+
+    def __init__(self, format=None, options=None, keep_exif=True, keep_icc=True):
+        """The constructor of the encoder settings.
+
+        :param format: The output format, None to keep the format of the source.
+        :param options: The save options of PIL per format.
+        :param keep_exif: True to copy the EXIF data of the source.
+        :param keep_icc: True to copy the ICC profile of the source.
+        :type format: str
+        :type options: dict
+        :type keep_exif: bool
+        :type keep_icc: bool
+        """
+        self.format = format.upper() if format else None
+        self.options = {fmt.upper(): dict(opts) for fmt, opts in (options or {}).items()}
+        self.keep_exif = keep_exif
+        self.keep_icc = keep_icc
+
+    def __repr__(self):
+        options = {fmt: dict(sorted(opts.items())) for fmt, opts in sorted(self.options.items())}
+        return (f"EncoderSettings(format={self.format!r}, options={options!r}, "
+                f"keep_exif={self.keep_exif!r}, keep_icc={self.keep_icc!r})")
+
+    def to_dict(self):
+        """Get the settings as the keyword arguments of the constructor.
+
+        :return: The format, the save options and the metadata flags.
+        :rtype: dict
+        """
+        return {"format": self.format, "options": {fmt: dict(opts) for fmt, opts in self.options.items()},
+                "keep_exif": self.keep_exif, "keep_icc": self.keep_icc}
+
+    def derive(self, format=None, quality=None):
+        """Get a copy of the settings with another output format or quality.
+
+        :param format: The output format, the format of these settings if None.
+        :param quality: The JPEG and WEBP quality, the quality of these settings if None.
+        :type format: str
+        :type quality: int
+
+        :return: The new settings.
+        :rtype: EncoderSettings
+        """
+        settings = self.to_dict()
+        if format:
+            settings["format"] = format
+        if quality is not None:
+            for fmt in QUALITY_FORMATS:
+                settings["options"].setdefault(fmt, {})["quality"] = quality
+        return EncoderSettings(**settings)
+
+    def output_format(self, source_format):
+        """Get the format of the watermarked image.
+
+        :param source_format: The format of the source image.
+        :type source_format: str
+
+        :return: The output format.
+        :rtype: str
+        """
+        return self.format or source_format or "PNG"
+
+    def save_options(self, fmt, info):
+        """Get the keyword arguments of :meth:`Image.save` for a format.
+
+        :param fmt: The output format.
+        :param info: The metadata of the source image.
+        :type fmt: str
+        :type info: dict
+
+        :return: The save options.
+        :rtype: dict
+        """
+        options = dict(self.options.get(fmt, {}))
+        if fmt in METADATA_FORMATS:
+            if self.keep_exif and info.get("exif"):
+                options.setdefault("exif", info["exif"])
+            if self.keep_icc and info.get("icc_profile"):
+                options.setdefault("icc_profile", info["icc_profile"])
+        return options
+
+
+def output_path_for(path, fmt):
+    """Change the extension of a path when it does not match the format.
+
+    :param path: The path of the output file.
+    :param fmt: The output format.
+    :type path: str
+    :type fmt: str
+
+    :return: The path with an extension of the format.
+    :rtype: str
+    """
+    root, ext = os.path.splitext(path)
+    extensions = FORMAT_EXTENSIONS.get(fmt)
+    if not extensions or ext.lower() in extensions:
+        return path
+    return root + extensions[0]
+
+
+def flatten(image, fmt):
+    """Convert an image to a mode the format can store.
+    The transparent areas are flattened on a white background for the formats without alpha.
+
+    :param image: The image to convert.
+    :param fmt: The output format.
+    :type image: Image
+    :type fmt: str
+
+    :return: The converted image.
+    :rtype: Image
+    """
+    if fmt in ALPHA_FORMATS:
+        return image
+    if image.mode == "P":
+        image = image.convert("RGBA")
+    if image.mode in ("RGBA", "LA"):
+        background = Image.new("RGB", image.size, (255, 255, 255))
+        background.paste(image, mask=image.getchannel("A"))
+        return background
+    if fmt == "JPEG" and image.mode not in ("RGB", "L", "CMYK"):
+        return image.convert("RGB")
+    return image
+
+
+def write(image, path, fmt, settings, info):
+    """Encode an image and write it.
+
+    :param image: The image to save.
+    :param path: The path of the output file, or a binary file object.
+    :param fmt: The output format.
+    :param settings: The encoder settings.
+    :param info: The metadata of the source image.
+    :type image: Image
+    :type path: str or file
+    :type fmt: str
+    :type settings: EncoderSettings
+    :type info: dict
+
+    :return: The encode time in seconds and the number of bytes written.
+    :rtype: (float, int)
+    """
+    start = time.perf_counter()
+    flatten(image, fmt).save(path, fmt, **settings.save_options(fmt, info))
+    elapsed = time.perf_counter() - start
+    return elapsed, os.path.getsize(path) if isinstance(path, (str, os.PathLike)) else path.tell()
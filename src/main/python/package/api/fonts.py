@@ -0,0 +1,311 @@
+import json
+import os
+import sys
+import tempfile
+import threading
+
+
+FONT_EXTENSIONS = (".ttf", ".otf", ".ttc", ".otc")
+
+FONT_INDEX_VERSION = 1
+
+REGULAR_STYLES = ("regular", "book", "roman", "normal", "medium")
+
+DEFAULT_FAMILIES = ("Arial", "Helvetica", "Segoe UI", "DejaVu Sans", "Liberation Sans", "Noto Sans")
+
+
+def font_dirs():
+    """Get the font directories of the platform, the per-user directories included.
+
+    :return: The existing font directories.
+    :rtype: list
+    """
+    home = os.path.expanduser("~")
+    if sys.platform == "win32":
+        dirs = [os.path.join(os.environ.get("WINDIR", r"C:\Windows"), "Fonts"),
+                os.path.join(os.environ.get("LOCALAPPDATA", home), "Microsoft", "Windows", "Fonts")]
+    elif sys.platform == "darwin":
+        dirs = ["/System/Library/Fonts", "/Library/Fonts", os.path.join(home, "Library", "Fonts")]
+    else:
+        data_home = os.environ.get("XDG_DATA_HOME") or os.path.join(home, ".local", "share")
+        data_dirs = (os.environ.get("XDG_DATA_DIRS") or "/usr/local/share:/usr/share").split(os.pathsep)
+        dirs = [os.path.join(home, ".fonts"), os.path.join(data_home, "fonts")]
+        dirs += [os.path.join(data_dir, "fonts") for data_dir in data_dirs if data_dir]
+    unique = []
+    for folder in dirs:
+        if os.path.isdir(folder) and folder not in unique:
+            unique.append(folder)
+    return unique
+
+
+def user_cache_dir():
+    """Get the cache directory of the application for the user.
+
+    :return: The path of the directory, it may not exist yet.
+    :rtype: str
+    """
+    if sys.platform == "win32":
+        cache = os.environ.get("LOCALAPPDATA") or os.path.expanduser("~")
+    else:
+        cache = os.environ.get("XDG_CACHE_HOME") or os.path.join(os.path.expanduser("~"), ".cache")
+    return os.path.join(cache, "pywatermark")
+
+
+def default_index_path():
+    """Get the path of the font index file in the cache directory of the user.
+
+    :return: The path of the index file.
+    :rtype: str
+    """
+    return os.path.join(user_cache_dir(), "fonts.json")
+
+
+def font_names(path):
+    """Read the family and style names of a font file.
+    Only the first face of the font collections is read.
+
+    :param path: The path of the font file.
+    :type path: str
+
+    :return: The family and style names, None if the file is not a readable font.
+    :rtype: (str, str)
+    """
+    # Imported here: loading a persisted index must not pay for the import of PIL at startup.
+    from PIL import ImageFont
+
+    try:
+        return ImageFont.truetype(path, 12).getname()
+    except (OSError, ValueError):
+        return None
+
+
+class FontIndex:
+    """The FontIndex class maps the font families and file names to the font files of the system.
+    The directories are scanned once and the index is persisted, it is scanned again only when
+    the modification time of a directory changes, and only the new or modified files are parsed.
+
+    Attributes:
+        **path** *(str)*: The path of the index file, nothing is persisted if None.
+
+        **dirs** *(list)*: The scanned font directories.
+
+        **fonts** *(dict)*: The modification time, size, family and style of each font file.
+    """
+
+    def __init__(self, path=None, dirs=None):
+        """The constructor of the index, the index is loaded by :meth:`load`.
+
+        :param path: The path of the index file, nothing is persisted if None.
+        :param dirs: The font directories, those of the platform if None.
+        :type path: str
+        :type dirs: list
+        """
+        self.path = path
+        self.dirs = font_dirs() if dirs is None else list(dirs)
+        self.fonts = {}
+        self._mtimes = {}
+        self._families = {}
+        self._files = {}
+
+    def load(self):
+        """Load the persisted index, scan again the directories modified since it was saved.
+
+        :return: The index itself.
+        :rtype: FontIndex
+        """
+        data = {}
+        if self.path is not None:
+            try:
+                with open(self.path, "r", encoding="utf-8") as f:
+                    data = json.load(f)
+            except (OSError, ValueError):
+                data = {}
+        if data.get("version") != FONT_INDEX_VERSION:
+            data = {}
+        self.fonts = data.get("fonts", {})
+        self._mtimes = data.get("dirs", {})
+
+        if (not self.fonts or data.get("roots") != self.dirs
+                or any(_mtime(folder) != mtime for folder, mtime in self._mtimes.items())):
+            self.scan()
+            self.save()
+        else:
+            self._build()
+        return self
+
+    def scan(self):
+        """Walk the font directories and parse the font files not indexed with the same modification time and size."""
+        fonts = {}
+        mtimes = {}
+        for root in self.dirs:
+            for folder, _, file_names in os.walk(root):
+                mtimes[folder] = _mtime(folder)
+                for file_name in file_names:
+                    if not file_name.lower().endswith(FONT_EXTENSIONS):
+                        continue
+                    path = os.path.join(folder, file_name)
+                    try:
+                        stat = os.stat(path)
+                    except OSError:
+                        continue
+                    known = self.fonts.get(path)
+                    if known is not None and known[:2] == [stat.st_mtime_ns, stat.st_size]:
+                        fonts[path] = known
+                        continue
+                    names = font_names(path)
+                    if names is not None:
+                        fonts[path] = [stat.st_mtime_ns, stat.st_size, names[0], names[1]]
+        self.fonts = fonts
+        self._mtimes = mtimes
+        self._build()
+
+    def save(self):
+        """Persist the index, through a temporary file renamed once complete."""
+        if self.path is None:
+            return
+        data = {"version": FONT_INDEX_VERSION, "roots": self.dirs, "dirs": self._mtimes, "fonts": self.fonts}
+        folder = os.path.dirname(self.path)
+        try:
+            os.makedirs(folder, exist_ok=True)
+            fd, temp_path = tempfile.mkstemp(dir=folder, prefix=".", suffix=".tmp")
+            with os.fdopen(fd, "w", encoding="utf-8") as f:
+                json.dump(data, f)
+            os.replace(temp_path, self.path)
+        except OSError:
+            # A read-only cache only costs a scan at the next start.
+            pass
+
+    def families(self):
+        """Get the font families of the index.
+
+        :return: The sorted family names.
+        :rtype: list
+        """
+        return sorted({family for family, _ in self._families.values()}, key=str.lower)
+
+    def default_family(self, preferred=DEFAULT_FAMILIES):
+        """Get a font family installed on every platform if possible, for the watermarks without a font.
+
+        :param preferred: The families to look for first, in order.
+        :type preferred: tuple
+
+        :return: The first preferred family in the index, else the first family, None if the index is empty.
+        :rtype: str
+        """
+        for family in preferred:
+            if family.lower() in self._families:
+                return self._families[family.lower()][0]
+        families = self.families()
+        return families[0] if families else None
+
+    def styles(self, family):
+        """Get the styles of a font family.
+
+        :param family: The family name, case insensitive.
+        :type family: str
+
+        :return: The sorted style names, empty if the family is unknown.
+        :rtype: list
+        """
+        _, styles = self._families.get(family.lower(), (None, {}))
+        return sorted(name for name, _ in styles.values())
+
+    def resolve(self, font, style=None):
+        """Get the font file of a family, a file name or a path.
+        The paths and the file names missing from the index are returned unchanged if the file exists.
+
+        :param font: A family name like "DejaVu Sans", a file name like "arial.ttf" or a path.
+        :param style: The style of the family, the regular style if None.
+        :type font: str
+        :type style: str
+
+        :return: The path of the font file.
+        :rtype: str
+
+        :raise OSError: The family is not in the index or the font file does not exist.
+        """
+        key = font.lower()
+        if not os.path.dirname(font) and key in self._files:
+            return self._files[key]
+        if os.path.dirname(font) or key.endswith(FONT_EXTENSIONS):
+            if not os.path.isfile(font):
+                raise OSError(f"The font file {font} does not exist")
+            return font
+
+        family = self._families.get(key)
+        if family is None:
+            raise OSError(f"The font {font} is not installed")
+        _, styles = family
+        for name in ((style,) if style else ()) + REGULAR_STYLES:
+            if name and name.lower() in styles:
+                return styles[name.lower()][1]
+        return styles[min(styles)][1]
+
+    def _build(self):
+        """Build the lookup tables of the families and file names from the indexed fonts."""
+        families = {}
+        files = {}
+        for path in sorted(self.fonts):
+            _, _, family, style = self.fonts[path]
+            _, styles = families.setdefault(family.lower(), (family, {}))
+            styles.setdefault(style.lower(), (style, path))
+            files.setdefault(os.path.basename(path).lower(), path)
+        self._families = families
+        self._files = files
+
+
+def _mtime(folder):
+    """Get the modification time of a directory.
+
+    :param folder: The path of the directory.
+    :type folder: str
+
+    :return: The modification time in nanoseconds, None if the directory does not exist anymore.
+    :rtype: int
+    """
+    try:
+        return os.stat(folder).st_mtime_ns
+    except OSError:
+        return None
+
+
+_INDEX = None
+_INDEX_LOCK = threading.Lock()
+
+
+def get_font_index():
+    """Get the font index of the process, loaded from the cache directory of the user on the first call.
+
+    :return: The shared font index.
+    :rtype: FontIndex
+    """
+    global _INDEX
+    with _INDEX_LOCK:
+        if _INDEX is None:
+            _INDEX = FontIndex(default_index_path()).load()
+        return _INDEX
+
+
+def default_family():
+    """Get the default font family from the font index of the process.
+
+    :return: The family name, None if no font is installed.
+    :rtype: str
+    """
+    return get_font_index().default_family()
+
+
+def find_font(font, style=None):
+    """Get the font file of a family, a file name or a path from the font index of the process.
+
+    :param font: A family name, a file name or a path.
+    :param style: The style of the family, the regular style if None.
+    :type font: str
+    :type style: str
+
+    :return: The path of the font file.
+    :rtype: str
+
+    :raise OSError: The family is not installed.
+    """
+    return get_font_index().resolve(font, style)
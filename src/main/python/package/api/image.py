@@ -1,131 +1,831 @@
+import collections
+import contextlib
+import io
+import math
 import os
+import time
 
-from PIL import Image, ImageDraw, ImageFont
+from PIL import Image, ImageDraw
 
+from package.api import encoding
+from package.api.cache import get_font, get_logo, get_text_layer
+from package.api.instrumentation import JobRecorder
+from package.api.jpeg import can_patch, patch_copy
+from package.api.position import TILED, watermark_position
+from package.api.stamp import (TILE_ANGLE, TILE_OPACITY, TiledStamp, layer_stamp, logo_stamp, scale_layer,
+                               text_stamp, tiled_logo_stamp, tiled_text_stamp)
+from package.api.stream import can_stream, raw_tiles, stream_copy, stream_footprint, unbounded_pixels
 
-WATERMARK_POSITION = (
-    "top left",
-    "top right",
-    "center",
-    "bottom left",
-    "bottom right",
-)
+
+PREVIEW_REDUCTIONS = (1, 2, 4, 8)
+
+OUTPUT_FILE = "file"
+
+OUTPUT_BUFFER = "buffer"
+
+OUTPUT_IMAGE = "image"
+
+OUTPUTS = (OUTPUT_FILE, OUTPUT_BUFFER, OUTPUT_IMAGE)
+
+
+Rendition = collections.namedtuple("Rendition", ("max_size", "format", "quality", "suffix"),
+                                   defaults=(None, None, None, ""))
+Rendition.__doc__ = """An output size of the watermarked image.
+
+    Attributes:
+        **max_size** *(int)*: The maximum width and height of the rendition, the size of the source if None.
+        The images are never enlarged.
+
+        **format** *(str)*: The output format, the format of the encoder settings if None.
+
+        **quality** *(int)*: The JPEG and WEBP quality, the quality of the encoder settings if None.
+
+        **suffix** *(str)*: The suffix appended to the name of the output file, e.g. "_1024".
+    """
+
+
+def pixel_bytes(mode, size):
+    """Estimate the memory used by the pixels of an image.
+    PIL stores the pixels of the multi-band and 32-bit modes on 4 bytes.
+
+    :param mode: The mode of the image.
+    :param size: The size of the image.
+    :type mode: str
+    :type size: (int, int)
+
+    :return: The number of bytes of the pixel buffer.
+    :rtype: int
+    """
+    if mode in ("1", "L", "P"):
+        depth = 1
+    elif mode.startswith("I;16"):
+        depth = 2
+    else:
+        depth = 4
+    return size[0] * size[1] * depth
+
+
+def rendition_size(size, max_size):
+    """Compute the size of a rendition, which fits in a square keeping the aspect ratio of the image.
+
+    :param size: The size of the source image.
+    :param max_size: The maximum width and height, the size of the source if None.
+    :type size: (int, int)
+    :type max_size: int
+
+    :return: The size of the rendition.
+    :rtype: (int, int)
+    """
+    if max_size is None or max(size) <= max_size:
+        return tuple(size)
+    scale = max_size / max(size)
+    return max(1, round(size[0] * scale)), max(1, round(size[1] * scale))
+
+
+def reduced_copy(image, size):
+    """Copy an image at a reduced size, the source image is left unchanged.
+
+    :param image: The image to reduce.
+    :param size: The size of the copy.
+    :type image: Image
+    :type size: (int, int)
+
+    :return: The reduced copy.
+    :rtype: Image
+    """
+    if image.size != size:
+        return image.resize(size, Image.BILINEAR)
+    return image.copy()
+
+
+def source_size(source):
+    """Get the encoded size of an image source.
+
+    :param source: The path of the file, a binary file object or a PIL image.
+    :type source: str or file or Image
+
+    :return: The size in bytes, 0 for a PIL image which was not read from an encoded source.
+    :rtype: int
+    """
+    if isinstance(source, (str, os.PathLike)):
+        return os.path.getsize(source)
+    if isinstance(source, Image.Image):
+        return 0
+    position = source.tell()
+    size = source.seek(0, io.SEEK_END)
+    source.seek(position)
+    return size
+
+
+class WatermarkResult:
+    """The WatermarkResult class describes a watermarked image.
+    It is always true, the watermark operations raise an exception when they fail.
+
+    Attributes:
+        **output** *(str or io.BytesIO)*: The path of the watermarked image file, or the buffer holding it,
+        None if the image was not encoded.
+
+        **image** *(Image)*: The watermarked image, only when it was not encoded.
+
+        **format** *(str)*: The output format.
+
+        **encode_time** *(float)*: The time spent to encode the image, in seconds.
+
+        **bytes_written** *(int)*: The size of the encoded image.
+    """
+
+    def __init__(self, output=None, image=None, format=None, encode_time=0.0, bytes_written=0):
+        """The constructor of the result.
+
+        :param output: The path of the watermarked image file, or the buffer holding it.
+        :param image: The watermarked image, when it was not encoded.
+        :param format: The output format.
+        :param encode_time: The time spent to encode the image, in seconds.
+        :param bytes_written: The size of the encoded image.
+        :type output: str or io.BytesIO
+        :type image: Image
+        :type format: str
+        :type encode_time: float
+        :type bytes_written: int
+        """
+        self.output = output
+        self.image = image
+        self.format = format
+        self.encode_time = encode_time
+        self.bytes_written = bytes_written
+
+    def __bool__(self):
+        return True
+
+    def __repr__(self):
+        output = "<buffer>" if isinstance(self.output, io.BytesIO) else repr(self.output)
+        return (f"WatermarkResult(output={output}, format={self.format!r}, "
+                f"bytes_written={self.bytes_written!r})")
+
+    @property
+    def data(self):
+        """The encoded watermarked image, read from the file if it was written on disk.
+
+        :return: The encoded image, None if the image was not encoded.
+        :rtype: bytes
+        """
+        if isinstance(self.output, io.BytesIO):
+            return self.output.getvalue()
+        if self.output is not None:
+            with open(self.output, "rb") as f:
+                return f.read()
+        return None
 
 
 class CustomImage:
     """The CustomImage class implements the image watermark operation.
 
+    The source is opened lazily: the constructor only reads the header,
+    the pixels are decoded once on first use and shared by all the watermark operations.
+    Call :meth:`close` or use the object as a context manager to release the decoded pixels.
+
     Attributes:
-        **image** *(Image)*: The image object from PIL.
+        **image** *(Image)*: The decoded image object from PIL.
 
         **width** *(int)*: The width of the image.
 
         **height** *(int)*: The height of the image.
 
-        **path** *(str)*: The path of the image.
+        **path** *(str or file or Image)*: The path of the image, a binary file object holding it or a PIL image.
 
         **margin** *(int)*: The margin between the image border and the watermark.
 
-        **output_path** *(str)*: The path of the watermarked image.
+        **output** *(str)*: Where the watermarked images go, one of :data:`OUTPUTS`.
+
+        **output_path** *(str or io.BytesIO)*: The path of the watermarked image,
+        or the buffer holding the last watermarked image in the buffer output.
+
+        **format** *(str)*: The format of the source image.
+
+        **encoder** *(EncoderSettings)*: The settings of the output encoding.
+
+        **encode_time** *(float)*: The time spent to encode the last watermarked image, in seconds.
+
+        **bytes_written** *(int)*: The size of the last watermarked image file.
+
+        **peak_memory** *(int)*: The estimated peak memory of the pixel buffers allocated for the image, in bytes.
+
+        **recorder** *(JobRecorder)*: The timings of the stages of the watermark operations.
+
+        **renditions** *(list)*: The output sizes of the watermarked image, a single full size output if None.
+
+        **stream** *(bool)*: True to stream the sources stored without compression.
+
+        **streaming** *(bool)*: True if the image is streamed, see :meth:`stream_region`.
+
+        **patch_jpeg** *(bool)*: True to re-encode only the blocks under the watermark of the JPEG sources.
+
+        **patching** *(bool)*: True if the image is patched, see :meth:`patch_region`.
     """
 
-    def __init__(self, path, margin=25, folder="output"):
+    def __init__(self, path, margin=25, folder="output", encoder=None, recorder=None, output=None, renditions=None,
+                 stream=False, patch_jpeg=False):
         """The constructor of the custom image object.
 
-        :param path: The path of the image file.
+        :param path: The path of the image file, the encoded image, a binary file object holding it
+            or a PIL image. A PIL image is modified in place during the watermark operations then restored.
         :param margin: The margin between the image border and the watermark.
-        :param folder: The name of the output folder.
-        :type path: str
+        :param folder: The name of the output folder, used by the file output only.
+        :param encoder: The settings of the output encoding, the source format with the PIL defaults if None.
+        :param recorder: The recorder of the stages timings, a new one if None.
+        :param output: One of :data:`OUTPUTS`: write the watermarked images in the output folder,
+            encode them in memory or return them without encoding.
+            The file output for a path, the buffer output for the other sources if None.
+        :param renditions: The output sizes of the watermarked image. The watermark operations then return
+            a result per rendition, see :meth:`watermark_renditions`.
+        :param stream: True to watermark the uncompressed TIFF, PPM and BMP files band by band without decoding them,
+            when they are written in the output folder in the same format. The size limit of PIL is lifted for them.
+        :param patch_jpeg: True to re-encode only the blocks under the watermark of the JPEG files with jpegtran,
+            when they are written in the output folder as JPEG with the quality of the source.
+        :type path: str or bytes or file or Image
         :type margin: int
         :type folder: str
+        :type encoder: EncoderSettings
+        :type recorder: JobRecorder
+        :type output: str
+        :type renditions: list
+        :type stream: bool
+        :type patch_jpeg: bool
         """
-        self.image = Image.open(path)
-        self.width, self.height = self.image.size
+        is_path = isinstance(path, (str, os.PathLike))
+        if isinstance(path, (bytes, bytearray, memoryview)):
+            path = io.BytesIO(path)
+        self.output = output or (OUTPUT_FILE if is_path else OUTPUT_BUFFER)
+        if self.output not in OUTPUTS:
+            raise ValueError(f"The output must be one of {OUTPUTS} : {self.output}")
+        if self.output == OUTPUT_FILE and not is_path:
+            raise ValueError("The file output needs the path of the source image")
+
+        self.recorder = recorder or JobRecorder()
         self.path = path
+        self.stream = stream and is_path
+        self._image = None
+        self.open()
+        self.width, self.height = self._image.size
+        self.format = self._image.format
+        self.encoder = encoder or encoding.EncoderSettings()
+        self.encode_time = 0.0
+        self.bytes_written = 0
+        self.peak_memory = 0
         self.margin = margin
-        self.output_path = os.path.join(os.path.dirname(self.path),
-                                        folder,
-                                        os.path.basename(self.path))
+        self.renditions = list(renditions) if renditions else None
+        self.streaming = (self.stream and self.output == OUTPUT_FILE and not self.renditions
+                          and can_stream(self._image, self.encoder))
+        self.patch_jpeg = patch_jpeg and is_path
+        self.patching = (self.patch_jpeg and self.output == OUTPUT_FILE and not self.renditions
+                         and can_patch(self._image, self.encoder))
+        if is_path:
+            self.output_path = os.path.join(os.path.dirname(self.path),
+                                            folder,
+                                            os.path.basename(self.path))
+        else:
+            self.output_path = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    @property
+    def image(self):
+        """The source image, decoded on first access and then reused.
+
+        :return: The decoded image.
+        :rtype: Image
+        """
+        if self._image is None:
+            self.open()
+        if not self._loaded:
+            with self.recorder.stage("decode"):
+                self._image.load()
+            self._loaded = True
+            self.recorder.bytes_read += source_size(self.path)
+        return self._image
+
+    def open(self):
+        """Open the source image again after a :meth:`close`.
+        Only the header is read, the pixels are decoded on first access of :attr:`image`.
+        """
+        if self._image is None:
+            if isinstance(self.path, Image.Image):
+                self._image = self.path
+            else:
+                with self.recorder.stage("open"), unbounded_pixels() if self.stream else contextlib.nullcontext():
+                    self._image = Image.open(self.path)
+            self._loaded = False
 
-    def watermark_text(self, text, color, font_type, font_size, pos_name):
+    def close(self):
+        """Release the file handle and the decoded pixels of the source image.
+        A PIL image given as source is left open, it belongs to the caller.
+        """
+        if self._image is not None:
+            if self._image is not self.path:
+                self._image.close()
+            self._image = None
+            self._loaded = False
+
+    def watermark_text(self, text, color, font_type, font_size, pos_name, stamp=False,
+                       angle=TILE_ANGLE, opacity=TILE_OPACITY):
         """Write text on the image.
+        In stamp mode the text is rendered once per configuration and image size then pasted.
+        In the tiled position the text is repeated over the whole image, rotated and semi-transparent,
+        the margin is the space between two repetitions.
 
         :param text: The text to write on the image.
         :param color: The color of the text.
-        :param font_type: The font type of the text.
+        :param font_type: The font family, file name or path of the text.
         :param font_size: The font size of the text.
         :param pos_name: The position name of the text.
+        :param stamp: True to paste a pre-rendered text instead of drawing it.
+        :param angle: The rotation of the tiled text, in degrees.
+        :param opacity: The opacity of the tiled text, between 0 and 1.
         :type text: str
         :type color: (int, int, int)
         :type font_type: str
         :type font_size: int
         :type pos_name: str
+        :type stamp: bool
+        :type angle: float
+        :type opacity: float
 
-        :return: True if the path of the reduced image exists else False.
-        :rtype: bool
+        :return: The watermarked image, or the watermarked renditions.
+        :rtype: WatermarkResult or list
         """
-        image = Image.open(self.path)
-        drawing = ImageDraw.Draw(image)
-        text = text
-        font = ImageFont.truetype(font_type, font_size)
-        self.watermark_width, self.watermark_height = drawing.textsize(text, font)
-        pos = self.watermark_position(pos_name)
+        if self.renditions:
+            return self.watermark_renditions(
+                lambda image, scale: image.watermark_text(text, color, font_type, max(1, round(font_size * scale)),
+                                                          pos_name, stamp, angle, opacity))
+
+        if pos_name == TILED:
+            with self.recorder.stage("draw"):
+                watermark = tiled_text_stamp(text, color, font_type, font_size, (self.width, self.height),
+                                             angle, opacity, self.margin)
+            return self.watermark_stamp(watermark)
 
-        drawing.text(pos, text, fill=color, font=font)
-        parent_dir = os.path.dirname(self.output_path)
+        if stamp or self.streaming or self.patching:
+            with self.recorder.stage("draw"):
+                watermark = text_stamp(text, color, font_type, font_size, pos_name,
+                                       self.margin, (self.width, self.height))
+            return self.watermark_stamp(watermark)
 
-        if not os.path.exists(parent_dir):
-            os.makedirs(parent_dir)
+        image = self.image
+        with self.recorder.stage("font"):
+            font = get_font(font_type, font_size)
+        self.watermark_width, self.watermark_height = ImageDraw.Draw(image).textsize(text, font)
+        x, y = self.watermark_position(pos_name)
 
-        image.save(self.output_path)
-        return os.path.exists(self.output_path)
+        def draw(region):
+            with self.recorder.stage("draw"):
+                ImageDraw.Draw(region).text((0, 0), text, fill=color, font=font)
 
-    def watermark_image(self, watermark_path, pos_name):
+        return self.save_region((x, y, x + self.watermark_width, y + self.watermark_height), draw)
+
+    def watermark_image(self, watermark_path, pos_name, stamp=False, angle=TILE_ANGLE, opacity=TILE_OPACITY,
+                        scale=1.0):
         """Add an image watermark on the image.
         Supports only PNG and JPG files.
+        The transparent watermarks are alpha composited, the image keeps the mode of the source.
+        In the tiled position the watermark is repeated over the whole image, rotated and semi-transparent.
 
         :param watermark_path: The path of the image watermark.
         :param pos_name: The position name of the image watermark.
+        :param stamp: True to paste a pre-rendered watermark.
+        :param angle: The rotation of the tiled watermark, in degrees.
+        :param opacity: The opacity of the tiled watermark, between 0 and 1.
+        :param scale: The scale of the image watermark, 1 for its original size.
         :type watermark_path: str
         :type pos_name: str
+        :type stamp: bool
+        :type angle: float
+        :type opacity: float
+        :type scale: float
 
-        :return: True if the path of the reduced image exists else False.
-        :rtype: bool
+        :return: The watermarked image, or the watermarked renditions.
+        :rtype: WatermarkResult or list
         """
-        image = Image.open(self.path)
-        watermark = Image.open(watermark_path)
+        if self.renditions:
+            return self.watermark_renditions(
+                lambda image, rendition_scale: image.watermark_image(watermark_path, pos_name, stamp, angle, opacity,
+                                                                     scale * rendition_scale))
+
+        if pos_name == TILED:
+            with self.recorder.stage("logo"):
+                watermark = tiled_logo_stamp(watermark_path, (self.width, self.height), angle, opacity, self.margin,
+                                             scale)
+            return self.watermark_stamp(watermark)
+
+        if stamp or self.streaming or self.patching:
+            with self.recorder.stage("logo"):
+                watermark = logo_stamp(watermark_path, pos_name, self.margin, (self.width, self.height), scale)
+            return self.watermark_stamp(watermark)
+
+        with self.recorder.stage("logo"):
+            watermark = get_logo(watermark_path, scale)
         self.watermark_width, self.watermark_height = watermark.size
-        pos = self.watermark_position(pos_name)
+        x, y = self.watermark_position(pos_name)
+
+        def composite(region):
+            with self.recorder.stage("composite"):
+                if watermark.mode in ("RGBA", "LA") or "transparency" in watermark.info:
+                    logo = watermark.convert("RGBA")
+                    if region.mode == "RGBA":
+                        region.alpha_composite(logo)
+                    else:
+                        region.paste(logo, (0, 0), mask=logo)
+                else:
+                    region.paste(watermark, (0, 0))
 
-        parent_dir = os.path.dirname(self.output_path)
-        if not os.path.exists(parent_dir):
-            os.makedirs(parent_dir)
+        return self.save_region((x, y, x + self.watermark_width, y + self.watermark_height), composite)
 
-        watermark_ext = os.path.splitext(watermark_path)[-1]
-        if watermark_ext in (".png", ".PNG"):
-            transparent = Image.new('RGBA', (self.width, self.height), (0, 0, 0, 0))
-            transparent.paste(image, (0, 0))
-            transparent.paste(watermark, pos, mask=watermark)
-            self.output_path = ".".join([os.path.splitext(self.output_path)[0], "png"])
-            transparent.save(self.output_path)
-        elif watermark_ext in (".jpg", ".JPG", ".jpeg", ".JPEG"):
-            image.paste(watermark, pos)
-            image.save(self.output_path)
+    def watermark_layers(self, layers):
+        """Apply several watermarks on the image, in order, and encode it once.
+        The layers are rendered as stamps, cached per configuration and image size, and blended in the region
+        covering all of them.
 
-        return os.path.exists(self.output_path)
+        :param layers: The watermark layers, from the bottom to the top.
+        :type layers: list
+
+        :return: The watermarked image, or the watermarked renditions.
+        :rtype: WatermarkResult or list
+
+        :raise ValueError: There is no layer or a layer is invalid.
+        """
+        if not layers:
+            raise ValueError("The layered watermark has no layer")
+        if self.renditions:
+            return self.watermark_renditions(
+                lambda image, scale: image.watermark_layers([scale_layer(layer, scale) for layer in layers]))
+
+        size = (self.width, self.height)
+        with self.recorder.stage("layers"):
+            stamps = [(layer_stamp(layer, size), layer.blend) for layer in layers]
+        boxes = [stamp.box for stamp, _ in stamps]
+        box = (max(0, min(box[0] for box in boxes)), max(0, min(box[1] for box in boxes)),
+               min(self.width, max(box[2] for box in boxes)), min(self.height, max(box[3] for box in boxes)))
+
+        def composite(region, origin):
+            with self.recorder.stage("composite"):
+                for stamp, blend in stamps:
+                    stamp.blend(region, origin, blend)
+
+        if self.streaming:
+            return self.stream_region(box, composite)
+        if self.patching:
+            return self.patch_region(box, composite)
+        return self.save_region(box, lambda region: composite(region, box[:2]))
+
+    def watermark_renditions(self, watermark):
+        """Watermark and encode all the renditions from a single decode of the source.
+        The renditions are reduced from the largest to the smallest, each one from the previous one,
+        and watermarked at their own resolution: the font size, the logo and the margin are scaled like the image,
+        and the positions are computed on the rendition.
+
+        :param watermark: Called with the :class:`CustomImage` of a rendition and its scale,
+            returns the result of the watermark operation on the rendition.
+        :type watermark: callable
+
+        :return: The results of the renditions, in the order of :attr:`renditions`.
+        :rtype: list
+        """
+        source = self.image
+        order = sorted(range(len(self.renditions)), reverse=True,
+                       key=lambda index: self.renditions[index].max_size or math.inf)
+        results = [None] * len(self.renditions)
+        reduced = source
+        self.encode_time = 0.0
+        self.bytes_written = 0
+        for index in order:
+            rendition = self.renditions[index]
+            size = rendition_size(source.size, rendition.max_size)
+            if size != reduced.size:
+                with self.recorder.stage("resize"):
+                    reduced = reduced.resize(size, Image.LANCZOS)
+            scale = size[0] / self.width
+
+            # The PIL source only allows the image output: the rendition is then redirected to the output
+            # of this image. It is modified in place and restored like the decoded source.
+            image = CustomImage(reduced, margin=round(self.margin * scale), recorder=self.recorder,
+                                encoder=self.encoder.derive(rendition.format, rendition.quality), output=OUTPUT_IMAGE)
+            image.format = self.format
+            if self.output == OUTPUT_FILE:
+                root, ext = os.path.splitext(self.output_path)
+                image.output, image.output_path = OUTPUT_FILE, root + rendition.suffix + ext
+            elif self.output == OUTPUT_BUFFER:
+                image.output = OUTPUT_BUFFER
+            results[index] = watermark(image, scale)
+
+            # The peak of the rendition counts its reduced image, which is the source itself at full size.
+            self.track_memory(image.peak_memory - (pixel_bytes(source.mode, source.size) if reduced is source else 0))
+            self.encode_time += image.encode_time
+            self.bytes_written += image.bytes_written
+        return results
+
+    def watermark_stamp(self, stamp):
+        """Composite a pre-rendered watermark on the image.
+
+        :param stamp: The stamp of the watermark, placed for the size of the image.
+        :type stamp: Stamp
+
+        :return: The watermarked image.
+        :rtype: WatermarkResult
+        """
+        if self.streaming:
+            return self.stream_region(stamp.box, stamp.apply)
+
+        def composite(region, origin):
+            with self.recorder.stage("composite"):
+                stamp.apply(region, origin)
+
+        if self.patching:
+            return self.patch_region(stamp.box, composite)
+        return self.save_region(stamp.box, lambda region: composite(region, stamp.box[:2]))
+
+    def stream_region(self, box, apply):
+        """Watermark a region of a source stored without compression and write the image, without decoding it.
+        The source file is copied in the output folder and only the rows of the watermark are rewritten in the copy,
+        band by band: the memory is bounded by a few bands of the watermark, whatever the size of the image.
+
+        :param box: The bounding box of the watermark.
+        :param apply: The callable watermarking a band of the region in place, given with its coordinates.
+        :type box: (int, int, int, int)
+        :type apply: callable
+
+        :return: The watermarked image.
+        :rtype: WatermarkResult
+        """
+        box = (max(0, box[0]), max(0, box[1]), min(self.width, box[2]), min(self.height, box[3]))
+        mode = self._image.mode
+        tiles = raw_tiles(self._image)
+        width = max(tile.box[2] - tile.box[0] for tile in tiles)
+        self.peak_memory = max(self.peak_memory, stream_footprint(mode, width, box[3] - box[1]))
+
+        fmt = self.format
+        self.output_path = encoding.output_path_for(self.output_path, fmt)
+        start = time.perf_counter()
+        with self.recorder.stage("stream"):
+            stream_copy(self.path, self.output_path, tiles, mode, box, apply)
+        self.encode_time = time.perf_counter() - start
+        self.bytes_written = os.path.getsize(self.output_path)
+        self.recorder.bytes_read += self.bytes_written
+        self.recorder.bytes_written += self.bytes_written
+        return WatermarkResult(self.output_path, format=fmt, encode_time=self.encode_time,
+                               bytes_written=self.bytes_written)
+
+    def patch_region(self, box, apply):
+        """Watermark a region of a JPEG source and write the image, re-encoding only the blocks of the region.
+        The other blocks are copied without being decoded, so they keep their quality and the memory is bounded
+        by the region. The image is saved as usual when the region covers the whole image or jpegtran fails.
+
+        :param box: The bounding box of the watermark.
+        :param apply: The callable watermarking the region in place, given with its coordinates.
+        :type box: (int, int, int, int)
+        :type apply: callable
+
+        :return: The watermarked image.
+        :rtype: WatermarkResult
+        """
+        box = (max(0, box[0]), max(0, box[1]), min(self.width, box[2]), min(self.height, box[3]))
+        if box == (0, 0, self.width, self.height):
+            return self.save_region(box, lambda region: apply(region, box[:2]))
+
+        fmt = self.format
+        output_path = encoding.output_path_for(self.output_path, fmt)
+        start = time.perf_counter()
+        try:
+            with self.recorder.stage("patch"):
+                patched = patch_copy(self.path, output_path, self._image, box, apply, self.encoder)
+        except OSError:
+            self.patching = False
+            return self.save_region(box, lambda region: apply(region, box[:2]))
+        self.encode_time = time.perf_counter() - start
+        self.output_path = output_path
+        self.peak_memory = max(self.peak_memory, 2 * pixel_bytes(self._image.mode, (patched[2] - patched[0],
+                                                                                    patched[3] - patched[1])))
+        self.bytes_written = os.path.getsize(self.output_path)
+        self.recorder.bytes_read += source_size(self.path)
+        self.recorder.bytes_written += self.bytes_written
+        return WatermarkResult(self.output_path, format=fmt, encode_time=self.encode_time,
+                               bytes_written=self.bytes_written)
+
+    def save_region(self, box, apply):
+        """Watermark a region of the image and write the image.
+        Only the bounding box of the watermark is cropped and blended, then pasted in the decoded source
+        for the encoding. The source pixels are restored afterwards, so the image is never copied entirely,
+        except when the watermark covers the whole image or when the watermarked image is returned.
+
+        :param box: The bounding box of the watermark.
+        :param apply: The callable watermarking the cropped region in place.
+        :type box: (int, int, int, int)
+        :type apply: callable
+
+        :return: The watermarked image.
+        :rtype: WatermarkResult
+        """
+        source = self.image
+        full = tuple(box) == (0, 0) + source.size
+        if full or self.output == OUTPUT_IMAGE:
+            watermarked = source.copy()
+            self.track_memory(pixel_bytes(watermarked.mode, watermarked.size))
+            if full:
+                apply(watermarked)
+            else:
+                region = watermarked.crop(box)
+                apply(region)
+                watermarked.paste(region, box[:2])
+            return self.save(watermarked)
+
+        original = source.crop(box)
+        region = original.copy()
+        self.track_memory(2 * pixel_bytes(region.mode, region.size))
+        apply(region)
+
+        source.paste(region, box[:2])
+        try:
+            return self.save(source)
+        finally:
+            source.paste(original, box[:2])
+
+    def track_memory(self, extra):
+        """Update the peak memory estimate with the buffers allocated on top of the decoded source.
+
+        :param extra: The size of the extra buffers, in bytes.
+        :type extra: int
+        """
+        self.peak_memory = max(self.peak_memory, pixel_bytes(self.image.mode, self.image.size) + extra)
+
+    def save(self, image):
+        """Encode a watermarked image with the encoder settings and write it in the output folder.
+        The extension of the output path follows the output format.
+        The image is encoded in a new buffer instead in the buffer output, and not encoded in the image output.
+
+        :param image: The watermarked image.
+        :type image: Image
+
+        :raise OSError: If the image cannot be encoded or written.
+
+        :return: The watermarked image.
+        :rtype: WatermarkResult
+        """
+        fmt = self.encoder.output_format(self.format)
+        if self.output == OUTPUT_IMAGE:
+            return WatermarkResult(image=image, format=fmt)
+
+        if self.output == OUTPUT_BUFFER:
+            self.output_path = io.BytesIO()
+        else:
+            self.output_path = encoding.output_path_for(self.output_path, fmt)
+            parent_dir = os.path.dirname(self.output_path)
+            if not os.path.exists(parent_dir):
+                os.makedirs(parent_dir)
+
+        flat = encoding.flatten(image, fmt)
+        if flat is not image:
+            self.track_memory(pixel_bytes(flat.mode, flat.size))
+        with self.recorder.stage("encode"):
+            self.encode_time, self.bytes_written = encoding.write(flat, self.output_path, fmt, self.encoder,
+                                                                  image.info)
+        self.recorder.bytes_written += self.bytes_written
+        return WatermarkResult(self.output_path, format=fmt, encode_time=self.encode_time,
+                               bytes_written=self.bytes_written)
+
+    def draft(self, reduce):
+        """Decode the source image at a reduced resolution.
+        JPEG files are decoded directly at the reduced size with the DCT scaling of the decoder,
+        the other formats are decoded then resized.
+
+        :param reduce: The reduction factor, one of 1, 2, 4 or 8.
+        :type reduce: int
+
+        :return: The reduced image.
+        :rtype: Image
+        """
+        if reduce not in PREVIEW_REDUCTIONS:
+            raise ValueError(f"The reduction must be one of {PREVIEW_REDUCTIONS} : {reduce}")
+
+        size = (math.ceil(self.width / reduce), math.ceil(self.height / reduce))
+        if self._loaded or reduce == 1 or isinstance(self.path, Image.Image):
+            return reduced_copy(self.image, size)
+        # A second handle is decoded in draft mode, the source image keeps its header for the watermark.
+        with Image.open(self.path) as image:
+            image.draft(image.mode, size)
+            return reduced_copy(image, size)
+
+    def preview_text(self, text, color, font_type, font_size, pos_name, reduce=4,
+                     angle=TILE_ANGLE, opacity=TILE_OPACITY):
+        """Render the text watermark on a reduced resolution image, without writing anything.
+        The font size and the margin are scaled like the image.
+
+        :param text: The text to write on the image.
+        :param color: The color of the text.
+        :param font_type: The font family, file name or path of the text.
+        :param font_size: The font size of the text.
+        :param pos_name: The position name of the text.
+        :param reduce: The reduction factor, one of 1, 2, 4 or 8.
+        :param angle: The rotation of the tiled text, in degrees.
+        :param opacity: The opacity of the tiled text, between 0 and 1.
+        :type text: str
+        :type color: (int, int, int)
+        :type font_type: str
+        :type font_size: int
+        :type pos_name: str
+        :type reduce: int
+        :type angle: float
+        :type opacity: float
+
+        :return: The watermarked preview.
+        :rtype: Image
+        """
+        image = self.draft(reduce)
+        scale = image.width / self.width
+        layer = get_text_layer(text, color, font_type, max(1, round(font_size * scale)))
+        self._paste_preview(image, layer, pos_name, scale, angle, opacity)
+        return image
+
+    def preview_image(self, watermark_path, pos_name, reduce=4, angle=TILE_ANGLE, opacity=TILE_OPACITY):
+        """Render the image watermark on a reduced resolution image, without writing anything.
+        The watermark and the margin are scaled like the image.
+
+        :param watermark_path: The path of the image watermark.
+        :param pos_name: The position name of the image watermark.
+        :param reduce: The reduction factor, one of 1, 2, 4 or 8.
+        :param angle: The rotation of the tiled watermark, in degrees.
+        :param opacity: The opacity of the tiled watermark, between 0 and 1.
+        :type watermark_path: str
+        :type pos_name: str
+        :type reduce: int
+        :type angle: float
+        :type opacity: float
+
+        :return: The watermarked preview.
+        :rtype: Image
+        """
+        image = self.draft(reduce)
+        scale = image.width / self.width
+        watermark = get_logo(watermark_path).convert("RGBA")
+        watermark = watermark.resize((max(1, round(watermark.width * scale)), max(1, round(watermark.height * scale))),
+                                     Image.BILINEAR)
+        self._paste_preview(image, watermark, pos_name, scale, angle, opacity)
+        return image
+
+    def preview_layers(self, layers, reduce=4):
+        """Render a layered watermark on a reduced resolution image, without writing anything.
+        The layers are scaled like the image.
+
+        :param layers: The watermark layers, from the bottom to the top.
+        :param reduce: The reduction factor, one of 1, 2, 4 or 8.
+        :type layers: list
+        :type reduce: int
+
+        :return: The watermarked preview.
+        :rtype: Image
+        """
+        image = self.draft(reduce)
+        scale = image.width / self.width
+        for layer in layers:
+            layer = scale_layer(layer, scale)
+            layer_stamp(layer, image.size).blend(image, mode=layer.blend)
+        return image
+
+    def _paste_preview(self, image, watermark, pos_name, scale, angle, opacity):
+        """Paste a scaled RGBA watermark on a preview.
+
+        :param image: The preview, modified in place.
+        :param watermark: The RGBA watermark, already scaled.
+        :param pos_name: The position name of the watermark.
+        :param scale: The scale of the preview.
+        :param angle: The rotation of the tiled watermark, in degrees.
+        :param opacity: The opacity of the tiled watermark, between 0 and 1.
+        :type image: Image
+        :type watermark: Image
+        :type pos_name: str
+        :type scale: float
+        :type angle: float
+        :type opacity: float
+        """
+        if pos_name == TILED:
+            TiledStamp(watermark, image.size, angle, opacity, round(self.margin * scale)).apply(image)
+            return
+        pos = watermark_position(pos_name, image.width, image.height,
+                                 watermark.width, watermark.height, round(self.margin * scale))
+        image.paste(watermark, pos, mask=watermark)
 
     def watermark_position(self, pos_name):
-        if pos_name == "top left":
-            return self.margin, self.margin
-        if pos_name == "top right":
-            return self.width - self.margin - self.watermark_width, self.margin
-        if pos_name == "center":
-            return (round(self.width/2) - round(self.watermark_width/2),
-                    round(self.height/2) - round(self.watermark_height/2))
-        if pos_name == "bottom left":
-            return self.margin, self.height - self.margin - self.watermark_height
-        if pos_name == "bottom right":
-            return self.width - self.margin - self.watermark_width, self.height - self.margin - self.watermark_height
+        """Compute the position of the current watermark on the image.
+
+        :param pos_name: The position name of the watermark.
+        :type pos_name: str
+
+        :return: The coordinates of the top left corner of the watermark.
+        :rtype: (int, int)
+        """
+        return watermark_position(pos_name, self.width, self.height,
+                                  self.watermark_width, self.watermark_height, self.margin)
 
 
 if __name__ == '__main__':
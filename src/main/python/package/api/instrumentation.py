@@ -0,0 +1,181 @@
+import contextlib
+import cProfile
+import io
+import json
+import math
+import pstats
+import threading
+import time
+import tracemalloc
+
+
+class JobRecorder:
+    """The JobRecorder class records the duration of the stages of a watermark job.
+
+    Attributes:
+        **stages** *(dict)*: The duration of each stage, in seconds.
+
+        **bytes_read** *(int)*: The number of bytes of the source image.
+
+        **bytes_written** *(int)*: The number of bytes of the watermarked images.
+    """
+
+    def __init__(self):
+        """The constructor of the recorder."""
+        self.stages = {}
+        self.bytes_read = 0
+        self.bytes_written = 0
+
+    @contextlib.contextmanager
+    def stage(self, name):
+        """Time a stage of the job, the durations of a stage run several times are added.
+
+        :param name: The name of the stage.
+        :type name: str
+        """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.stages[name] = self.stages.get(name, 0.0) + time.perf_counter() - start
+
+    def to_dict(self):
+        """Get the records of the job.
+
+        :return: The stages durations and the bytes read and written.
+        :rtype: dict
+        """
+        return {"stages": dict(self.stages), "bytes_read": self.bytes_read, "bytes_written": self.bytes_written}
+
+
+@contextlib.contextmanager
+def profile(top=20):
+    """Profile the code of the block with cProfile and tracemalloc.
+    The report is available in the ``text`` key of the yielded dict once the block is over.
+
+    :param top: The number of functions and allocation sites of the report.
+    :type top: int
+    """
+    report = {}
+    profiler = cProfile.Profile()
+    tracing = tracemalloc.is_tracing()
+    if not tracing:
+        tracemalloc.start()
+    profiler.enable()
+    try:
+        yield report
+    finally:
+        profiler.disable()
+        snapshot = tracemalloc.take_snapshot()
+        _, peak = tracemalloc.get_traced_memory()
+        if not tracing:
+            tracemalloc.stop()
+
+        stream = io.StringIO()
+        pstats.Stats(profiler, stream=stream).sort_stats("cumulative").print_stats(top)
+        stream.write(f"Python allocations, peak {peak} bytes:\n")
+        for statistic in snapshot.statistics("lineno")[:top]:
+            stream.write(f"{statistic}\n")
+        report["text"] = stream.getvalue()
+
+
+def percentile(values, rank):
+    """Compute a percentile with the nearest rank method.
+
+    :param values: The sorted values.
+    :param rank: The percentile, between 0 and 100.
+    :type values: list
+    :type rank: float
+
+    :return: The percentile of the values.
+    :rtype: float
+    """
+    if not values:
+        return 0.0
+    index = max(0, math.ceil(rank / 100 * len(values)) - 1)
+    return values[index]
+
+
+class StatsCollector:
+    """The StatsCollector class aggregates the records of the jobs of a run.
+
+    Attributes:
+        **callback** *(callable)*: Called with the summary when new records are added.
+
+        **interval** *(float)*: The minimum delay between two calls of the callback, in seconds.
+    """
+
+    def __init__(self, callback=None, interval=1.0):
+        """The constructor of the collector.
+
+        :param callback: Called with the summary when new records are added.
+        :param interval: The minimum delay between two calls of the callback, in seconds.
+        :type callback: callable
+        :type interval: float
+        """
+        self.callback = callback
+        self.interval = interval
+        self._records = []
+        self._profiles = []
+        self._start = time.perf_counter()
+        self._last_callback = 0.0
+        self._lock = threading.Lock()
+
+    def add(self, record, profile=None):
+        """Add the records of a job.
+
+        :param record: The records of the job, as returned by :meth:`JobRecorder.to_dict`.
+        :param profile: The profiling report of the job.
+        :type record: dict
+        :type profile: str
+        """
+        with self._lock:
+            self._records.append(record)
+            if profile:
+                self._profiles.append(profile)
+        now = time.perf_counter()
+        if self.callback is not None and now - self._last_callback >= self.interval:
+            self._last_callback = now
+            self.callback(self.summary())
+
+    def summary(self):
+        """Get the aggregated statistics of the jobs.
+
+        :return: The number of images, the throughput, the bytes read and written
+            and the p50, p95 and total duration of each stage.
+        :rtype: dict
+        """
+        with self._lock:
+            records = list(self._records)
+        elapsed = time.perf_counter() - self._start
+
+        stages = {}
+        for name in sorted({name for record in records for name in record["stages"]}):
+            values = sorted(record["stages"][name] for record in records if name in record["stages"])
+            stages[name] = {"p50": percentile(values, 50), "p95": percentile(values, 95), "total": sum(values)}
+
+        return {
+            "images": len(records),
+            "seconds": elapsed,
+            "images_per_second": len(records) / elapsed if elapsed else 0.0,
+            "bytes_read": sum(record["bytes_read"] for record in records),
+            "bytes_written": sum(record["bytes_written"] for record in records),
+            "stages": stages,
+        }
+
+    def write_json(self, path):
+        """Write the summary and the profiling reports in a JSON report.
+
+        :param path: The path of the report.
+        :type path: str
+        """
+        report = self.summary()
+        with self._lock:
+            report["profiles"] = list(self._profiles)
+        with open(path, "w") as f:
+            json.dump(report, f, indent=2)
+
+    def flush(self):
+        """Call the callback with the final summary."""
+        if self.callback is not None:
+            self.callback(self.summary())
@@ -0,0 +1,201 @@
+import io
+import os
+import shutil
+import subprocess
+import tempfile
+import threading
+
+from PIL import Image, JpegImagePlugin
+
+
+PATCH_MODES = ("L", "RGB")
+
+PATCH_OPTIONS = {"optimize": "-optimize", "progressive": "-progressive"}
+
+
+_JPEGTRAN = None
+_JPEGTRAN_LOCK = threading.Lock()
+
+
+def jpegtran_path():
+    """Find the jpegtran program of libjpeg, which must support the -drop switch.
+    It is looked up once per process in the PATH.
+
+    :return: The path of the program, None if it is missing or too old.
+    :rtype: str
+    """
+    global _JPEGTRAN
+    with _JPEGTRAN_LOCK:
+        if _JPEGTRAN is None:
+            path = shutil.which("jpegtran")
+            try:
+                usage = subprocess.run([path, "-help"], capture_output=True, timeout=10) if path else None
+            except (OSError, subprocess.SubprocessError):
+                usage = None
+            _JPEGTRAN = path if usage is not None and b"-drop" in usage.stdout + usage.stderr else ""
+        return _JPEGTRAN or None
+
+
+def copy_markers(encoder):
+    """Get the markers jpegtran must copy to keep the metadata like the encoder settings.
+
+    :param encoder: The settings of the output encoding.
+    :type encoder: EncoderSettings
+
+    :return: The value of the -copy switch, None if jpegtran cannot keep the EXIF data without the ICC profile.
+    :rtype: str
+    """
+    if encoder.keep_exif:
+        return "all" if encoder.keep_icc else None
+    return "icc" if encoder.keep_icc else "none"
+
+
+def quantization_tables(image):
+    """Get the quantization tables of the components of a JPEG image in the order PIL assigns them
+    to the components when encoding: the luminance, then the chrominance.
+
+    :param image: The opened JPEG image.
+    :type image: JpegImageFile
+
+    :return: The quantization tables, None if the chrominance components do not share a table.
+    :rtype: list
+    """
+    tables = [component[3] for component in image.layer]
+    if len(set(tables[1:])) > 1 or any(table not in image.quantization for table in tables):
+        return None
+    return [image.quantization[table] for table in tables[:2]]
+
+
+def can_patch(image, encoder):
+    """Check if the watermarked image can be written by re-encoding only the blocks under the watermark:
+    the source is a baseline or progressive 8-bit JPEG in grayscale or YCbCr, the output keeps the JPEG format
+    with the quality of the source, and jpegtran is installed.
+
+    :param image: The opened source image, not loaded.
+    :param encoder: The settings of the output encoding.
+    :type image: Image
+    :type encoder: EncoderSettings
+
+    :return: True if the image can be patched.
+    :rtype: bool
+    """
+    if image.format != "JPEG" or encoder.output_format("JPEG") != "JPEG" or image.mode not in PATCH_MODES:
+        return False
+    if not set(encoder.options.get("JPEG", {})) <= set(PATCH_OPTIONS) or copy_markers(encoder) is None:
+        return False
+    # The Adobe transform 0 stores the RGB channels without conversion to YCbCr, which PIL does not write.
+    if image.info.get("adobe_transform") == 0 or len(image.layer) != len(image.mode):
+        return False
+    if image.mode == "RGB" and JpegImagePlugin.get_sampling(image) == -1:
+        return False
+    return quantization_tables(image) is not None and jpegtran_path() is not None
+
+
+def mcu_size(image):
+    """Get the size of the minimum coded units of a JPEG image, the blocks jpegtran can copy or replace.
+
+    :param image: The opened JPEG image.
+    :type image: JpegImageFile
+
+    :return: The width and height of a unit, in pixels.
+    :rtype: (int, int)
+    """
+    return 8 * max(component[1] for component in image.layer), 8 * max(component[2] for component in image.layer)
+
+
+def patch_box(box, mcu, size):
+    """Extend a region to the boundaries of the minimum coded units.
+
+    :param box: The region of the image.
+    :param mcu: The size of the minimum coded units.
+    :param size: The size of the image.
+    :type box: (int, int, int, int)
+    :type mcu: (int, int)
+    :type size: (int, int)
+
+    :return: The smallest region made of whole units covering the region, clamped to the image.
+    :rtype: (int, int, int, int)
+    """
+    return (box[0] // mcu[0] * mcu[0], box[1] // mcu[1] * mcu[1],
+            min(size[0], -(-box[2] // mcu[0]) * mcu[0]), min(size[1], -(-box[3] // mcu[1]) * mcu[1]))
+
+
+def _jpegtran(*args):
+    """Run jpegtran.
+
+    :param args: The arguments of the program.
+    :type args: str
+
+    :return: The output of the program.
+    :rtype: bytes
+
+    :raise OSError: jpegtran is missing or failed.
+    """
+    path = jpegtran_path()
+    if path is None:
+        raise OSError("jpegtran with the -drop switch is not installed")
+    try:
+        process = subprocess.run([path] + list(args), capture_output=True)
+    except subprocess.SubprocessError as e:
+        raise OSError(f"jpegtran failed : {e}") from e
+    if process.returncode != 0:
+        raise OSError(f"jpegtran failed : {process.stderr.decode(errors='replace').strip()}")
+    return process.stdout
+
+
+def patch_copy(source_path, output_path, image, box, apply, encoder):
+    """Watermark a JPEG image by re-encoding only the minimum coded units under the watermark.
+    The units of the region are extracted losslessly with jpegtran, decoded, watermarked and encoded again
+    with the quantization tables and the sampling of the source, then dropped in a copy of the source
+    which replaces the output file once complete. The coefficients of the other units are copied unchanged,
+    without generation loss.
+
+    :param source_path: The path of the source image file.
+    :param output_path: The path of the watermarked image file.
+    :param image: The opened source image, not loaded.
+    :param box: The region of the watermark.
+    :param apply: Called with the decoded region and its coordinates on the image, watermarks it in place.
+    :param encoder: The settings of the output encoding.
+    :type source_path: str
+    :type output_path: str
+    :type image: JpegImageFile
+    :type box: (int, int, int, int)
+    :type apply: callable
+    :type encoder: EncoderSettings
+
+    :return: The region actually re-encoded, aligned on the units.
+    :rtype: (int, int, int, int)
+
+    :raise OSError: jpegtran is missing or cannot transform the source.
+    """
+    box = patch_box(box, mcu_size(image), image.size)
+    width, height = box[2] - box[0], box[3] - box[1]
+    data = _jpegtran("-copy", "none", "-crop", f"{width}x{height}+{box[0]}+{box[1]}", source_path)
+    with Image.open(io.BytesIO(data)) as cropped:
+        region = cropped.convert(image.mode)
+    if region.size != (width, height):
+        raise OSError(f"jpegtran cropped {region.size} instead of {(width, height)}")
+    apply(region, box[:2])
+
+    folder = os.path.dirname(output_path)
+    os.makedirs(folder, exist_ok=True)
+    options = {"qtables": quantization_tables(image)}
+    if image.mode == "RGB":
+        options["subsampling"] = JpegImagePlugin.get_sampling(image)
+    switches = [PATCH_OPTIONS[name] for name, value in sorted(encoder.options.get("JPEG", {}).items()) if value]
+    fd, patch_path = tempfile.mkstemp(dir=folder, prefix=".", suffix=".jpg")
+    temp_path = None
+    try:
+        with os.fdopen(fd, "wb") as f:
+            region.save(f, "JPEG", **options)
+        fd, temp_path = tempfile.mkstemp(dir=folder, prefix=".", suffix=".tmp")
+        os.close(fd)
+        _jpegtran("-copy", copy_markers(encoder), *switches, "-drop", f"+{box[0]}+{box[1]}", patch_path,
+                  "-outfile", temp_path, source_path)
+        os.replace(temp_path, output_path)
+        temp_path = None
+    finally:
+        os.unlink(patch_path)
+        if temp_path is not None:
+            os.unlink(temp_path)
+    return box
@@ -0,0 +1,176 @@
+import hashlib
+import json
+import os
+import sqlite3
+
+
+MANIFEST_NAME = ".pywatermark.sqlite"
+
+MANIFEST_VERSION = 2
+
+
+def fingerprint(options):
+    """Compute the fingerprint of a watermark configuration.
+    The fingerprint changes with the settings and with the content of the logo files, of the layers too.
+
+    :param options: The options of the watermark job.
+    :type options: dict
+
+    :return: The hexadecimal digest of the configuration.
+    :rtype: str
+    """
+    config = dict(options, version=MANIFEST_VERSION)
+    logo = options.get("logo")
+    if logo and os.path.exists(logo):
+        stat = os.stat(logo)
+        config["logo_stat"] = (stat.st_size, stat.st_mtime_ns)
+    layer_logos = [os.stat(layer.logo) for layer in options.get("layers") or ()
+                   if layer.logo and os.path.exists(layer.logo)]
+    if layer_logos:
+        config["layer_logo_stats"] = [(stat.st_size, stat.st_mtime_ns) for stat in layer_logos]
+    data = json.dumps(config, sort_keys=True, default=str)
+    return hashlib.sha1(data.encode("utf-8")).hexdigest()
+
+
+class Manifest:
+    """The Manifest class records the watermarked images of an output folder in a SQLite database.
+    The output column holds the JSON list of the output paths of each source, one per rendition.
+
+    Attributes:
+        **path** *(str)*: The path of the database file.
+    """
+
+    COMMIT_INTERVAL = 100
+
+    def __init__(self, output_dir):
+        """The constructor of the manifest.
+
+        :param output_dir: The path of the output folder.
+        :type output_dir: str
+        """
+        self.path = os.path.join(output_dir, MANIFEST_NAME)
+        self._connection = None
+        self._uncommitted = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def _connect(self, create):
+        """Open the database on first use.
+
+        :param create: True to create the database if it does not exist.
+        :type create: bool
+
+        :return: The connection to the database, None if it does not exist.
+        :rtype: sqlite3.Connection
+        """
+        if self._connection is None:
+            if not create and not os.path.exists(self.path):
+                return None
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            self._connection = sqlite3.connect(self.path)
+            self._connection.execute("CREATE TABLE IF NOT EXISTS jobs ("
+                                     "source TEXT PRIMARY KEY, size INTEGER, mtime INTEGER, "
+                                     "fingerprint TEXT, output TEXT)")
+        return self._connection
+
+    def is_up_to_date(self, source, config):
+        """Check if the output of an image is already up to date.
+
+        :param source: The path of the source image.
+        :param config: The fingerprint of the watermark configuration.
+        :type source: str
+        :type config: str
+
+        :return: True if the source and the configuration did not change since the outputs were written,
+            and all the outputs still exist.
+        :rtype: bool
+        """
+        connection = self._connect(create=False)
+        if connection is None:
+            return False
+        row = connection.execute("SELECT size, mtime, fingerprint, output FROM jobs WHERE source = ?",
+                                 (source,)).fetchone()
+        if row is None:
+            return False
+        try:
+            stat = os.stat(source)
+        except OSError:
+            return False
+        size, mtime, recorded_config, outputs = row
+        if (size, mtime, recorded_config) != (stat.st_size, stat.st_mtime_ns, config):
+            return False
+        return all(os.path.exists(output) for output in json.loads(outputs))
+
+    def record(self, source, config, outputs):
+        """Record the outputs of an image.
+
+        :param source: The path of the source image.
+        :param config: The fingerprint of the watermark configuration.
+        :param outputs: The paths of the watermarked images, one per rendition.
+        :type source: str
+        :type config: str
+        :type outputs: list
+        """
+        stat = os.stat(source)
+        connection = self._connect(create=True)
+        connection.execute("INSERT OR REPLACE INTO jobs VALUES (?, ?, ?, ?, ?)",
+                           (source, stat.st_size, stat.st_mtime_ns, config, json.dumps(list(outputs))))
+        self._uncommitted += 1
+        if self._uncommitted >= self.COMMIT_INTERVAL:
+            self.commit()
+
+    def commit(self):
+        """Write the pending records to the database."""
+        if self._connection is not None and self._uncommitted:
+            self._connection.commit()
+            self._uncommitted = 0
+
+    def close(self):
+        """Commit the pending records and close the database."""
+        if self._connection is not None:
+            self.commit()
+            self._connection.close()
+            self._connection = None
+
+
+class ManifestStore:
+    """The ManifestStore class gives the manifest of the output folder of each image."""
+
+    def __init__(self, folder):
+        """The constructor of the store.
+
+        :param folder: The name of the output folder.
+        :type folder: str
+        """
+        self.folder = folder
+        self._manifests = {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def get(self, source):
+        """Get the manifest of the output folder of an image.
+
+        :param source: The path of the source image.
+        :type source: str
+
+        :return: The manifest of the output folder.
+        :rtype: Manifest
+        """
+        output_dir = os.path.join(os.path.dirname(source), self.folder)
+        if output_dir not in self._manifests:
+            self._manifests[output_dir] = Manifest(output_dir)
+        return self._manifests[output_dir]
+
+    def close(self):
+        """Close all the manifests."""
+        for manifest in self._manifests.values():
+            manifest.close()
+        self._manifests.clear()
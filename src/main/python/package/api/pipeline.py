@@ -0,0 +1,373 @@
+import functools
+import multiprocessing
+import os
+import queue
+import tempfile
+import threading
+import time
+
+from package.api.batch import _CANCELLED, JobResult, process_image
+from package.api.manifest import ManifestStore, fingerprint
+from package.api.scheduler import MemoryScheduler, image_footprint
+
+
+def write_atomic(path, data):
+    """Write a file through a temporary file renamed once complete,
+    so the readers of the output folder never see a partial image.
+
+    :param path: The path of the file.
+    :param data: The content of the file.
+    :type path: str
+    :type data: bytes
+    """
+    folder = os.path.dirname(path)
+    os.makedirs(folder, exist_ok=True)
+    fd, temp_path = tempfile.mkstemp(dir=folder, prefix=".", suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+        os.replace(temp_path, path)
+    except BaseException:
+        os.unlink(temp_path)
+        raise
+
+
+class StageMeter:
+    """The StageMeter class measures the busy time of the stages of a pipeline.
+
+    Attributes:
+        **capacity** *(dict)*: The number of threads or processes of each stage.
+    """
+
+    def __init__(self, capacity):
+        """The constructor of the meter.
+
+        :param capacity: The number of threads or processes of each stage.
+        :type capacity: dict
+        """
+        self.capacity = capacity
+        self._busy = dict.fromkeys(capacity, 0.0)
+        self._start = time.perf_counter()
+        self._lock = threading.Lock()
+
+    def add(self, stage, seconds):
+        """Add busy time to a stage.
+
+        :param stage: The name of the stage.
+        :param seconds: The busy time.
+        :type stage: str
+        :type seconds: float
+        """
+        with self._lock:
+            self._busy[stage] += seconds
+
+    def utilization(self):
+        """Get the share of the time each stage was busy, 1.0 when all its threads or processes always worked.
+
+        :return: The utilization of each stage.
+        :rtype: dict
+        """
+        elapsed = time.perf_counter() - self._start
+        with self._lock:
+            return {stage: busy / (elapsed * self.capacity[stage]) if elapsed else 0.0
+                    for stage, busy in self._busy.items()}
+
+
+class Pipeline:
+    """The Pipeline class watermarks the images in three overlapping stages connected by bounded queues:
+    prefetch threads read the files, the worker processes watermark the images in memory
+    and writer threads write the outputs atomically. The disk latency is hidden behind the computation,
+    which suits slow or network storage.
+
+    It is a drop-in replacement of :class:`BatchProcessor`, with the same results and options.
+
+    Attributes:
+        **workers** *(int)*: The number of worker processes.
+
+        **readers** *(int)*: The number of prefetch threads.
+
+        **writers** *(int)*: The number of writer threads.
+
+        **incremental** *(bool)*: True to skip the images whose output is up to date.
+
+        **skipped** *(int)*: The number of images skipped by the last run.
+
+        **collector** *(StatsCollector)*: The aggregator of the jobs statistics.
+
+        **profile_every** *(int)*: Profile one job every this number of jobs, never if 0.
+
+        **scheduler** *(MemoryScheduler)*: The admission of the jobs under the memory budget.
+
+        **meter** *(StageMeter)*: The busy time of the stages of the last run.
+    """
+
+    def __init__(self, workers=None, readers=2, writers=2, max_pending=None, incremental=True, collector=None,
+                 profile_every=0, memory_budget=None):
+        """The constructor of the pipeline.
+
+        :param workers: The number of worker processes, the number of CPUs if None.
+        :param readers: The number of prefetch threads.
+        :param writers: The number of writer threads.
+        :param max_pending: The maximum number of images in the pipeline, 4 per worker if None.
+        :param incremental: True to skip the images recorded in the manifest of their output folder
+            with the same size, modification time and watermark configuration.
+        :param collector: The aggregator of the jobs statistics.
+        :param profile_every: Profile one job every this number of jobs, never if 0.
+        :param memory_budget: The maximum estimated memory of the images in the pipeline, in bytes,
+            no limit if None.
+        :type workers: int
+        :type readers: int
+        :type writers: int
+        :type max_pending: int
+        :type incremental: bool
+        :type collector: StatsCollector
+        :type profile_every: int
+        :type memory_budget: int
+        """
+        self.workers = workers or os.cpu_count() or 1
+        self.readers = readers
+        self.writers = writers
+        self.max_pending = max_pending or self.workers * 4
+        self.incremental = incremental
+        self.skipped = 0
+        self.collector = collector
+        self.profile_every = profile_every
+        self.scheduler = MemoryScheduler(memory_budget)
+        self.meter = StageMeter({"read": readers, "compute": self.workers, "write": writers})
+        self._pool = None
+        self._results = None
+        self._lock = threading.Lock()
+        self._cancelled = threading.Event()
+
+    @property
+    def cancelled(self):
+        """True if the batch has been cancelled."""
+        return self._cancelled.is_set()
+
+    def utilization(self):
+        """Get the utilization of the stages of the last run.
+
+        :return: The share of the time each stage was busy.
+        :rtype: dict
+        """
+        return self.meter.utilization()
+
+    def run(self, paths, **options):
+        """Watermark the images and yield the results as soon as they are written.
+        The paths are consumed lazily, so they can come from a generator of any length.
+        The options are the keyword arguments of :func:`process_image`.
+
+        :param paths: The paths of the image files.
+        :type paths: iterable
+
+        :return: A generator of the results in completion order.
+        :rtype: generator
+        """
+        paths = iter(paths)
+        # The sources are read in memory by the pipeline, they are never streamed nor patched.
+        options.pop("stream", None)
+        options.pop("patch_jpeg", None)
+        results = queue.Queue()
+        reads = queue.Queue(maxsize=self.max_pending)
+        writes = queue.Queue(maxsize=self.max_pending)
+        self.skipped = 0
+        self.scheduler = scheduler = MemoryScheduler(self.scheduler.budget)
+        self.meter = StageMeter({"read": self.readers, "compute": self.workers, "write": self.writers})
+        config = fingerprint(options)
+        manifests = ManifestStore(options.get("folder", "output")) if self.incremental else None
+        with self._lock:
+            if self.cancelled:
+                return
+            self._results = results
+            self._pool = multiprocessing.Pool(processes=self.workers)
+
+        threads = [threading.Thread(target=self._read, args=(reads, writes, results, options), daemon=True)
+                   for _ in range(self.readers)]
+        threads += [threading.Thread(target=self._write, args=(writes, results), daemon=True)
+                    for _ in range(self.writers)]
+        for thread in threads:
+            thread.start()
+
+        pending = 0
+        submitted = 0
+        exhausted = False
+        waiting = None
+        try:
+            while True:
+                while not exhausted and pending < self.max_pending:
+                    if waiting is None:
+                        path = next(paths, None)
+                        if path is None:
+                            exhausted = True
+                            break
+                        if manifests is not None and manifests.get(path).is_up_to_date(path, config):
+                            self.skipped += 1
+                            yield JobResult(path, True, skipped=True)
+                            continue
+                        footprint = image_footprint(path, **options) if scheduler.budget is not None else 0
+                        waiting = (path, footprint)
+                    path, footprint = waiting
+                    if not scheduler.try_acquire(footprint):
+                        break
+                    waiting = None
+                    profile = bool(self.profile_every) and submitted % self.profile_every == 0
+                    reads.put((path, footprint, profile))
+                    pending += 1
+                    submitted += 1
+
+                if not pending:
+                    break
+                footprint, result = results.get()
+                if result is _CANCELLED:
+                    break
+                scheduler.release(footprint)
+                pending -= 1
+                if manifests is not None and result.success:
+                    manifests.get(result.path).record(result.path, config, result.output_paths)
+                if self.collector is not None and result.stats is not None:
+                    self.collector.add(result.stats, result.profile)
+                yield result
+        finally:
+            self._shutdown(reads, writes, threads, terminate=bool(pending) or not exhausted)
+            if manifests is not None:
+                manifests.close()
+
+    def cancel(self):
+        """Cancel the batch.
+        The pending jobs are dropped and the worker processes are terminated, so the jobs in flight stop too.
+        """
+        with self._lock:
+            self._cancelled.set()
+            if self._pool is not None:
+                self._pool.terminate()
+            if self._results is not None:
+                self._results.put((0, _CANCELLED))
+
+    def _read(self, reads, writes, results, options):
+        """Prefetch the source files and submit them to the worker processes, until a None item.
+
+        :param reads: The queue of the paths to read.
+        :param writes: The queue of the watermarked images to write.
+        :param results: The queue of the results.
+        :param options: The keyword arguments of :func:`process_image`.
+        :type reads: queue.Queue
+        :type writes: queue.Queue
+        :type results: queue.Queue
+        :type options: dict
+        """
+        while True:
+            item = reads.get()
+            if item is None:
+                return
+            path, footprint, profile = item
+            start = time.perf_counter()
+            try:
+                with open(path, "rb") as f:
+                    data = f.read()
+            except OSError as e:
+                results.put((footprint, JobResult(path, False, error=str(e))))
+                continue
+            finally:
+                self.meter.add("read", time.perf_counter() - start)
+
+            with self._lock:
+                if self._pool is None or self.cancelled:
+                    return
+                self._pool.apply_async(process_image, (path,), dict(options, profile=profile, data=data),
+                                       callback=functools.partial(self._computed, writes, footprint),
+                                       error_callback=functools.partial(self._failed, results, footprint, path))
+
+    def _computed(self, writes, footprint, result):
+        """Pass a watermarked image to the writer threads.
+
+        :param writes: The queue of the watermarked images to write.
+        :param footprint: The estimated memory of the job.
+        :param result: The result of the job, holding the encoded image.
+        :type writes: queue.Queue
+        :type footprint: int
+        :type result: JobResult
+        """
+        if result.stats is not None:
+            self.meter.add("compute", sum(result.stats["stages"].values()))
+        writes.put((footprint, result))
+
+    def _write(self, writes, results):
+        """Write the watermarked images, until a None item.
+
+        :param writes: The queue of the watermarked images to write.
+        :param results: The queue of the results.
+        :type writes: queue.Queue
+        :type results: queue.Queue
+        """
+        while True:
+            item = writes.get()
+            if item is None:
+                return
+            footprint, result = item
+            start = time.perf_counter()
+            try:
+                for output_path, data in result.data:
+                    write_atomic(output_path, data)
+                result = result._replace(data=None)
+            except OSError as e:
+                result = JobResult(result.path, False, error=str(e))
+            finally:
+                self.meter.add("write", time.perf_counter() - start)
+            results.put((footprint, result))
+
+    @staticmethod
+    def _failed(results, footprint, path, error):
+        """Report a job which raised an exception as a failure.
+
+        :param results: The queue of the results.
+        :param footprint: The estimated memory of the job.
+        :param path: The path of the image file.
+        :param error: The exception raised by the job.
+        :type results: queue.Queue
+        :type footprint: int
+        :type path: str
+        :type error: Exception
+        """
+        results.put((footprint, JobResult(path, False, error=str(error))))
+
+    def _shutdown(self, reads, writes, threads, terminate=False):
+        """Stop the threads and release the pool once the batch is over.
+
+        :param reads: The queue of the paths to read.
+        :param writes: The queue of the watermarked images to write.
+        :param threads: The prefetch and writer threads.
+        :param terminate: True to kill the jobs still running.
+        :type reads: queue.Queue
+        :type writes: queue.Queue
+        :type threads: list
+        :type terminate: bool
+        """
+        with self._lock:
+            pool, self._pool, self._results = self._pool, None, None
+        if pool is not None:
+            if terminate:
+                pool.terminate()
+            else:
+                pool.close()
+            pool.join()
+
+        for queue_, count in ((reads, self.readers), (writes, self.writers)):
+            if terminate:
+                _drain(queue_)
+            for _ in range(count):
+                queue_.put(None)
+        for thread in threads:
+            thread.join()
+
+
+def _drain(items):
+    """Remove all the items of a queue.
+
+    :param items: The queue to empty.
+    :type items: queue.Queue
+    """
+    while True:
+        try:
+            items.get_nowait()
+        except queue.Empty:
+            return
@@ -0,0 +1,43 @@
+WATERMARK_POSITION = (
+    "top left",
+    "top right",
+    "center",
+    "bottom left",
+    "bottom right",
+    "tiled",
+)
+
+TILED = "tiled"
+
+
+def watermark_position(pos_name, width, height, watermark_width, watermark_height, margin):
+    """Compute the top left corner of a watermark on an image.
+    The tiled watermarks cover the whole image from its top left corner.
+
+    :param pos_name: The position name of the watermark.
+    :param width: The width of the image.
+    :param height: The height of the image.
+    :param watermark_width: The width of the watermark.
+    :param watermark_height: The height of the watermark.
+    :param margin: The margin between the image border and the watermark.
+    :type pos_name: str
+    :type width: int
+    :type height: int
+    :type watermark_width: int
+    :type watermark_height: int
+    :type margin: int
+
+    :return: The coordinates of the top left corner of the watermark.
+    :rtype: (int, int)
+    """
+    if pos_name in ("top left", TILED):
+        return margin, margin
+    if pos_name == "top right":
+        return width - margin - watermark_width, margin
+    if pos_name == "center":
+        return (round(width/2) - round(watermark_width/2),
+                round(height/2) - round(watermark_height/2))
+    if pos_name == "bottom left":
+        return margin, height - margin - watermark_height
+    if pos_name == "bottom right":
+        return width - margin - watermark_width, height - margin - watermark_height
@@ -0,0 +1,337 @@
+import collections
+import json
+import os
+import re
+
+from PIL import Image, ImageColor
+
+from package.api.cache import get_logo
+from package.api.encoding import EncoderSettings
+from package.api.fonts import find_font
+from package.api.image import Rendition
+from package.api.position import WATERMARK_POSITION
+from package.api.stamp import BLEND_MODES, TILE_ANGLE, TILE_OPACITY, Layer
+
+try:
+    import tomllib
+except ImportError:  # Python < 3.11
+    tomllib = None
+
+
+PRESET_VERSION = 1
+
+
+WatermarkSpec = collections.namedtuple("WatermarkSpec", ("wt_type", "text", "font", "size", "color", "logo", "pos",
+                                                         "margin", "angle", "opacity", "stamp", "folder", "encoder",
+                                                         "renditions", "layers"),
+                                       defaults=("text", "watermark", "Arial", 75, "#000000", None, "bottom right",
+                                                 25, TILE_ANGLE, TILE_OPACITY, False, "output", None, None, None))
+WatermarkSpec.__doc__ = """The declarative settings of a watermark, as saved in a preset file.
+
+    Attributes:
+        **wt_type** *(str)*: The type of the watermark ("text", "image" or "layers").
+
+        **text** *(str)*: The text of the watermark.
+
+        **font** *(str)*: The font family, file name or path of the text.
+
+        **size** *(int)*: The font size of the text.
+
+        **color** *(str)*: The color of the text, any color name or code of PIL.
+
+        **logo** *(str)*: The path of the image watermark.
+
+        **pos** *(str)*: The position name of the watermark.
+
+        **margin** *(int)*: The margin between the image border and the watermark, or between the tiles.
+
+        **angle** *(float)*: The rotation of the tiled watermark, in degrees.
+
+        **opacity** *(float)*: The opacity of the tiled watermark, between 0 and 1.
+
+        **stamp** *(bool)*: True to paste a watermark pre-rendered once per image size.
+
+        **folder** *(str)*: The name of the output folder.
+
+        **encoder** *(dict)*: The keyword arguments of :class:`EncoderSettings`, the source format if None.
+
+        **renditions** *(list)*: The output sizes, as "max_size:format:quality:suffix" strings,
+        a single full size output if None. See :func:`parse_rendition`.
+
+        **layers** *(list)*: The settings of the watermarks of the "layers" type, from the bottom to the top.
+        Each one is a dict of the fields of :class:`Layer`, with the color as a name or a code.
+    """
+
+
+Preset = collections.namedtuple("Preset", ("folder", "margin", "wt_type", "pos", "text", "font", "size", "color",
+                                           "logo", "stamp", "encoder", "angle", "opacity", "renditions", "layers"))
+Preset.__doc__ = """A watermark spec validated and resolved once, shared by all the jobs of a batch.
+    The fields are the keyword arguments of :func:`package.api.batch.process_image`,
+    so ``preset._asdict()`` is the options of a batch run.
+
+    Attributes:
+        **folder** *(str)*: The name of the output folder.
+
+        **margin** *(int)*: The margin between the image border and the watermark, or between the tiles.
+
+        **wt_type** *(str)*: The type of the watermark ("text", "image" or "layers").
+
+        **pos** *(str)*: The position name of the watermark.
+
+        **text** *(str)*: The text of the watermark, None for an image watermark.
+
+        **font** *(str)*: The path of the font file, None for an image watermark.
+
+        **size** *(int)*: The font size of the text, None for an image watermark.
+
+        **color** *(str)*: The color of the text, any color name or code of PIL, None for an image watermark.
+        It is checked once and converted by PIL to the mode of each image.
+
+        **logo** *(str)*: The absolute path of the image watermark, None for a text watermark.
+
+        **stamp** *(bool)*: True to paste a watermark pre-rendered once per image size.
+
+        **encoder** *(EncoderSettings)*: The settings of the output encoding.
+
+        **angle** *(float)*: The rotation of the tiled watermark, in degrees.
+
+        **opacity** *(float)*: The opacity of the tiled watermark, between 0 and 1.
+
+        **renditions** *(list)*: The output sizes of each image, a single full size output if None.
+
+        **layers** *(list)*: The compiled :class:`Layer` of a layered watermark, None for the other types.
+    """
+
+
+def parse_rendition(text):
+    """Parse an output size written "max_size:format:quality:suffix", like "1024:WEBP:80:_1024".
+    The trailing fields can be omitted and the empty fields keep their default value,
+    "full" or an empty size is the size of the source.
+
+    :param text: The description of the rendition.
+    :type text: str
+
+    :return: The rendition.
+    :rtype: Rendition
+
+    :raise ValueError: A field is invalid.
+    """
+    fields = text.split(":", 3)
+    fields += [""] * (4 - len(fields))
+    max_size, fmt, quality, suffix = fields
+    try:
+        rendition = Rendition(max_size=int(max_size) if max_size not in ("", "full") else None,
+                              format=fmt.upper() or None, quality=int(quality) if quality else None, suffix=suffix)
+    except ValueError:
+        raise ValueError(f"Invalid rendition : {text}") from None
+    if rendition.max_size is not None and rendition.max_size <= 0:
+        raise ValueError(f"The size of the rendition must be positive : {text}")
+    return rendition
+
+
+def compile_layer(data):
+    """Validate the settings of a layer and resolve its assets once: the font file and the logo.
+    The text layers default to the font, size and color of :class:`WatermarkSpec`.
+
+    :param data: The settings of the layer, the fields of :class:`Layer`.
+    :type data: dict
+
+    :return: The compiled layer.
+    :rtype: Layer
+
+    :raise ValueError: A setting is invalid.
+    :raise OSError: The font is not installed or the logo cannot be read.
+    """
+    unknown = set(data) - set(Layer._fields)
+    if unknown:
+        raise ValueError(f"Unknown layer settings : {', '.join(sorted(unknown))}")
+    layer = Layer(**data)
+    if layer.pos not in WATERMARK_POSITION:
+        raise ValueError(f"Unknown position : {layer.pos}")
+    if layer.margin < 0:
+        raise ValueError(f"The margin must be positive : {layer.margin}")
+    if layer.opacity is not None and not 0 <= layer.opacity <= 1:
+        raise ValueError(f"The opacity must be between 0 and 1 : {layer.opacity}")
+    if layer.blend not in BLEND_MODES:
+        raise ValueError(f"Unknown blend mode : {layer.blend}")
+    if layer.scale <= 0:
+        raise ValueError(f"The scale must be positive : {layer.scale}")
+
+    if layer.wt_type == "text":
+        defaults = WatermarkSpec()
+        size = layer.size or defaults.size
+        if not layer.text:
+            raise ValueError("The text of the layer is empty")
+        if size <= 0:
+            raise ValueError(f"The font size must be positive : {size}")
+        color = layer.color or defaults.color
+        ImageColor.getrgb(color)
+        return layer._replace(font=find_font(layer.font or defaults.font), size=size, color=color, logo=None)
+    if layer.wt_type == "image":
+        if not layer.logo:
+            raise ValueError("The logo of the layer is missing")
+        logo = os.path.abspath(layer.logo)
+        get_logo(logo)
+        return layer._replace(text=None, font=None, size=None, color=None, logo=logo)
+    raise ValueError(f"Unknown watermark type : {layer.wt_type}")
+
+
+def compile_spec(spec):
+    """Validate a watermark spec and resolve its assets once: the font file and the logo.
+    The logo is decoded in the cache of the process, the worker processes forked afterwards inherit it.
+
+    :param spec: The settings of the watermark.
+    :type spec: WatermarkSpec
+
+    :return: The compiled preset.
+    :rtype: Preset
+
+    :raise ValueError: A setting is invalid.
+    :raise OSError: The font is not installed or the logo cannot be read.
+    """
+    if spec.pos not in WATERMARK_POSITION:
+        raise ValueError(f"Unknown position : {spec.pos}")
+    if spec.margin < 0:
+        raise ValueError(f"The margin must be positive : {spec.margin}")
+    if not 0 <= spec.opacity <= 1:
+        raise ValueError(f"The opacity must be between 0 and 1 : {spec.opacity}")
+    encoder = EncoderSettings(**(spec.encoder or {}))
+    Image.init()
+    if encoder.format is not None and encoder.format not in Image.SAVE:
+        raise ValueError(f"Unknown output format : {encoder.format}")
+    renditions = [parse_rendition(text) for text in spec.renditions] if spec.renditions else None
+    for rendition in renditions or ():
+        if rendition.format is not None and rendition.format not in Image.SAVE:
+            raise ValueError(f"Unknown output format : {rendition.format}")
+    suffixes = [rendition.suffix for rendition in renditions or ()]
+    if len(set(suffixes)) != len(suffixes):
+        raise ValueError("The renditions must have different suffixes")
+    common = {"folder": spec.folder, "margin": spec.margin, "wt_type": spec.wt_type, "pos": spec.pos,
+              "stamp": spec.stamp, "encoder": encoder, "angle": spec.angle, "opacity": spec.opacity,
+              "renditions": renditions, "layers": None}
+
+    if spec.wt_type == "text":
+        if not spec.text:
+            raise ValueError("The text of the watermark is empty")
+        if spec.size <= 0:
+            raise ValueError(f"The font size must be positive : {spec.size}")
+        ImageColor.getrgb(spec.color)
+        return Preset(text=spec.text, font=find_font(spec.font), size=spec.size, color=spec.color, logo=None,
+                      **common)
+    if spec.wt_type == "image":
+        if not spec.logo:
+            raise ValueError("The logo of the watermark is missing")
+        logo = os.path.abspath(spec.logo)
+        get_logo(logo)
+        return Preset(text=None, font=None, size=None, color=None, logo=logo, **common)
+    if spec.wt_type == "layers":
+        if not spec.layers:
+            raise ValueError("The layered watermark has no layer")
+        common["layers"] = [compile_layer(layer) for layer in spec.layers]
+        return Preset(text=None, font=None, size=None, color=None, logo=None, **common)
+    raise ValueError(f"Unknown watermark type : {spec.wt_type}")
+
+
+def spec_from_dict(data):
+    """Build a watermark spec from the content of a preset file.
+
+    :param data: The settings of the watermark, the missing ones keep their default value.
+    :type data: dict
+
+    :return: The settings of the watermark.
+    :rtype: WatermarkSpec
+
+    :raise ValueError: The preset has unknown settings or a newer version.
+    """
+    data = dict(data)
+    version = data.pop("version", PRESET_VERSION)
+    if version > PRESET_VERSION:
+        raise ValueError(f"The preset version {version} is not supported")
+    unknown = set(data) - set(WatermarkSpec._fields)
+    if unknown:
+        raise ValueError(f"Unknown preset settings : {', '.join(sorted(unknown))}")
+    return WatermarkSpec(**data)
+
+
+def load_preset(path):
+    """Load a watermark spec from a JSON or TOML preset file, by extension.
+
+    :param path: The path of the preset file.
+    :type path: str
+
+    :return: The settings of the watermark.
+    :rtype: WatermarkSpec
+    """
+    if path.lower().endswith(".toml"):
+        if tomllib is None:
+            raise ValueError("Reading TOML presets requires Python 3.11")
+        with open(path, "rb") as f:
+            return spec_from_dict(tomllib.load(f))
+    with open(path, "r", encoding="utf-8") as f:
+        return spec_from_dict(json.load(f))
+
+
+def save_preset(spec, path):
+    """Save a watermark spec in a JSON or TOML preset file, by extension.
+    The unset settings are not written.
+
+    :param spec: The settings of the watermark.
+    :param path: The path of the preset file.
+    :type spec: WatermarkSpec
+    :type path: str
+    """
+    data = {"version": PRESET_VERSION}
+    data.update((key, value) for key, value in spec._asdict().items() if value is not None)
+    with open(path, "w", encoding="utf-8") as f:
+        if path.lower().endswith(".toml"):
+            f.write(_toml_table(data))
+        else:
+            json.dump(data, f, indent=2)
+
+
+def _toml_table(data, name=None, array=False):
+    """Write a table of a TOML document, the sub-tables and the arrays of tables after the values.
+
+    :param data: The content of the table, strings, numbers, booleans, lists, tables and lists of tables.
+    :param name: The dotted name of the table, None for the root table.
+    :param array: True to write the table as an item of an array of tables.
+    :type data: dict
+    :type name: str
+    :type array: bool
+
+    :return: The TOML text of the table and its sub-tables.
+    :rtype: str
+    """
+    lines = [f"[[{name}]]" if array else f"[{name}]"] if name is not None else []
+    tables = []
+    arrays = []
+    for key, value in data.items():
+        if value is None:
+            continue
+        if isinstance(value, dict):
+            tables.append((key, value))
+        elif isinstance(value, list) and value and all(isinstance(item, dict) for item in value):
+            arrays.append((key, value))
+        elif isinstance(value, bool):
+            lines.append(f"{_toml_key(key)} = {str(value).lower()}")
+        else:
+            lines.append(f"{_toml_key(key)} = {json.dumps(value)}")
+    text = "\n".join(lines) + "\n" if lines else ""
+    for key, value in tables:
+        text += "\n" + _toml_table(value, _toml_key(key) if name is None else f"{name}.{_toml_key(key)}")
+    for key, value in arrays:
+        for item in value:
+            text += "\n" + _toml_table(item, _toml_key(key) if name is None else f"{name}.{_toml_key(key)}", True)
+    return text
+
+
+def _toml_key(key):
+    """Quote a TOML key when it is not a bare key.
+
+    :param key: The key.
+    :type key: str
+
+    :return: The key as written in TOML.
+    :rtype: str
+    """
+    return key if re.fullmatch(r"[A-Za-z0-9_-]+", key) else json.dumps(key)
@@ -0,0 +1,115 @@
+import glob
+import itertools
+import os
+
+
+SIGNATURES = (
+    (b"\xff\xd8\xff", "JPEG"),
+    (b"\x89PNG\r\n\x1a\n", "PNG"),
+    (b"GIF87a", "GIF"),
+    (b"GIF89a", "GIF"),
+    (b"II*\x00", "TIFF"),
+    (b"MM\x00*", "TIFF"),
+    (b"BM", "BMP"),
+)
+
+
+def image_format(path):
+    """Identify the format of an image file from its first bytes.
+
+    :param path: The path of the file.
+    :type path: str
+
+    :return: The name of the image format, None if the file is not a supported image.
+    :rtype: str
+    """
+    try:
+        with open(path, "rb") as f:
+            header = f.read(12)
+    except OSError:
+        return None
+    if header[:4] == b"RIFF" and header[8:12] == b"WEBP":
+        return "WEBP"
+    if header[:1] == b"P" and header[1:2] in (b"4", b"5", b"6") and header[2:3].isspace():
+        # The binary PBM, PGM and PPM files.
+        return "PPM"
+    for signature, name in SIGNATURES:
+        if header.startswith(signature):
+            return name
+    return None
+
+
+def walk(directory, exclude=()):
+    """Walk recursively through a directory and yield its files.
+    Only the directories still to visit are kept in memory.
+
+    :param directory: The path of the directory.
+    :param exclude: The names of the directories to skip.
+    :type directory: str
+    :type exclude: tuple
+
+    :return: A generator of the paths of the files.
+    :rtype: generator
+    """
+    stack = [directory]
+    while stack:
+        try:
+            with os.scandir(stack.pop()) as entries:
+                for entry in entries:
+                    if entry.is_dir(follow_symlinks=False):
+                        if entry.name not in exclude:
+                            stack.append(entry.path)
+                    elif entry.is_file():
+                        yield entry.path
+        except OSError:
+            continue
+
+
+def scan(paths, exclude=(), seen=None, stop=None):
+    """Walk lazily through files, directories and glob patterns and yield the image files.
+    The directories are walked recursively without listing the whole tree up front,
+    the files are identified by their signature and not by their extension.
+
+    :param paths: The files, directories or glob patterns.
+    :param exclude: The names of the directories to skip.
+    :param seen: The set of the paths already yielded, updated in place.
+    :param stop: An event ending the walk before the next file when it is set, from another thread.
+    :type paths: list
+    :type exclude: tuple
+    :type seen: set
+    :type stop: threading.Event
+
+    :return: A generator of the absolute paths of the image files.
+    :rtype: generator
+    """
+    seen = set() if seen is None else seen
+    for pattern in paths:
+        matches = glob.iglob(pattern, recursive=True) if glob.has_magic(pattern) else [pattern]
+        for match in matches:
+            files = walk(match, exclude) if os.path.isdir(match) else [match]
+            for path in files:
+                if stop is not None and stop.is_set():
+                    return
+                path = os.path.abspath(path)
+                if path not in seen and image_format(path):
+                    seen.add(path)
+                    yield path
+
+
+def chunked(iterable, size):
+    """Split an iterable in lists of a given size, lazily.
+
+    :param iterable: The iterable to split.
+    :param size: The maximum size of the chunks.
+    :type iterable: iterable
+    :type size: int
+
+    :return: A generator of lists.
+    :rtype: generator
+    """
+    iterator = iter(iterable)
+    while True:
+        chunk = list(itertools.islice(iterator, size))
+        if not chunk:
+            return
+        yield chunk
@@ -0,0 +1,180 @@
+import contextlib
+import os
+import threading
+
+from PIL import Image
+
+from package.api.encoding import ALPHA_FORMATS, EncoderSettings
+from package.api.image import pixel_bytes
+from package.api.position import TILED
+from package.api.stream import can_stream, stream_footprint, unbounded_pixels
+
+
+def physical_memory():
+    """Get the physical memory of the machine.
+
+    :return: The size of the memory in bytes, None if it cannot be found on this platform.
+    :rtype: int
+    """
+    try:
+        return os.sysconf("SC_PHYS_PAGES") * os.sysconf("SC_PAGE_SIZE")
+    except (AttributeError, ValueError, OSError):
+        return None
+
+
+def default_budget():
+    """Get the default memory budget of the decoded pixels: half of the physical memory.
+
+    :return: The budget in bytes, None if the physical memory is unknown.
+    :rtype: int
+    """
+    memory = physical_memory()
+    return memory // 2 if memory else None
+
+
+def job_footprint(mode, size, pos="bottom right", wt_type="text", fmt=None, encoder=None):
+    """Estimate the peak memory of the pixel buffers of a watermark job.
+    The source is decoded entirely. The tiled watermarks add a full copy of the image and the tiled canvas,
+    the formats without alpha add a flattened copy of the transparent images.
+
+    :param mode: The mode of the source image.
+    :param size: The size of the source image.
+    :param pos: The position name of the watermark.
+    :param wt_type: The type of the watermark ("text" or "image").
+    :param fmt: The format of the source image.
+    :param encoder: The settings of the output encoding.
+    :type mode: str
+    :type size: (int, int)
+    :type pos: str
+    :type wt_type: str
+    :type fmt: str
+    :type encoder: EncoderSettings
+
+    :return: The estimated number of bytes.
+    :rtype: int
+    """
+    decoded = pixel_bytes(mode, size)
+    footprint = decoded
+    if pos == TILED:
+        # The copy of the source and the canvas: an L mask for a text, an RGBA layer and its mask for a logo.
+        footprint += decoded + pixel_bytes("RGBA" if wt_type == "image" else "L", size)
+        if wt_type == "image":
+            footprint += pixel_bytes("L", size)
+    output_format = (encoder or EncoderSettings()).output_format(fmt)
+    if mode in ("RGBA", "LA", "P") and output_format not in ALPHA_FORMATS:
+        footprint += pixel_bytes("RGB", size)
+    return footprint
+
+
+def image_footprint(path, **options):
+    """Estimate the peak memory of a watermark job from the header of its source image.
+    Only the header is read, the pixels are not decoded. A streamed job only holds a few bands of the image.
+
+    :param path: The path of the image file.
+    :param options: The keyword arguments of :func:`package.api.batch.process_image`.
+    :type path: str
+
+    :return: The estimated number of bytes, 0 if the file cannot be read.
+    :rtype: int
+    """
+    stream = options.get("stream") and not options.get("renditions")
+    try:
+        with unbounded_pixels() if stream else contextlib.nullcontext(), Image.open(path) as image:
+            mode, size, fmt = image.mode, image.size, image.format
+            stream = stream and can_stream(image, options.get("encoder") or EncoderSettings())
+    except OSError:
+        return 0
+    pos, wt_type = options.get("pos", "bottom right"), options.get("wt_type", "text")
+    if any(layer.pos == TILED for layer in options.get("layers") or ()):
+        pos, wt_type = TILED, "image"
+    footprint = job_footprint(mode, size, pos, wt_type, fmt, options.get("encoder"))
+    return min(footprint, stream_footprint(mode, size[0], size[1])) if stream else footprint
+
+
+class MemoryScheduler:
+    """The MemoryScheduler class admits jobs while their estimated memory stays under a budget.
+    A job larger than the budget is admitted alone, so every job eventually runs.
+
+    Attributes:
+        **budget** *(int)*: The maximum number of bytes of the admitted jobs, no limit if None.
+
+        **used** *(int)*: The number of bytes of the admitted jobs not finished yet.
+
+        **peak** *(int)*: The highest number of bytes admitted at once.
+    """
+
+    def __init__(self, budget=None):
+        """The constructor of the scheduler.
+
+        :param budget: The maximum number of bytes of the admitted jobs, no limit if None.
+        :type budget: int
+        """
+        self.budget = budget
+        self.used = 0
+        self.peak = 0
+        self._admitted = 0
+        self._condition = threading.Condition()
+
+    def fits(self, footprint):
+        """Check if a job can be admitted now.
+
+        :param footprint: The estimated number of bytes of the job.
+        :type footprint: int
+
+        :return: True if the job fits in the budget.
+        :rtype: bool
+        """
+        return self.budget is None or not self._admitted or self.used + footprint <= self.budget
+
+    def try_acquire(self, footprint):
+        """Admit a job if it fits in the budget, without waiting.
+
+        :param footprint: The estimated number of bytes of the job.
+        :type footprint: int
+
+        :return: True if the job is admitted.
+        :rtype: bool
+        """
+        with self._condition:
+            if not self.fits(footprint):
+                return False
+            self._admit(footprint)
+            return True
+
+    def acquire(self, footprint, timeout=None):
+        """Wait until a job fits in the budget and admit it.
+
+        :param footprint: The estimated number of bytes of the job.
+        :param timeout: The maximum waiting time in seconds, no limit if None.
+        :type footprint: int
+        :type timeout: float
+
+        :return: True if the job is admitted, False if the timeout expired.
+        :rtype: bool
+        """
+        with self._condition:
+            if not self._condition.wait_for(lambda: self.fits(footprint), timeout):
+                return False
+            self._admit(footprint)
+            return True
+
+    def release(self, footprint):
+        """Give back the memory of a finished job.
+
+        :param footprint: The estimated number of bytes of the job, as admitted.
+        :type footprint: int
+        """
+        with self._condition:
+            self.used -= footprint
+            self._admitted -= 1
+            self._condition.notify_all()
+
+    def _admit(self, footprint):
+        """Count an admitted job, the lock must be held.
+
+        :param footprint: The estimated number of bytes of the job.
+        :type footprint: int
+        """
+        self.used += footprint
+        self._admitted += 1
+        self.peak = max(self.peak, self.used)
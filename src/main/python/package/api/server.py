@@ -0,0 +1,462 @@
+"""A local HTTP service watermarking images in memory.
+
+Run it with ``python -m package.api.server --port 8765`` then post an image::
+
+    curl --data-binary @photo.jpg "http://127.0.0.1:8765/watermark?text=pyWatermark&position=tiled" -o out.jpg
+    curl "http://127.0.0.1:8765/watermark?path=/photos/photo.jpg&type=image&logo=/photos/logo.png" -o out.jpg
+    curl "http://127.0.0.1:8765/metrics"
+"""
+import argparse
+import asyncio
+import collections
+import concurrent.futures
+import functools
+import json
+import os
+import sys
+import time
+import urllib.parse
+
+from PIL import ImageColor
+
+from package.api.encoding import EncoderSettings
+from package.api.fonts import default_family, find_font
+from package.api.image import OUTPUT_BUFFER, CustomImage
+from package.api.instrumentation import StatsCollector, percentile
+from package.api.position import WATERMARK_POSITION
+from package.api.stamp import TILE_ANGLE, TILE_OPACITY
+
+
+MAX_BODY_SIZE = 256 * 1024 * 1024
+
+LATENCY_WINDOW = 1000
+
+CONTENT_TYPES = {
+    "JPEG": "image/jpeg",
+    "PNG": "image/png",
+    "WEBP": "image/webp",
+    "TIFF": "image/tiff",
+    "BMP": "image/bmp",
+    "GIF": "image/gif",
+}
+
+REASONS = {
+    200: "OK",
+    400: "Bad Request",
+    404: "Not Found",
+    405: "Method Not Allowed",
+    413: "Payload Too Large",
+    500: "Internal Server Error",
+    503: "Service Unavailable",
+}
+
+
+class RequestError(Exception):
+    """The RequestError exception reports a request the server rejects.
+
+    Attributes:
+        **status** *(int)*: The HTTP status of the response.
+    """
+
+    def __init__(self, status, message):
+        """The constructor of the exception.
+
+        :param status: The HTTP status of the response.
+        :param message: The description of the error.
+        :type status: int
+        :type message: str
+        """
+        super().__init__(message)
+        self.status = status
+
+
+def parse_spec(params):
+    """Build the watermark specification from the query parameters of a request.
+
+    :param params: The query parameters, as returned by :func:`urllib.parse.parse_qs`.
+    :type params: dict
+
+    :return: The keyword arguments of :func:`watermark_bytes`, with the path of the font file.
+    :rtype: dict
+
+    :raise RequestError: A parameter is invalid or the font is not installed.
+    """
+    def get(name, default=None, convert=str):
+        values = params.get(name)
+        if not values:
+            return default
+        try:
+            return convert(values[-1])
+        except ValueError:
+            raise RequestError(400, f"Invalid value of {name} : {values[-1]}")
+
+    def color(value):
+        ImageColor.getrgb(value)
+        return value
+
+    def opacity(value):
+        value = float(value)
+        if not 0 <= value <= 1:
+            raise ValueError(f"The opacity must be between 0 and 1 : {value}")
+        return value
+
+    spec = {
+        "wt_type": get("type", "text"),
+        "pos": get("position", "bottom right"),
+        "margin": get("margin", 25, int),
+        "text": get("text", "watermark"),
+        "font": get("font") or default_family(),
+        "size": get("size", 75, int),
+        "color": get("color", "#000000", color),
+        "logo": get("logo"),
+        "stamp": get("stamp", False, lambda value: value.lower() in ("1", "true", "yes")),
+        "angle": get("angle", TILE_ANGLE, float),
+        "opacity": get("opacity", TILE_OPACITY, opacity),
+        "format": get("format"),
+        "quality": get("quality", None, int),
+    }
+    if spec["wt_type"] not in ("text", "image"):
+        raise RequestError(400, f"Unknown watermark type : {spec['wt_type']}")
+    if spec["pos"] not in WATERMARK_POSITION:
+        raise RequestError(400, f"Unknown position : {spec['pos']}")
+    if spec["wt_type"] == "image" and not spec["logo"]:
+        raise RequestError(400, "The logo parameter is required with the image type")
+    if spec["wt_type"] == "text":
+        if spec["font"] is None:
+            raise RequestError(400, "No font is installed, the font parameter is required")
+        try:
+            spec["font"] = find_font(spec["font"])
+        except OSError as e:
+            raise RequestError(400, str(e))
+    return spec
+
+
+def watermark_bytes(source, wt_type="text", pos="bottom right", margin=25, text=None, font=None, size=None,
+                    color=None, logo=None, stamp=False, angle=TILE_ANGLE, opacity=TILE_OPACITY, format=None,
+                    quality=None):
+    """Watermark an image held in memory or in a local file and get the encoded result, without any temporary file.
+    This function is executed in the executor of the server, it must stay at module level to be picklable.
+
+    :param source: The encoded image, or the path of a local image file.
+    :param wt_type: The type of the watermark ("text" or "image").
+    :param pos: The position name of the watermark.
+    :param margin: The margin between the image border and the watermark.
+    :param text: The text of the watermark.
+    :param font: The font path of the watermark.
+    :param size: The font size of the watermark.
+    :param color: The color of the watermark.
+    :param logo: The path of the image watermark.
+    :param stamp: True to paste a watermark pre-rendered once per image size.
+    :param angle: The rotation of the tiled watermark, in degrees.
+    :param opacity: The opacity of the tiled watermark, between 0 and 1.
+    :param format: The output format, the source format if None.
+    :param quality: The JPEG and WEBP quality.
+    :type source: bytes or str
+    :type wt_type: str
+    :type pos: str
+    :type margin: int
+    :type text: str
+    :type font: str
+    :type size: int
+    :type color: str
+    :type logo: str
+    :type stamp: bool
+    :type angle: float
+    :type opacity: float
+    :type format: str
+    :type quality: int
+
+    :return: The encoded watermarked image, its format and the records of the job.
+    :rtype: (bytes, str, dict)
+    """
+    options = {}
+    if quality is not None:
+        options = {"JPEG": {"quality": quality}, "WEBP": {"quality": quality}}
+    encoder = EncoderSettings(format=format, options=options)
+
+    with CustomImage(source, margin=margin, encoder=encoder, output=OUTPUT_BUFFER) as image:
+        if wt_type == "text":
+            result = image.watermark_text(text, color, font, size, pos, stamp=stamp, angle=angle, opacity=opacity)
+        else:
+            result = image.watermark_image(logo, pos, stamp=stamp, angle=angle, opacity=opacity)
+    return result.data, result.format, image.recorder.to_dict()
+
+
+class WatermarkServer:
+    """The WatermarkServer class serves the watermark operation over HTTP on the local machine.
+
+    ``POST /watermark`` watermarks the image of the body, ``GET /watermark?path=...`` a local image file.
+    The watermark specification is given in the query string and the response holds the encoded image.
+    ``GET /metrics`` returns the throughput and latency statistics as JSON.
+
+    The images are watermarked in a bounded executor. The requests beyond the queue depth limit
+    are rejected with a 503 status instead of piling up in memory.
+
+    Attributes:
+        **host** *(str)*: The address the server listens on.
+
+        **port** *(int)*: The port the server listens on, the port picked by the system once started if 0.
+
+        **workers** *(int)*: The number of workers of the executor.
+
+        **max_queue** *(int)*: The maximum number of requests in progress or waiting for a worker.
+
+        **collector** *(StatsCollector)*: The aggregator of the jobs statistics.
+    """
+
+    def __init__(self, host="127.0.0.1", port=8765, workers=None, max_queue=None, executor=None):
+        """The constructor of the server.
+
+        :param host: The address the server listens on.
+        :param port: The port the server listens on, 0 to let the system pick one.
+        :param workers: The number of worker processes, the number of CPUs if None.
+        :param max_queue: The maximum number of requests in progress or waiting, 4 per worker if None.
+        :param executor: The executor running the watermark jobs, a process pool if None.
+        :type host: str
+        :type port: int
+        :type workers: int
+        :type max_queue: int
+        :type executor: concurrent.futures.Executor
+        """
+        self.host = host
+        self.port = port
+        self.workers = workers or os.cpu_count() or 1
+        self.max_queue = max_queue or self.workers * 4
+        self.collector = StatsCollector()
+        self._executor = executor
+        self._owns_executor = executor is None
+        self._server = None
+        self._in_flight = 0
+        self._counters = collections.Counter()
+        self._latencies = collections.deque(maxlen=LATENCY_WINDOW)
+        self._pending = set()
+
+    async def start(self):
+        """Create the executor and start listening.
+        The worker processes are started before the server socket exists: forked by a request, they would inherit
+        its connection and keep it open after the response.
+        """
+        if self._executor is None:
+            self._executor = concurrent.futures.ProcessPoolExecutor(max_workers=self.workers)
+            await asyncio.gather(*(asyncio.wrap_future(self._executor.submit(os.getpid))
+                                   for _ in range(self.workers)))
+        self._server = await asyncio.start_server(self._handle, self.host, self.port)
+        self.port = self._server.sockets[0].getsockname()[1]
+
+    async def stop(self):
+        """Stop listening and shut the executor down."""
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+            self._server = None
+        if self._owns_executor and self._executor is not None:
+            # The jobs not started are cancelled by hand, shutdown(cancel_futures=True) needs Python 3.9.
+            for future in list(self._pending):
+                future.cancel()
+            self._executor.shutdown(wait=True)
+            self._executor = None
+
+    async def serve_forever(self):
+        """Start the server and serve until it is cancelled."""
+        await self.start()
+        try:
+            await self._server.serve_forever()
+        finally:
+            await self.stop()
+
+    async def __aenter__(self):
+        await self.start()
+        return self
+
+    async def __aexit__(self, exc_type, exc_value, traceback):
+        await self.stop()
+
+    def metrics(self):
+        """Get the statistics of the server.
+
+        :return: The request counters, the queue state, the latency percentiles and the jobs statistics.
+        :rtype: dict
+        """
+        latencies = sorted(self._latencies)
+        return {
+            "requests": self._counters["requests"],
+            "completed": self._counters["completed"],
+            "failed": self._counters["failed"],
+            "rejected": self._counters["rejected"],
+            "in_flight": self._in_flight,
+            "max_queue": self.max_queue,
+            "workers": self.workers,
+            "latency": {"p50": percentile(latencies, 50), "p95": percentile(latencies, 95),
+                        "p99": percentile(latencies, 99)},
+            "jobs": self.collector.summary(),
+        }
+
+    async def watermark(self, source, spec):
+        """Watermark an image in the executor.
+
+        :param source: The encoded image, or the path of a local image file.
+        :param spec: The keyword arguments of :func:`watermark_bytes`.
+        :type source: bytes or str
+        :type spec: dict
+
+        :raise RequestError: If the queue of the server is full.
+
+        :return: The encoded watermarked image and its format.
+        :rtype: (bytes, str)
+        """
+        if self._in_flight >= self.max_queue:
+            self._counters["rejected"] += 1
+            raise RequestError(503, "Too many images in progress, retry later")
+
+        self._in_flight += 1
+        start = time.perf_counter()
+        try:
+            future = self._executor.submit(functools.partial(watermark_bytes, source, **spec))
+            self._pending.add(future)
+            future.add_done_callback(self._pending.discard)
+            data, fmt, stats = await asyncio.wrap_future(future)
+        except Exception:
+            self._counters["failed"] += 1
+            raise
+        finally:
+            self._in_flight -= 1
+        self._latencies.append(time.perf_counter() - start)
+        self._counters["completed"] += 1
+        self.collector.add(stats)
+        return data, fmt
+
+    async def _handle(self, reader, writer):
+        """Serve the requests of a connection, kept alive until the client closes it.
+
+        :param reader: The stream of the connection.
+        :param writer: The writer of the connection.
+        :type reader: asyncio.StreamReader
+        :type writer: asyncio.StreamWriter
+        """
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line.strip():
+                    break
+                keep_alive = await self._serve(request_line, reader, writer)
+                await writer.drain()
+                if not keep_alive:
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+    async def _serve(self, request_line, reader, writer):
+        """Serve one request.
+
+        :param request_line: The first line of the request.
+        :param reader: The stream of the connection.
+        :param writer: The writer of the connection.
+        :type request_line: bytes
+        :type reader: asyncio.StreamReader
+        :type writer: asyncio.StreamWriter
+
+        :return: True if the connection can serve another request.
+        :rtype: bool
+        """
+        headers = {}
+        while True:
+            line = await reader.readline()
+            if line in (b"\r\n", b"\n", b""):
+                break
+            name, _, value = line.decode("latin-1").partition(":")
+            headers[name.strip().lower()] = value.strip()
+        keep_alive = headers.get("connection", "").lower() != "close"
+
+        try:
+            method, target, _ = request_line.decode("latin-1").split(" ", 2)
+            length = int(headers.get("content-length", 0))
+        except ValueError:
+            self._respond(writer, 400, b"Malformed request", "text/plain", keep_alive=False)
+            return False
+        if length < 0:
+            self._respond(writer, 400, b"Malformed request", "text/plain", keep_alive=False)
+            return False
+        if length > MAX_BODY_SIZE:
+            self._respond(writer, 413, b"The image is too large", "text/plain", keep_alive=False)
+            return False
+        body = await reader.readexactly(length) if length else b""
+
+        self._counters["requests"] += 1
+        url = urllib.parse.urlsplit(target)
+        params = urllib.parse.parse_qs(url.query)
+        try:
+            if url.path == "/metrics" and method == "GET":
+                self._respond(writer, 200, json.dumps(self.metrics()).encode(), "application/json", keep_alive)
+            elif url.path == "/watermark" and method in ("GET", "POST"):
+                spec = parse_spec(params)
+                source = params["path"][-1] if "path" in params else body
+                if not source:
+                    raise RequestError(400, "Post an image or give the path of a local image")
+                data, fmt = await self.watermark(source, spec)
+                self._respond(writer, 200, data, CONTENT_TYPES.get(fmt, "application/octet-stream"), keep_alive)
+            elif url.path in ("/metrics", "/watermark"):
+                raise RequestError(405, f"{method} is not allowed on {url.path}")
+            else:
+                raise RequestError(404, f"Unknown path : {url.path}")
+        except RequestError as e:
+            extra = {"Retry-After": "1"} if e.status == 503 else None
+            self._respond(writer, e.status, str(e).encode(), "text/plain", keep_alive, extra)
+        except Exception as e:
+            self._respond(writer, 500, f"{type(e).__name__}: {e}".encode(), "text/plain", keep_alive)
+        return keep_alive
+
+    @staticmethod
+    def _respond(writer, status, body, content_type, keep_alive=True, extra=None):
+        """Write a response.
+
+        :param writer: The writer of the connection.
+        :param status: The HTTP status.
+        :param body: The body of the response.
+        :param content_type: The content type of the body.
+        :param keep_alive: False to close the connection after the response.
+        :param extra: Other headers of the response.
+        :type writer: asyncio.StreamWriter
+        :type status: int
+        :type body: bytes
+        :type content_type: str
+        :type keep_alive: bool
+        :type extra: dict
+        """
+        headers = {"Content-Type": content_type, "Content-Length": str(len(body)),
+                   "Connection": "keep-alive" if keep_alive else "close"}
+        headers.update(extra or {})
+        head = f"HTTP/1.1 {status} {REASONS[status]}\r\n"
+        head += "".join(f"{name}: {value}\r\n" for name, value in headers.items())
+        writer.write(head.encode("latin-1") + b"\r\n" + body)
+
+
+def main(argv=None):
+    """Run the server until it is interrupted.
+
+    :param argv: The command line arguments, sys.argv if None.
+    :type argv: list
+
+    :return: The exit code.
+    :rtype: int
+    """
+    parser = argparse.ArgumentParser(prog="python -m package.api.server", description="Watermark images over HTTP.")
+    parser.add_argument("--host", default="127.0.0.1", help="The address to listen on, the local machine only.")
+    parser.add_argument("--port", type=int, default=8765, help="The port to listen on.")
+    parser.add_argument("-j", "--jobs", type=int, default=None,
+                        help="The number of worker processes, the number of CPUs by default.")
+    parser.add_argument("--max-queue", type=int, default=None,
+                        help="The number of images in progress beyond which the requests are rejected.")
+    args = parser.parse_args(argv)
+
+    server = WatermarkServer(args.host, args.port, workers=args.jobs, max_queue=args.max_queue)
+    try:
+        asyncio.run(server.serve_forever())
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
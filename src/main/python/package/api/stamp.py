@@ -0,0 +1,503 @@
+import collections
+import os
+
+from PIL import Image, ImageChops
+
+from package.api.cache import STAMPS, TILES, get_logo, get_text_layer
+from package.api.position import TILED, watermark_position
+
+
+TILE_ANGLE = 30
+
+TILE_OPACITY = 0.5
+
+BLEND_MODES = {
+    "normal": None,
+    "multiply": ImageChops.multiply,
+    "screen": ImageChops.screen,
+    "overlay": ImageChops.overlay,
+    "soft light": ImageChops.soft_light,
+    "hard light": ImageChops.hard_light,
+    "darken": ImageChops.darker,
+    "lighten": ImageChops.lighter,
+    "difference": ImageChops.difference,
+}
+
+
+Layer = collections.namedtuple("Layer", ("wt_type", "text", "font", "size", "color", "logo", "pos", "margin",
+                                         "opacity", "blend", "angle", "scale"),
+                               defaults=("text", None, None, None, None, None, "bottom right", 25, None, "normal",
+                                         TILE_ANGLE, 1.0))
+Layer.__doc__ = """A watermark of a layered watermark, see :meth:`package.api.image.CustomImage.watermark_layers`.
+
+    Attributes:
+        **wt_type** *(str)*: The type of the watermark ("text" or "image").
+
+        **text** *(str)*: The text of the watermark.
+
+        **font** *(str)*: The font family, file name or path of the text.
+
+        **size** *(int)*: The font size of the text.
+
+        **color** *(str)*: The color of the text, any color name or code of PIL.
+
+        **logo** *(str)*: The path of the image watermark.
+
+        **pos** *(str)*: The position name of the watermark, "tiled" to repeat it over the whole image.
+
+        **margin** *(int)*: The margin between the image border and the watermark, or between the tiles.
+
+        **opacity** *(float)*: The opacity of the watermark, between 0 and 1,
+        :data:`TILE_OPACITY` for a tiled watermark and opaque otherwise if None.
+
+        **blend** *(str)*: The blend mode of the watermark, one of :data:`BLEND_MODES`.
+
+        **angle** *(float)*: The rotation of the tiled watermark, in degrees.
+
+        **scale** *(float)*: The scale of the image watermark, 1 for its original size.
+    """
+
+
+class Stamp:
+    """The Stamp class holds a watermark rendered once and placed for a given image size.
+    Applying it costs a single paste, whatever the watermark is.
+
+    Attributes:
+        **tile** *(Image)*: The RGBA rendering of the watermark.
+
+        **mask** *(Image)*: The alpha mask of the watermark.
+
+        **position** *((int, int))*: The top left corner of the watermark on the image.
+    """
+
+    def __init__(self, tile, pos_name, margin, size):
+        """The constructor of the stamp.
+
+        :param tile: The RGBA rendering of the watermark.
+        :param pos_name: The position name of the watermark.
+        :param margin: The margin between the image border and the watermark.
+        :param size: The size of the images to stamp.
+        :type tile: Image
+        :type pos_name: str
+        :type margin: int
+        :type size: (int, int)
+        """
+        self.tile = tile
+        self.mask = tile.getchannel("A")
+        self.position = watermark_position(pos_name, size[0], size[1], tile.width, tile.height, margin)
+
+    @property
+    def box(self):
+        """The bounding box of the watermark on the image.
+
+        :return: The left, upper, right and lower coordinates of the watermark.
+        :rtype: (int, int, int, int)
+        """
+        x, y = self.position
+        return x, y, x + self.tile.width, y + self.tile.height
+
+    def apply(self, image, origin=(0, 0)):
+        """Composite the watermark on an image or on a region of an image.
+
+        :param image: The image to stamp, modified in place.
+        :param origin: The coordinates of the region in the full image.
+        :type image: Image
+        :type origin: (int, int)
+        """
+        x, y = self.position[0] - origin[0], self.position[1] - origin[1]
+        composite(image, self.tile, self.mask, (x, y, x + self.tile.width, y + self.tile.height))
+
+    def overlay(self, box):
+        """Get the pixels and the alpha mask of the watermark over a region of the image.
+        The region outside the watermark is transparent.
+
+        :param box: The region of the image.
+        :type box: (int, int, int, int)
+
+        :return: The RGBA pixels or the fill color, and the alpha mask.
+        :rtype: (Image or (int, int, int), Image)
+        """
+        x, y = self.position
+        box = (box[0] - x, box[1] - y, box[2] - x, box[3] - y)
+        return self.tile.crop(box), self.mask.crop(box)
+
+    def blend(self, image, origin=(0, 0), mode="normal"):
+        """Blend the watermark on an image or on a region of an image with a blend mode.
+        The blended pixels are composited with the alpha of the watermark, the image keeps its alpha.
+
+        :param image: The image to stamp, modified in place.
+        :param origin: The coordinates of the region in the full image.
+        :param mode: The blend mode, one of :data:`BLEND_MODES`.
+        :type image: Image
+        :type origin: (int, int)
+        :type mode: str
+        """
+        operation = BLEND_MODES[mode]
+        if operation is None:
+            self.apply(image, origin)
+            return
+        box = self.box
+        box = (max(box[0], origin[0]), max(box[1], origin[1]),
+               min(box[2], origin[0] + image.width), min(box[3], origin[1] + image.height))
+        if box[0] >= box[2] or box[1] >= box[3]:
+            return
+        local = (box[0] - origin[0], box[1] - origin[1], box[2] - origin[0], box[3] - origin[1])
+        part = image.crop(local)
+        tile, mask = self.overlay(box)
+        if not isinstance(tile, Image.Image):
+            tile = Image.new("RGB", part.size, tile)
+        blended = operation(part.convert("RGB"), tile.convert("RGB"))
+        if part.mode in ("RGBA", "LA"):
+            blended = blended.convert(part.mode)
+            blended.putalpha(part.getchannel("A"))
+        image.paste(blended, local[:2], mask=mask)
+
+
+def composite(image, tile, mask, box):
+    """Composite a watermark on a region of an image through its alpha mask.
+    The images with an alpha channel are alpha composited like the drawing path does: a paste with a mask
+    would blend their alpha with the mask and make the edges of the watermark semi-transparent.
+    The palette images are composited in RGBA then mapped back to their palette, their indexes cannot be blended.
+
+    :param image: The image, modified in place.
+    :param tile: The RGBA pixels of the watermark, or its fill color.
+    :param mask: The alpha mask of the watermark.
+    :param box: The region of the watermark on the image, it may exceed the image.
+    :type image: Image
+    :type tile: Image or str or (int, int, int)
+    :type mask: Image
+    :type box: (int, int, int, int)
+    """
+    if image.mode not in ("RGBA", "LA", "P"):
+        if not isinstance(tile, Image.Image):
+            # The fill color is converted like a pixel, for the single band and the other color spaces.
+            tile = Image.new("RGB", (1, 1), tile).convert(image.mode).getpixel((0, 0))
+        image.paste(tile, box, mask=mask)
+        return
+    size = (box[2] - box[0], box[3] - box[1])
+    # The conversion copies the shared tile before its alpha is replaced by the mask.
+    overlay = tile.convert("RGBA") if isinstance(tile, Image.Image) else Image.new("RGBA", size, tile)
+    overlay.putalpha(mask)
+    region = image.crop(box).convert("RGBA")
+    region.alpha_composite(overlay)
+    if image.mode == "P":
+        region = region.convert("RGB").quantize(palette=image, dither=Image.NONE)
+    elif image.mode == "LA":
+        region = region.convert("LA")
+    image.paste(region, box[:2])
+
+
+def fade(layer, opacity):
+    """Multiply the alpha of a watermark by an opacity.
+
+    :param layer: The RGBA watermark, or the L mask of a single color watermark.
+    :param opacity: The opacity, between 0 and 1.
+    :type layer: Image
+    :type opacity: float
+
+    :return: The faded watermark, the layer itself if it is opaque.
+    :rtype: Image
+    """
+    if opacity >= 1:
+        return layer
+    alpha = layer.getchannel("A") if layer.mode == "RGBA" else layer
+    alpha = alpha.point([round(value * opacity) for value in range(256)])
+    if layer.mode != "RGBA":
+        return alpha
+    layer = layer.copy()
+    layer.putalpha(alpha)
+    return layer
+
+
+def text_stamp(text, color, font_type, font_size, pos_name, margin, size):
+    """Get the stamp of a text watermark, rendered once per configuration and image size.
+
+    :param text: The text of the watermark.
+    :param color: The color of the text.
+    :param font_type: The path of the font file.
+    :param font_size: The size of the font.
+    :param pos_name: The position name of the watermark.
+    :param margin: The margin between the image border and the watermark.
+    :param size: The size of the images to stamp.
+    :type text: str
+    :type color: (int, int, int)
+    :type font_type: str
+    :type font_size: int
+    :type pos_name: str
+    :type margin: int
+    :type size: (int, int)
+
+    :return: The stamp of the watermark.
+    :rtype: Stamp
+    """
+    key = ("text", text, color, font_type, font_size, pos_name, margin, size)
+    return STAMPS.get(key, lambda: Stamp(get_text_layer(text, color, font_type, font_size), pos_name, margin, size))
+
+
+def logo_stamp(watermark_path, pos_name, margin, size, scale=1.0):
+    """Get the stamp of an image watermark, rendered once per configuration and image size.
+
+    :param watermark_path: The path of the image watermark.
+    :param pos_name: The position name of the watermark.
+    :param margin: The margin between the image border and the watermark.
+    :param size: The size of the images to stamp.
+    :param scale: The scale of the watermark, 1 for its original size.
+    :type watermark_path: str
+    :type pos_name: str
+    :type margin: int
+    :type size: (int, int)
+    :type scale: float
+
+    :return: The stamp of the watermark.
+    :rtype: Stamp
+    """
+    key = ("image", watermark_path, os.path.getmtime(watermark_path), pos_name, margin, size, scale)
+    return STAMPS.get(key, lambda: Stamp(get_logo(watermark_path, scale).convert("RGBA"), pos_name, margin, size))
+
+
+def tile_pattern(tile, size, spacing, origin=(0, 0)):
+    """Repeat a tile over a canvas, every other row shifted by half a tile.
+    The first cell of the pattern is pasted once, then the filled area of the canvas is copied next to itself,
+    which doubles it each time: the canvas is filled with a logarithmic number of pastes.
+
+    :param tile: The tile to repeat, of any mode.
+    :param size: The size of the canvas.
+    :param spacing: The space between two tiles.
+    :param origin: The coordinates of the canvas in the pattern, to render a region of a larger canvas.
+    :type tile: Image
+    :type size: (int, int)
+    :type spacing: int
+    :type origin: (int, int)
+
+    :return: The canvas covered with the tile.
+    :rtype: Image
+    """
+    step_x, step_y = tile.width + spacing, tile.height + spacing
+    if origin != (0, 0):
+        # The pattern repeats every cell: the region is cut from a canvas starting at the same phase.
+        x, y = origin[0] % step_x, origin[1] % (2 * step_y)
+        return tile_pattern(tile, (size[0] + x, size[1] + y), spacing).crop((x, y, x + size[0], y + size[1]))
+    shift = step_x // 2
+    cell = Image.new(tile.mode, (step_x, 2 * step_y), 0)
+    cell.paste(tile, (0, 0))
+    cell.paste(tile, (shift, step_y))
+    cell.paste(tile, (shift - step_x, step_y))
+
+    canvas = Image.new(tile.mode, size, 0)
+    canvas.paste(cell, (0, 0))
+    width = cell.width
+    while width < size[0]:
+        canvas.paste(canvas.crop((0, 0, width, cell.height)), (width, 0))
+        width *= 2
+    height = cell.height
+    while height < size[1]:
+        canvas.paste(canvas.crop((0, 0, size[0], height)), (0, height))
+        height *= 2
+    return canvas
+
+
+class TiledStamp(Stamp):
+    """The TiledStamp class holds a watermark repeated over the whole image, rotated and semi-transparent.
+    The full canvas is built once per configuration and image size on first use, applying it costs a single blend.
+    The regions of a streamed image are blended with a canvas of the region only.
+
+    Attributes:
+        **layer** *(Image)*: The rotated and semi-transparent watermark, RGBA or the L mask of a single color watermark.
+
+        **fill** *((int, int, int))*: The color of a single color watermark, None if the layer is RGBA.
+
+        **spacing** *(int)*: The space between two repetitions of the watermark.
+
+        **position** *((int, int))*: The top left corner of the canvas, always the corner of the image.
+
+        **size** *((int, int))*: The size of the canvas.
+    """
+
+    def __init__(self, layer, size, angle=TILE_ANGLE, opacity=TILE_OPACITY, spacing=25, fill=None):
+        """The constructor of the tiled stamp.
+
+        :param layer: The RGBA watermark, or the L mask of a single color watermark.
+        :param size: The size of the images to stamp.
+        :param angle: The counter clockwise rotation of the watermark, in degrees.
+        :param opacity: The opacity of the watermark, between 0 and 1.
+        :param spacing: The space between two repetitions of the watermark.
+        :param fill: The color of a single color watermark, None if the layer is RGBA.
+        :type layer: Image
+        :type size: (int, int)
+        :type angle: float
+        :type opacity: float
+        :type spacing: int
+        :type fill: (int, int, int)
+        """
+        if angle % 360:
+            if layer.mode == "RGBA":
+                # Rotate the premultiplied pixels, the transparent black does not darken the edges.
+                layer = layer.convert("RGBa").rotate(angle, Image.BICUBIC, expand=True).convert("RGBA")
+            else:
+                layer = layer.rotate(angle, Image.BICUBIC, expand=True)
+        self.layer = fade(layer, opacity)
+        self.fill = fill
+        self.spacing = max(0, spacing)
+        self.position = (0, 0)
+        self.size = tuple(size)
+        self._canvas = None
+
+    def canvas(self, box=None):
+        """Get the canvas of the watermark and its alpha mask, over the image or a region of it.
+        The canvas of the whole image is built once and kept, a region is cut from it when it is built.
+
+        :param box: The region of the image, the whole image if None.
+        :type box: (int, int, int, int)
+
+        :return: The RGBA canvas or the fill color, and the alpha mask.
+        :rtype: (Image or (int, int, int), Image)
+        """
+        if box is None or tuple(box) == self.box:
+            if self._canvas is None:
+                canvas = tile_pattern(self.layer, self.size, self.spacing)
+                self._canvas = (canvas if self.fill is None else self.fill,
+                                canvas.getchannel("A") if canvas.mode == "RGBA" else canvas)
+            return self._canvas
+        if self._canvas is not None:
+            tile, mask = self._canvas
+            return tile.crop(box) if self.fill is None else tile, mask.crop(box)
+        canvas = tile_pattern(self.layer, (box[2] - box[0], box[3] - box[1]), self.spacing, box[:2])
+        return canvas if self.fill is None else self.fill, canvas.getchannel("A") if canvas.mode == "RGBA" else canvas
+
+    @property
+    def box(self):
+        """The bounding box of the watermark on the image, the whole image.
+
+        :return: The left, upper, right and lower coordinates of the watermark.
+        :rtype: (int, int, int, int)
+        """
+        return (0, 0) + self.size
+
+    def apply(self, image, origin=(0, 0)):
+        """Blend the watermark canvas on an image or on a region of an image.
+
+        :param image: The image to stamp, modified in place.
+        :param origin: The coordinates of the region in the full image.
+        :type image: Image
+        :type origin: (int, int)
+        """
+        tile, mask = self.canvas((origin[0], origin[1], origin[0] + image.width, origin[1] + image.height))
+        composite(image, tile, mask, (0, 0, image.width, image.height))
+
+    def overlay(self, box):
+        """Get the pixels and the alpha mask of the watermark over a region of the image.
+
+        :param box: The region of the image.
+        :type box: (int, int, int, int)
+
+        :return: The RGBA pixels or the fill color, and the alpha mask.
+        :rtype: (Image or (int, int, int), Image)
+        """
+        return self.canvas(box)
+
+
+def tiled_text_stamp(text, color, font_type, font_size, size, angle=TILE_ANGLE, opacity=TILE_OPACITY, spacing=25):
+    """Get the tiled stamp of a text watermark, built once per configuration and image size.
+
+    :param text: The text of the watermark.
+    :param color: The color of the text.
+    :param font_type: The path of the font file.
+    :param font_size: The size of the font.
+    :param size: The size of the images to stamp.
+    :param angle: The counter clockwise rotation of the text, in degrees.
+    :param opacity: The opacity of the text, between 0 and 1.
+    :param spacing: The space between two repetitions of the text.
+    :type text: str
+    :type color: (int, int, int)
+    :type font_type: str
+    :type font_size: int
+    :type size: (int, int)
+    :type angle: float
+    :type opacity: float
+    :type spacing: int
+
+    :return: The tiled stamp of the watermark.
+    :rtype: TiledStamp
+    """
+    key = ("text", text, color, font_type, font_size, size, angle, opacity, spacing)
+
+    def build():
+        mask = get_text_layer(text, color, font_type, font_size).getchannel("A")
+        return TiledStamp(mask, size, angle, opacity, spacing, fill=color)
+
+    return TILES.get(key, build)
+
+
+def tiled_logo_stamp(watermark_path, size, angle=TILE_ANGLE, opacity=TILE_OPACITY, spacing=25, scale=1.0):
+    """Get the tiled stamp of an image watermark, built once per configuration and image size.
+
+    :param watermark_path: The path of the image watermark.
+    :param size: The size of the images to stamp.
+    :param angle: The counter clockwise rotation of the watermark, in degrees.
+    :param opacity: The opacity of the watermark, between 0 and 1.
+    :param spacing: The space between two repetitions of the watermark.
+    :param scale: The scale of the watermark, 1 for its original size.
+    :type watermark_path: str
+    :type size: (int, int)
+    :type angle: float
+    :type opacity: float
+    :type spacing: int
+    :type scale: float
+
+    :return: The tiled stamp of the watermark.
+    :rtype: TiledStamp
+    """
+    key = ("image", watermark_path, os.path.getmtime(watermark_path), size, angle, opacity, spacing, scale)
+    return TILES.get(key, lambda: TiledStamp(get_logo(watermark_path, scale).convert("RGBA"), size, angle, opacity,
+                                             spacing))
+
+
+def layer_stamp(layer, size):
+    """Get the stamp of a watermark layer, rendered once per configuration and image size.
+
+    :param layer: The watermark layer.
+    :param size: The size of the images to stamp.
+    :type layer: Layer
+    :type size: (int, int)
+
+    :return: The stamp of the layer.
+    :rtype: Stamp
+
+    :raise ValueError: The type of the layer is unknown.
+    """
+    if layer.wt_type not in ("text", "image"):
+        raise ValueError(f"Unknown watermark type : {layer.wt_type}")
+    tiled = layer.pos == TILED
+    opacity = layer.opacity if layer.opacity is not None else TILE_OPACITY if tiled else 1.0
+    if tiled and layer.wt_type == "text":
+        return tiled_text_stamp(layer.text, layer.color, layer.font, layer.size, size, layer.angle, opacity,
+                                layer.margin)
+    if tiled:
+        return tiled_logo_stamp(layer.logo, size, layer.angle, opacity, layer.margin, layer.scale)
+
+    if layer.wt_type == "text":
+        stamp = text_stamp(layer.text, layer.color, layer.font, layer.size, layer.pos, layer.margin, size)
+        key = ("faded", layer, size)
+    else:
+        stamp = logo_stamp(layer.logo, layer.pos, layer.margin, size, layer.scale)
+        key = ("faded", layer, size, os.path.getmtime(layer.logo))
+    if opacity >= 1:
+        return stamp
+    return STAMPS.get(key, lambda: Stamp(fade(stamp.tile, opacity), layer.pos, layer.margin, size))
+
+
+def scale_layer(layer, scale):
+    """Scale a watermark layer for an image resized by a factor: its font size, logo and margin.
+
+    :param layer: The watermark layer.
+    :param scale: The scale of the image.
+    :type layer: Layer
+    :type scale: float
+
+    :return: The scaled layer.
+    :rtype: Layer
+    """
+    if scale == 1:
+        return layer
+    return layer._replace(size=max(1, round(layer.size * scale)) if layer.size else layer.size,
+                          margin=round(layer.margin * scale), scale=layer.scale * scale)
@@ -0,0 +1,288 @@
+import collections
+import contextlib
+import os
+import shutil
+import tempfile
+import threading
+
+from PIL import Image
+
+
+STREAM_FORMATS = ("TIFF", "PPM", "BMP")
+
+STREAM_MODES = ("L", "RGB", "RGBA")
+
+STREAM_BAND_BYTES = 16 * 2 ** 20
+
+
+RawTile = collections.namedtuple("RawTile", ("box", "offset", "rawmode", "stride", "orientation"))
+RawTile.__doc__ = """A strip or a tile of an image file stored without compression.
+
+    Attributes:
+        **box** *((int, int, int, int))*: The left, upper, right and lower coordinates of the tile on the image.
+
+        **offset** *(int)*: The position of the first row of the tile in the file.
+
+        **rawmode** *(str)*: The layout of the pixels in the file, like "RGB" or "BGR".
+
+        **stride** *(int)*: The number of bytes of a row in the file, padding included.
+
+        **orientation** *(int)*: 1 if the rows are stored from top to bottom, -1 from bottom to top.
+    """
+
+
+def raw_tiles(image):
+    """Get the strips or tiles of an opened image when all its pixels are stored without compression,
+    so a region can be read and rewritten in place without decoding the rest of the image.
+
+    :param image: The opened image, not loaded.
+    :type image: Image
+
+    :return: The tiles of the image, None if the image is compressed or its layout is not supported.
+    :rtype: list
+    """
+    if image.format not in STREAM_FORMATS or image.mode not in STREAM_MODES or not image.tile:
+        return None
+    tiles = []
+    for tile in image.tile:
+        codec, box, offset, args = tile
+        if codec != "raw":
+            return None
+        args = (args,) if isinstance(args, str) else tuple(args)
+        rawmode, stride, orientation = args + (None, 0, 1)[len(args):]
+        try:
+            depth = pixel_depth(image.mode, rawmode)
+        except (KeyError, ValueError):
+            return None
+        tiles.append(RawTile(box, offset, rawmode, stride or (box[2] - box[0]) * depth, orientation))
+    return tiles
+
+
+def pixel_depth(mode, rawmode):
+    """Get the number of bytes of a pixel stored in a raw mode.
+
+    :param mode: The mode of the image.
+    :param rawmode: The layout of the pixels in the file.
+    :type mode: str
+    :type rawmode: str
+
+    :return: The number of bytes per pixel.
+    :rtype: int
+
+    :raise ValueError: PIL cannot write the pixels of the mode in this layout.
+    """
+    return len(Image.new(mode, (1, 1)).tobytes("raw", rawmode))
+
+
+def can_stream(image, encoder):
+    """Check if the watermarked image can be written by rewriting the pixels of a copy of its source file:
+    the source is stored without compression and the output keeps its format and its encoding.
+
+    :param image: The opened source image, not loaded.
+    :param encoder: The settings of the output encoding.
+    :type image: Image
+    :type encoder: EncoderSettings
+
+    :return: True if the image can be streamed.
+    :rtype: bool
+    """
+    fmt = image.format
+    return (encoder.output_format(fmt) == fmt and not encoder.options.get(fmt)
+            and raw_tiles(image) is not None)
+
+
+def band_height(width, mode, band_bytes=STREAM_BAND_BYTES):
+    """Get the number of rows of the bands processed at once.
+
+    :param width: The width of the bands.
+    :param mode: The mode of the image.
+    :param band_bytes: The maximum size of the pixels of a band.
+    :type width: int
+    :type mode: str
+    :type band_bytes: int
+
+    :return: The number of rows, at least 1.
+    :rtype: int
+    """
+    # PIL stores the pixels of the multi-band modes on 4 bytes.
+    return max(1, band_bytes // max(1, width * (4 if len(mode) > 1 else 1)))
+
+
+def stream_footprint(mode, width, height, band_bytes=STREAM_BAND_BYTES):
+    """Estimate the peak memory of the pixel buffers of a streamed watermark:
+    the rows of the strips overlapping a band, the band of the region and the watermark canvas of the band.
+
+    :param mode: The mode of the image.
+    :param width: The width of the widest strip or tile.
+    :param height: The height of the watermark region.
+    :param band_bytes: The maximum size of the pixels of a band.
+    :type mode: str
+    :type width: int
+    :type height: int
+    :type band_bytes: int
+
+    :return: The estimated number of bytes.
+    :rtype: int
+    """
+    rows = min(height, band_height(width, mode, band_bytes))
+    return 3 * width * rows * (4 if len(mode) > 1 else 1)
+
+
+_OPEN_LOCK = threading.Lock()
+
+
+@contextlib.contextmanager
+def unbounded_pixels():
+    """Disable the decompression bomb check of PIL while an image is opened for streaming.
+    A streamed image is never decoded entirely, its size does not matter.
+    """
+    with _OPEN_LOCK:
+        limit = Image.MAX_IMAGE_PIXELS
+        Image.MAX_IMAGE_PIXELS = None
+        try:
+            yield
+        finally:
+            Image.MAX_IMAGE_PIXELS = limit
+
+
+class RawImageFile:
+    """The RawImageFile class reads and rewrites the pixels of the regions of an image file stored
+    without compression. Only the rows of the strips or tiles overlapping a region are read,
+    and only the bytes of the region are written back.
+
+    Attributes:
+        **file** *(file)*: The image file, opened in binary read and write mode.
+
+        **mode** *(str)*: The mode of the image.
+
+        **tiles** *(list)*: The strips or tiles of the image, see :func:`raw_tiles`.
+    """
+
+    def __init__(self, file, mode, tiles):
+        """The constructor of the raw image file.
+
+        :param file: The image file, opened in binary read and write mode.
+        :param mode: The mode of the image.
+        :param tiles: The strips or tiles of the image.
+        :type file: file
+        :type mode: str
+        :type tiles: list
+        """
+        self.file = file
+        self.mode = mode
+        self.tiles = tiles
+
+    def _overlaps(self, box):
+        """Iterate over the tiles overlapping a region.
+
+        :param box: The region of the image.
+        :type box: (int, int, int, int)
+
+        :return: The tiles and their intersection with the region.
+        :rtype: generator
+        """
+        for tile in self.tiles:
+            x0, y0, x1, y1 = tile.box
+            overlap = (max(x0, box[0]), max(y0, box[1]), min(x1, box[2]), min(y1, box[3]))
+            if overlap[0] < overlap[2] and overlap[1] < overlap[3]:
+                yield tile, overlap
+
+    def _row_offset(self, tile, y):
+        """Get the position in the file of a row of a tile.
+
+        :param tile: The tile.
+        :param y: The row, in the coordinates of the image.
+        :type tile: RawTile
+        :type y: int
+
+        :return: The position of the first byte of the row.
+        :rtype: int
+        """
+        row = y - tile.box[1] if tile.orientation > 0 else tile.box[3] - 1 - y
+        return tile.offset + row * tile.stride
+
+    def read(self, box):
+        """Decode the pixels of a region.
+
+        :param box: The region of the image.
+        :type box: (int, int, int, int)
+
+        :return: The pixels of the region.
+        :rtype: Image
+        """
+        region = Image.new(self.mode, (box[2] - box[0], box[3] - box[1]))
+        for tile, (x0, y0, x1, y1) in self._overlaps(box):
+            # The rows are read entirely and in the order of the file, then cropped to the region.
+            first = y0 if tile.orientation > 0 else y1 - 1
+            self.file.seek(self._row_offset(tile, first))
+            data = self.file.read((y1 - y0) * tile.stride)
+            width = tile.box[2] - tile.box[0]
+            rows = Image.frombuffer(self.mode, (width, y1 - y0), data, "raw", tile.rawmode, tile.stride,
+                                    tile.orientation)
+            region.paste(rows.crop((x0 - tile.box[0], 0, x1 - tile.box[0], y1 - y0)), (x0 - box[0], y0 - box[1]))
+        return region
+
+    def write(self, box, region):
+        """Encode the pixels of a region in place, the other bytes of the file are left untouched.
+
+        :param box: The region of the image.
+        :param region: The new pixels of the region.
+        :type box: (int, int, int, int)
+        :type region: Image
+        """
+        for tile, (x0, y0, x1, y1) in self._overlaps(box):
+            depth = pixel_depth(self.mode, tile.rawmode)
+            rows = region.crop((x0 - box[0], y0 - box[1], x1 - box[0], y1 - box[1]))
+            if tile.orientation < 0:
+                rows = rows.transpose(Image.FLIP_TOP_BOTTOM)
+            data = rows.tobytes("raw", tile.rawmode)
+            length = (x1 - x0) * depth
+            first = y0 if tile.orientation > 0 else y1 - 1
+            start = self._row_offset(tile, first) + (x0 - tile.box[0]) * depth
+            if length == tile.stride:
+                self.file.seek(start)
+                self.file.write(data)
+                continue
+            for index in range(y1 - y0):
+                self.file.seek(start + index * tile.stride)
+                self.file.write(data[index * length:(index + 1) * length])
+
+
+def stream_copy(source_path, output_path, tiles, mode, box, apply, band_bytes=STREAM_BAND_BYTES):
+    """Watermark an image stored without compression, band by band, without decoding it entirely.
+    The source file is copied, then the rows of the watermark region are read, watermarked and rewritten
+    in the copy, which replaces the output file once complete.
+
+    :param source_path: The path of the source image file.
+    :param output_path: The path of the watermarked image file.
+    :param tiles: The strips or tiles of the source, see :func:`raw_tiles`.
+    :param mode: The mode of the image.
+    :param box: The region of the watermark.
+    :param apply: Called with each band of the region and its coordinates on the image, watermarks it in place.
+    :param band_bytes: The maximum size of the pixels of a band.
+    :type source_path: str
+    :type output_path: str
+    :type tiles: list
+    :type mode: str
+    :type box: (int, int, int, int)
+    :type apply: callable
+    :type band_bytes: int
+    """
+    folder = os.path.dirname(output_path)
+    os.makedirs(folder, exist_ok=True)
+    fd, temp_path = tempfile.mkstemp(dir=folder, prefix=".", suffix=".tmp")
+    try:
+        with open(source_path, "rb") as source, os.fdopen(fd, "w+b") as f:
+            shutil.copyfileobj(source, f, 2 ** 20)
+            raw = RawImageFile(f, mode, tiles)
+            # The rows of the overlapped strips are read at their full width, they bound the band.
+            rows = band_height(max(tile.box[2] - tile.box[0] for tile in tiles), mode, band_bytes)
+            for y in range(box[1], box[3], rows):
+                band = (box[0], y, box[2], min(box[3], y + rows))
+                region = raw.read(band)
+                apply(region, band[:2])
+                raw.write(band, region)
+        os.replace(temp_path, output_path)
+    except BaseException:
+        os.unlink(temp_path)
+        raise
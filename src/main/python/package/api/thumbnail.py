@@ -0,0 +1,281 @@
+import concurrent.futures
+import io
+import os
+import sqlite3
+import threading
+import time
+
+from PIL import Image
+
+from package.api.fonts import user_cache_dir
+
+
+THUMBNAIL_SIZE = 64
+
+THUMBNAIL_CACHE_BYTES = 64 * 2 ** 20
+
+
+def default_cache_path():
+    """Get the path of the thumbnail cache in the cache directory of the user.
+
+    :return: The path of the database file.
+    :rtype: str
+    """
+    return os.path.join(user_cache_dir(), "thumbnails.sqlite")
+
+
+def render_thumbnail(path, size=THUMBNAIL_SIZE):
+    """Decode an image at a reduced resolution and encode its thumbnail.
+    JPEG files are decoded directly near the thumbnail size with the DCT scaling of the decoder.
+
+    :param path: The path of the image file.
+    :param size: The maximum width and height of the thumbnail.
+    :type path: str
+    :type size: int
+
+    :return: The thumbnail encoded in JPEG, or in PNG when the image is transparent.
+    :rtype: bytes
+    """
+    with Image.open(path) as image:
+        image.draft("RGB", (size, size))
+        image.thumbnail((size, size), Image.BILINEAR)
+        transparent = image.mode in ("RGBA", "LA", "PA") or "transparency" in image.info
+        thumbnail = image.convert("RGBA" if transparent else "RGB")
+    data = io.BytesIO()
+    if transparent:
+        thumbnail.save(data, "PNG")
+    else:
+        thumbnail.save(data, "JPEG", quality=85)
+    return data.getvalue()
+
+
+class ThumbnailCache:
+    """The ThumbnailCache class keeps the encoded thumbnails in a SQLite database, shared by the threads.
+    A thumbnail is valid while the size and the modification time of its image do not change.
+    The least recently used thumbnails are evicted when the database exceeds its size.
+
+    Attributes:
+        **path** *(str)*: The path of the database file, ":memory:" for a cache without persistence.
+
+        **max_bytes** *(int)*: The maximum size of the thumbnails in the database.
+    """
+
+    COMMIT_INTERVAL = 100
+
+    def __init__(self, path=None, max_bytes=THUMBNAIL_CACHE_BYTES):
+        """The constructor of the cache.
+
+        :param path: The path of the database file, in the cache directory of the user if None.
+        :param max_bytes: The maximum size of the thumbnails in the database.
+        :type path: str
+        :type max_bytes: int
+        """
+        self.path = path or default_cache_path()
+        self.max_bytes = max_bytes
+        self._connection = None
+        self._uncommitted = 0
+        self._bytes = 0
+        self._lock = threading.Lock()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def _connect(self):
+        """Open the database on first use, the lock must be held.
+
+        :return: The connection to the database.
+        :rtype: sqlite3.Connection
+        """
+        if self._connection is None:
+            if self.path != ":memory:":
+                os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            self._connection = sqlite3.connect(self.path, check_same_thread=False)
+            self._connection.execute("CREATE TABLE IF NOT EXISTS thumbnails ("
+                                     "source TEXT, dimension INTEGER, size INTEGER, mtime INTEGER, "
+                                     "data BLOB, used INTEGER, PRIMARY KEY (source, dimension))")
+            self._connection.execute("CREATE INDEX IF NOT EXISTS thumbnails_used ON thumbnails (used)")
+            self._bytes = self._connection.execute("SELECT COALESCE(SUM(LENGTH(data)), 0) "
+                                                   "FROM thumbnails").fetchone()[0]
+        return self._connection
+
+    def get(self, source, stat, dimension=THUMBNAIL_SIZE):
+        """Get the thumbnail of an image if it is up to date.
+
+        :param source: The path of the image file.
+        :param stat: The status of the image file.
+        :param dimension: The size of the thumbnail.
+        :type source: str
+        :type stat: os.stat_result
+        :type dimension: int
+
+        :return: The encoded thumbnail, None if it is missing or outdated.
+        :rtype: bytes
+        """
+        with self._lock:
+            connection = self._connect()
+            row = connection.execute("SELECT size, mtime, data FROM thumbnails WHERE source = ? AND dimension = ?",
+                                     (source, dimension)).fetchone()
+            if row is None or row[:2] != (stat.st_size, stat.st_mtime_ns):
+                return None
+            connection.execute("UPDATE thumbnails SET used = ? WHERE source = ? AND dimension = ?",
+                               (time.time_ns(), source, dimension))
+            self._count_change(connection)
+            return row[2]
+
+    def put(self, source, stat, data, dimension=THUMBNAIL_SIZE):
+        """Store the thumbnail of an image, replacing the previous one, and evict the least recently used.
+
+        :param source: The path of the image file.
+        :param stat: The status of the image file when the thumbnail was rendered.
+        :param data: The encoded thumbnail.
+        :param dimension: The size of the thumbnail.
+        :type source: str
+        :type stat: os.stat_result
+        :type data: bytes
+        :type dimension: int
+        """
+        with self._lock:
+            connection = self._connect()
+            previous = connection.execute("SELECT LENGTH(data) FROM thumbnails WHERE source = ? AND dimension = ?",
+                                          (source, dimension)).fetchone()
+            connection.execute("INSERT OR REPLACE INTO thumbnails VALUES (?, ?, ?, ?, ?, ?)",
+                               (source, dimension, stat.st_size, stat.st_mtime_ns, data, time.time_ns()))
+            self._bytes += len(data) - (previous[0] if previous else 0)
+            if self._bytes > self.max_bytes:
+                self._evict(connection)
+            self._count_change(connection)
+
+    def _evict(self, connection):
+        """Delete the least recently used thumbnails until the database is back under 90% of its size.
+
+        :param connection: The connection to the database.
+        :type connection: sqlite3.Connection
+        """
+        target = self.max_bytes * 9 // 10
+        rows = connection.execute("SELECT source, dimension, LENGTH(data) FROM thumbnails ORDER BY used").fetchall()
+        evicted = []
+        for source, dimension, length in rows:
+            if self._bytes <= target:
+                break
+            evicted.append((source, dimension))
+            self._bytes -= length
+        connection.executemany("DELETE FROM thumbnails WHERE source = ? AND dimension = ?", evicted)
+
+    def _count_change(self, connection):
+        """Commit the changes every :attr:`COMMIT_INTERVAL` changes.
+
+        :param connection: The connection to the database.
+        :type connection: sqlite3.Connection
+        """
+        self._uncommitted += 1
+        if self._uncommitted >= self.COMMIT_INTERVAL:
+            connection.commit()
+            self._uncommitted = 0
+
+    def size(self):
+        """Get the size of the thumbnails in the database.
+
+        :return: The number of bytes.
+        :rtype: int
+        """
+        with self._lock:
+            self._connect()
+            return self._bytes
+
+    def close(self):
+        """Commit the pending changes and close the database."""
+        with self._lock:
+            if self._connection is not None:
+                self._connection.commit()
+                self._connection.close()
+                self._connection = None
+                self._uncommitted = 0
+
+
+class ThumbnailService:
+    """The ThumbnailService class renders the thumbnails on a pool of threads, the decoders release the GIL.
+    A thumbnail is rendered once per image version: the cached ones are only read,
+    and the requests for an image already in progress are merged.
+
+    Attributes:
+        **cache** *(ThumbnailCache)*: The persistent cache of the thumbnails.
+
+        **size** *(int)*: The maximum width and height of the thumbnails.
+    """
+
+    def __init__(self, cache=None, workers=None, size=THUMBNAIL_SIZE):
+        """The constructor of the service.
+
+        :param cache: The persistent cache of the thumbnails, in the cache directory of the user if None.
+        :param workers: The number of threads, up to 4 according to the number of CPUs if None.
+        :param size: The maximum width and height of the thumbnails.
+        :type cache: ThumbnailCache
+        :type workers: int
+        :type size: int
+        """
+        self.cache = cache if cache is not None else ThumbnailCache()
+        self.size = size
+        self._executor = concurrent.futures.ThreadPoolExecutor(max_workers=workers or min(4, os.cpu_count() or 1))
+        self._pending = {}
+        self._failed = set()
+        self._lock = threading.Lock()
+
+    def request(self, path, callback):
+        """Render the thumbnail of an image in the background, unless it is already requested.
+        The callback is called from a thread of the pool, and only if the thumbnail could be rendered.
+
+        :param path: The path of the image file.
+        :param callback: Called with the path and the encoded thumbnail.
+        :type path: str
+        :type callback: callable
+        """
+        with self._lock:
+            if path in self._pending or path in self._failed:
+                return
+            self._pending[path] = self._executor.submit(self._load, path, callback)
+
+    def retain(self, paths):
+        """Cancel the requests of the images not in a set, when they are not started yet.
+        Called when the visible images change, so the thumbnails of the images scrolled past are skipped.
+
+        :param paths: The paths of the images still needed.
+        :type paths: set
+        """
+        with self._lock:
+            for path, future in list(self._pending.items()):
+                if path not in paths and future.cancel():
+                    del self._pending[path]
+
+    def _load(self, path, callback):
+        """Read the thumbnail of an image from the cache, or render and cache it.
+
+        :param path: The path of the image file.
+        :param callback: Called with the path and the encoded thumbnail.
+        :type path: str
+        :type callback: callable
+        """
+        try:
+            stat = os.stat(path)
+            data = self.cache.get(path, stat, self.size)
+            if data is None:
+                data = render_thumbnail(path, self.size)
+                self.cache.put(path, stat, data, self.size)
+        except (OSError, ValueError, Image.DecompressionBombError):
+            with self._lock:
+                self._failed.add(path)
+                del self._pending[path]
+            return
+        with self._lock:
+            del self._pending[path]
+        callback(path, data)
+
+    def close(self):
+        """Stop the threads, the requests not started are dropped, and close the cache."""
+        with self._lock:
+            for future in self._pending.values():
+                future.cancel()
+        self._executor.shutdown(wait=True)
+        self.cache.close()
@@ -0,0 +1,232 @@
+import argparse
+import json
+import sys
+import time
+
+from package.api.batch import BatchProcessor
+from package.api.encoding import EncoderSettings
+from package.api.fonts import default_family
+from package.api.instrumentation import StatsCollector
+from package.api.pipeline import Pipeline
+from package.api.position import WATERMARK_POSITION
+from package.api.preset import WatermarkSpec, compile_spec, load_preset, save_preset
+from package.api.scanner import scan
+from package.api.scheduler import default_budget
+from package.api.stamp import TILE_ANGLE, TILE_OPACITY
+
+
+SPEC_ARGUMENTS = {"wt_type": "wt_type", "text": "text", "font": "font", "size": "size", "color": "color",
+                  "logo": "logo", "pos": "position", "margin": "margin", "angle": "angle", "opacity": "opacity",
+                  "stamp": "stamp", "folder": "output", "renditions": "renditions"}
+
+ENCODER_ARGUMENTS = ("format", "quality", "progressive", "optimize", "compress_level", "strip_metadata")
+
+
+def parse_args(argv=None):
+    """Parse the command line arguments.
+
+    :param argv: The arguments, sys.argv if None.
+    :type argv: list
+
+    :return: The parsed arguments.
+    :rtype: argparse.Namespace
+    """
+    parser = argparse.ArgumentParser(prog="python -m package", description="Watermark images without the UI.")
+    parser.add_argument("paths", nargs="+", help="Image files, directories or glob patterns.")
+    parser.add_argument("--preset", help="A JSON or TOML preset file, the other options override its settings.")
+    parser.add_argument("--save-preset", help="Save the watermark settings in this JSON or TOML preset file.")
+    parser.add_argument("-t", "--type", dest="wt_type", choices=("text", "image", "layers"), default="text",
+                        help="The type of the watermark, the layers are defined in the preset.")
+    parser.add_argument("--text", default="watermark", help="The text of the watermark.")
+    parser.add_argument("--font", help="The font family, file name or path of the text, "
+                                       "an installed family like Arial or DejaVu Sans by default.")
+    parser.add_argument("--size", type=int, default=75, help="The font size of the text.")
+    parser.add_argument("--color", default="#000000", help="The color of the text.")
+    parser.add_argument("--logo", help="The path of the image watermark.")
+    parser.add_argument("-p", "--position", choices=WATERMARK_POSITION, default="top left",
+                        help="The position of the watermark.")
+    parser.add_argument("--angle", type=float, default=TILE_ANGLE,
+                        help="The rotation of the tiled watermark, in degrees.")
+    parser.add_argument("--opacity", type=float, default=TILE_OPACITY,
+                        help="The opacity of the tiled watermark, between 0 and 1.")
+    parser.add_argument("-m", "--margin", type=int, default=25,
+                        help="The margin between the image border and the watermark, or between the tiles.")
+    parser.add_argument("-o", "--output", default="output", help="The name of the output folder.")
+    parser.add_argument("-j", "--jobs", type=int, default=None,
+                        help="The number of worker processes, the number of CPUs by default.")
+    parser.add_argument("--pipeline", action="store_true",
+                        help="Read and write the files in threads overlapping the watermark, for slow storage.")
+    parser.add_argument("--readers", type=int, default=2, help="The number of prefetch threads of the pipeline.")
+    parser.add_argument("--writers", type=int, default=2, help="The number of writer threads of the pipeline.")
+    parser.add_argument("--stream", action="store_true",
+                        help="Watermark the uncompressed TIFF, PPM and BMP files band by band, without decoding "
+                             "them entirely, when they keep their format. For the images larger than the memory.")
+    parser.add_argument("--patch-jpeg", action="store_true",
+                        help="Re-encode only the blocks under the watermark of the JPEG files with jpegtran, "
+                             "when they keep the JPEG format and the quality of the source. The other blocks are "
+                             "copied without quality loss.")
+    parser.add_argument("--memory-budget", type=int, default=None,
+                        help="The memory of the decoded images in progress, in MiB, half of the RAM by default.")
+    parser.add_argument("-f", "--format", help="The output format (JPEG, PNG, WEBP...), the source format by default.")
+    parser.add_argument("-q", "--quality", type=int, help="The JPEG and WEBP quality.")
+    parser.add_argument("--progressive", action="store_true", help="Write progressive JPEG files.")
+    parser.add_argument("--optimize", action="store_true", help="Optimize the JPEG and PNG encoding.")
+    parser.add_argument("--compress-level", type=int, help="The PNG compression level, from 0 to 9.")
+    parser.add_argument("--strip-metadata", action="store_true", help="Do not copy the EXIF data and ICC profile.")
+    parser.add_argument("--rendition", dest="renditions", action="append", metavar="SIZE:FORMAT:QUALITY:SUFFIX",
+                        help="Write this rendition of each image, like 1024:WEBP:80:_1024 or full, instead of "
+                             "a single full size output. Repeat for each size, all are written from one decode.")
+    parser.add_argument("--force", action="store_true",
+                        help="Watermark again the images whose output is up to date.")
+    parser.add_argument("--stamp", action="store_true",
+                        help="Paste a watermark pre-rendered once per image size.")
+    parser.add_argument("--json", action="store_true", help="Print the summary as JSON.")
+    parser.add_argument("--report", help="Write the per-stage timings report to this JSON file.")
+    parser.add_argument("--profile-every", type=int, default=0,
+                        help="Profile one job every N jobs with cProfile and tracemalloc, in the report.")
+    args = parser.parse_args(argv)
+
+    if args.preset:
+        try:
+            spec = load_preset(args.preset)
+        except (OSError, TypeError, ValueError) as e:
+            parser.error(f"cannot load the preset {args.preset}: {e}")
+        parser.set_defaults(**{dest: getattr(spec, field) for field, dest in SPEC_ARGUMENTS.items()})
+        args = parser.parse_args(argv)
+        args.spec = spec
+    else:
+        args.spec = WatermarkSpec()
+
+    if args.wt_type == "image" and not args.logo:
+        parser.error("--logo is required with --type image")
+    if args.font is None and args.wt_type != "image":
+        args.font = default_family()
+        if args.font is None:
+            parser.error("no font is installed, --font is required for the text")
+    if args.stream and args.pipeline:
+        parser.error("--stream cannot be used with --pipeline, which reads the images in memory")
+    if args.patch_jpeg and args.pipeline:
+        parser.error("--patch-jpeg cannot be used with --pipeline, which reads the images in memory")
+    return args
+
+
+def encoder_settings(args):
+    """Build the encoder settings from the command line arguments.
+
+    :param args: The parsed arguments.
+    :type args: argparse.Namespace
+
+    :return: The encoder settings.
+    :rtype: EncoderSettings
+    """
+    jpeg, png, webp = {}, {}, {}
+    if args.quality is not None:
+        jpeg["quality"] = webp["quality"] = args.quality
+    if args.progressive:
+        jpeg["progressive"] = True
+    if args.optimize:
+        jpeg["optimize"] = png["optimize"] = True
+    if args.compress_level is not None:
+        png["compress_level"] = args.compress_level
+    return EncoderSettings(format=args.format, options={"JPEG": jpeg, "PNG": png, "WEBP": webp},
+                           keep_exif=not args.strip_metadata, keep_icc=not args.strip_metadata)
+
+
+def watermark_spec(args):
+    """Build the watermark settings from the command line arguments, over the settings of the preset.
+    The encoder settings of the preset are kept unless an encoding option is given.
+
+    :param args: The parsed arguments.
+    :type args: argparse.Namespace
+
+    :return: The settings of the watermark.
+    :rtype: WatermarkSpec
+    """
+    spec = args.spec._replace(**{field: getattr(args, dest) for field, dest in SPEC_ARGUMENTS.items()})
+    if not args.preset or any(getattr(args, dest) not in (None, False) for dest in ENCODER_ARGUMENTS):
+        spec = spec._replace(encoder=encoder_settings(args).to_dict())
+    return spec
+
+
+def main(argv=None):
+    """Watermark the images given on the command line and print a summary.
+
+    :param argv: The arguments, sys.argv if None.
+    :type argv: list
+
+    :return: The exit code, 1 if an image failed else 0.
+    :rtype: int
+    """
+    args = parse_args(argv)
+    spec = watermark_spec(args)
+    if args.save_preset:
+        save_preset(spec, args.save_preset)
+    try:
+        preset = compile_spec(spec)
+    except (OSError, TypeError, ValueError) as e:
+        print(f"error: {e}", file=sys.stderr)
+        return 2
+    paths = scan(args.paths, exclude=(args.output,))
+
+    collector = StatsCollector()
+    memory_budget = args.memory_budget * 2 ** 20 if args.memory_budget else default_budget()
+    if args.pipeline:
+        engine = Pipeline(workers=args.jobs, readers=args.readers, writers=args.writers, incremental=not args.force,
+                          collector=collector, profile_every=args.profile_every, memory_budget=memory_budget)
+    else:
+        engine = BatchProcessor(workers=args.jobs, incremental=not args.force, collector=collector,
+                                profile_every=args.profile_every, memory_budget=memory_budget)
+    count = 0
+    encode_time = 0.0
+    bytes_written = 0
+    peak_memory = 0
+    failures = []
+    start = time.perf_counter()
+    try:
+        for result in engine.run(paths, stream=args.stream, patch_jpeg=args.patch_jpeg, **preset._asdict()):
+            count += 1
+            encode_time += result.encode_time
+            bytes_written += result.bytes_written
+            peak_memory = max(peak_memory, result.peak_memory)
+            if not result.success:
+                failures.append((result.path, result.error))
+    except KeyboardInterrupt:
+        engine.cancel()
+        return 130
+    elapsed = time.perf_counter() - start
+    if args.report:
+        collector.write_json(args.report)
+
+    summary = {
+        "images": count,
+        "processed": count - len(failures) - engine.skipped,
+        "skipped": engine.skipped,
+        "failed": len(failures),
+        "failures": [path for path, _ in failures],
+        "errors": {path: error for path, error in failures},
+        "encode_seconds": round(encode_time, 3),
+        "bytes_written": bytes_written,
+        "peak_memory_per_job": peak_memory,
+        "workers": engine.workers,
+        "memory_budget": memory_budget,
+        "peak_admitted_memory": engine.scheduler.peak,
+        "stages": {name: {"p50": round(stage["p50"], 4), "p95": round(stage["p95"], 4)}
+                   for name, stage in collector.summary()["stages"].items()},
+        "seconds": round(elapsed, 3),
+        "images_per_second": round(count / elapsed, 2) if elapsed else 0.0,
+    }
+    if args.pipeline:
+        summary["utilization"] = {stage: round(value, 3) for stage, value in engine.utilization().items()}
+    if args.json:
+        print(json.dumps(summary, indent=2))
+    else:
+        print(f"{summary['processed']}/{summary['images']} images watermarked, {summary['skipped']} up to date, "
+              f"in {summary['seconds']}s ({summary['images_per_second']} images/s, {summary['workers']} workers), "
+              f"{summary['bytes_written']} bytes written in {summary['encode_seconds']}s of encoding, "
+              f"peak memory per job {summary['peak_memory_per_job'] / 2 ** 20:.1f} MiB")
+        if args.pipeline:
+            print("utilization: " + ", ".join(f"{stage} {value:.0%}" for stage, value in summary["utilization"].items()))
+        for path, error in failures:
+            print(f"failed: {path}: {error}", file=sys.stderr)
+
+    return 1 if failures else 0
@@ -0,0 +1,204 @@
+import collections
+
+from PySide2 import QtCore, QtGui
+
+
+class FileListModel(QtCore.QAbstractListModel):
+    """This is a class to hold the image files of the list and their processing status.
+    The status changes are buffered and the views are refreshed once per :meth:`flush`,
+    so a batch of tens of thousands of images costs a few repaints only.
+    The images show their thumbnail, once loaded, with the icon of their status in the corner.
+    """
+
+    PENDING = 0
+    DONE = 1
+    FAILED = 2
+
+    PathRole = QtCore.Qt.UserRole
+    StatusRole = QtCore.Qt.UserRole + 1
+
+    MAX_THUMBNAILS = 2000
+
+    BADGE_SIZE = 16
+
+    def __init__(self, icons, parent=None):
+        """The constructor of the model.
+
+        :param icons: The icon of each status.
+        :param parent: The parent object.
+        :type icons: dict
+        :type parent: QtCore.QObject
+        """
+        super().__init__(parent)
+        self.icons = icons
+        self.paths = []
+        self.status = []
+        self.errors = {}
+        self.rows = {}
+        self.changed = set()
+        self.thumbnails = collections.OrderedDict()
+
+    def rowCount(self, parent=QtCore.QModelIndex()):
+        """Overload the rowCount method.
+
+        :param parent: The parent index, invalid for a list.
+        :type parent: QtCore.QModelIndex
+
+        :return: The number of images.
+        :rtype: int
+        """
+        return 0 if parent.isValid() else len(self.paths)
+
+    def data(self, index, role=QtCore.Qt.DisplayRole):
+        """Overload the data method.
+
+        :param index: The index of the image.
+        :param role: The role of the requested data.
+        :type index: QtCore.QModelIndex
+        :type role: int
+
+        :return: The data of the image for the role.
+        """
+        if not index.isValid():
+            return None
+        row = index.row()
+        if role in (QtCore.Qt.DisplayRole, self.PathRole):
+            return self.paths[row]
+        if role == QtCore.Qt.DecorationRole:
+            return self.decoration(row)
+        if role == QtCore.Qt.ToolTipRole:
+            return self.errors.get(self.paths[row], self.paths[row])
+        if role == self.StatusRole:
+            return self.status[row]
+        return None
+
+    def add_paths(self, paths):
+        """Append image files to the list, with a single insertion for the views.
+
+        :param paths: The paths of the image files, not in the list yet.
+        :type paths: list
+        """
+        paths = [path for path in paths if path not in self.rows]
+        if not paths:
+            return
+        first = len(self.paths)
+        self.beginInsertRows(QtCore.QModelIndex(), first, first + len(paths) - 1)
+        for row, path in enumerate(paths, first):
+            self.rows[path] = row
+        self.paths.extend(paths)
+        self.status.extend([self.PENDING] * len(paths))
+        self.endInsertRows()
+
+    def remove_rows(self, rows):
+        """Remove image files from the list, one removal per contiguous range of rows.
+
+        :param rows: The rows to remove.
+        :type rows: iterable
+        """
+        ranges = []
+        for row in sorted(set(rows), reverse=True):
+            if ranges and ranges[-1][0] == row + 1:
+                ranges[-1][0] = row
+            else:
+                ranges.append([row, row])
+        for first, last in ranges:
+            self.beginRemoveRows(QtCore.QModelIndex(), first, last)
+            for path in self.paths[first:last + 1]:
+                self.errors.pop(path, None)
+                self.thumbnails.pop(path, None)
+            del self.paths[first:last + 1]
+            del self.status[first:last + 1]
+            self.endRemoveRows()
+        self.rows = {path: row for row, path in enumerate(self.paths)}
+        self.changed.clear()
+
+    def set_status(self, path, status, error=None):
+        """Change the status of an image file, the views are refreshed on the next :meth:`flush`.
+
+        :param path: The path of the image file.
+        :param status: The new status.
+        :param error: The error of a failed image.
+        :type path: str
+        :type status: int
+        :type error: str
+        """
+        row = self.rows.get(path)
+        if row is None:
+            return
+        self.status[row] = status
+        if error:
+            self.errors[path] = error
+        else:
+            self.errors.pop(path, None)
+        self.changed.add(row)
+
+    def flush(self):
+        """Refresh the views for the status changes since the last flush, with a single notification."""
+        if not self.changed:
+            return
+        first, last = min(self.changed), max(self.changed)
+        self.changed.clear()
+        self.dataChanged.emit(self.index(first), self.index(last),
+                              [QtCore.Qt.DecorationRole, QtCore.Qt.ToolTipRole, self.StatusRole])
+
+    def pending_paths(self):
+        """Get the image files which are not processed yet, the failed ones included.
+
+        :return: The paths of the image files.
+        :rtype: list
+        """
+        return [path for path, status in zip(self.paths, self.status) if status != self.DONE]
+
+    def has_thumbnail(self, path):
+        """Check if the thumbnail of an image file is loaded.
+
+        :param path: The path of the image file.
+        :type path: str
+
+        :return: True if the thumbnail is loaded.
+        :rtype: bool
+        """
+        return path in self.thumbnails
+
+    def set_thumbnail(self, path, pixmap):
+        """Show the thumbnail of an image file, the least recently shown thumbnails are forgotten.
+
+        :param path: The path of the image file.
+        :param pixmap: The thumbnail.
+        :type path: str
+        :type pixmap: QtGui.QPixmap
+        """
+        row = self.rows.get(path)
+        if row is None:
+            return
+        self.thumbnails[path] = (pixmap, None, None)
+        while len(self.thumbnails) > self.MAX_THUMBNAILS:
+            self.thumbnails.popitem(last=False)
+        index = self.index(row)
+        self.dataChanged.emit(index, index, [QtCore.Qt.DecorationRole])
+
+    def decoration(self, row):
+        """Get the decoration of an image file: its thumbnail with the status icon, or the status icon alone.
+        The decorated thumbnail is painted again only when the status changes.
+
+        :param row: The row of the image file.
+        :type row: int
+
+        :return: The decoration of the image file.
+        :rtype: QtGui.QIcon or QtGui.QPixmap
+        """
+        path = self.paths[row]
+        status = self.status[row]
+        thumbnail = self.thumbnails.get(path)
+        if thumbnail is None:
+            return self.icons[status]
+        self.thumbnails.move_to_end(path)
+        pixmap, decorated_status, decorated = thumbnail
+        if decorated is None or decorated_status != status:
+            decorated = QtGui.QPixmap(pixmap)
+            badge = self.icons[status].pixmap(self.BADGE_SIZE, self.BADGE_SIZE)
+            painter = QtGui.QPainter(decorated)
+            painter.drawPixmap(decorated.width() - badge.width(), decorated.height() - badge.height(), badge)
+            painter.end()
+            self.thumbnails[path] = (pixmap, status, decorated)
+        return decorated
@@ -1,80 +1,154 @@
+import collections
 import os
+import threading
+import time
 from PySide2 import QtWidgets, QtCore, QtGui
 
-from package.api.image import CustomImage
+from package.api.scanner import scan
+from package.file_model import FileListModel
 from package.widget import FileBrowser
 
+# PIL and the watermark engine are imported on first use, so they do not delay the start of the application.
+
 
 class Worker(QtCore.QObject):
-    """This is a class to create the worker of the threading system."""
+    """This is a class to create the worker of the threading system.
+    The images are processed by a :class:`Pipeline`, the worker only queues their results
+    in :attr:`results`, which the UI consumes at its own pace.
+    """
 
-    image_processed = QtCore.Signal(object, bool)
     finished = QtCore.Signal()
 
-    def __init__(self, images_to_process, folder, pos, size=None,
-                 wt_type=None, text=None, font=None, color=None, logo=None):
+    def __init__(self, images_to_process, preset, workers=None):
         """The constructor of the worker.
 
-        :param images_to_process: The images items to process.
-        :param folder: The name of the output folder.
-        :param pos: The position of the watermark.
-        :param size: The reduction size coefficient.
-        :param wt_type: The type of the watermark.
-        :param text: The text of the watermark.
-        :param font: The font of the watermark.
-        :param color: The color of the watermark.
-        :param logo: The path of the image watermark.
-
-        :type images_to_process: QWidgets.QListWidgetItem
-        :type folder: str
-        :type pos: str
-        :type size: float
-        :type wt_type: str
-        :type text: str
-        :type font: str
-        :type color: str
-        :type logo: str
+        :param images_to_process: The paths of the images to process.
+        :param preset: The compiled watermark settings, shared by all the images.
+        :param workers: The number of worker processes, the number of CPUs if None.
+
+        :type images_to_process: list
+        :type preset: Preset
+        :type workers: int
         """
+        from package.api.instrumentation import StatsCollector
+        from package.api.pipeline import Pipeline
+        from package.api.scheduler import default_budget
+
         super().__init__()
         self.images_to_process = images_to_process
-        self.type = wt_type
-        self.text = text
-        self.font = font
-        self.color = color
-        self.logo = logo
-        self.size = size
-        self.folder = folder
-        self.pos = pos
-        self.runs = True
+        self.preset = preset
+        self.results = collections.deque()
+        self.collector = StatsCollector()
+        self.engine = Pipeline(workers=workers, collector=self.collector, memory_budget=default_budget())
 
     def process_images(self):
         """Convert the all the images of the list."""
-        for image_lw_item in self.images_to_process:
-            if self.runs and not image_lw_item.processed:
-                image = CustomImage(path=image_lw_item.text(), folder=self.folder)
-                success = None
-                if self.type == "text":
-                    success = image.watermark_text(self.text, self.color, self.font, self.size, self.pos)
-                elif self.type == "image":
-                    success = image.watermark_image(self.logo, self.pos)
-                self.image_processed.emit(image_lw_item, success)
+        for result in self.engine.run(self.images_to_process, **self.preset._asdict()):
+            self.results.append(result)
 
         self.finished.emit()
 
+    def cancel(self):
+        """Cancel the images processing, including the images in progress."""
+        self.engine.cancel()
+
+
+class FontLoader(QtCore.QObject):
+    """This is a class to load the font families in a thread, so the window shows before the fonts are listed."""
+
+    loaded = QtCore.Signal(list)
+
+    def run(self):
+        """Load the font index and send its families."""
+        from package.api.fonts import get_font_index
+
+        self.loaded.emit(get_font_index().families())
+
+
+class Scanner(QtCore.QObject):
+    """This is a class to scan the dropped files and directories in a thread.
+    Every candidate file is opened to check its signature, which is slow on huge trees and network storage,
+    so the images found are sent by chunks while the walk goes on.
+    """
+
+    found = QtCore.Signal(list)
+
+    finished = QtCore.Signal()
+
+    def __init__(self, paths, exclude, seen, chunk_size, interval):
+        """The constructor of the scanner.
+
+        :param paths: The paths of the files or directories.
+        :param exclude: The names of the directories to skip.
+        :param seen: The paths already in the list, they are not sent again.
+        :param chunk_size: The maximum number of images of a chunk.
+        :param interval: The maximum time between two chunks while images are found, in seconds.
+
+        :type paths: list
+        :type exclude: tuple
+        :type seen: set
+        :type chunk_size: int
+        :type interval: float
+        """
+        super().__init__()
+        self.paths = paths
+        self.exclude = exclude
+        self.seen = seen
+        self.chunk_size = chunk_size
+        self.interval = interval
+        self.stop = threading.Event()
+
+    def run(self):
+        """Walk the paths and send the images found by chunks."""
+        chunk = []
+        sent = time.monotonic()
+        for path in scan(self.paths, exclude=self.exclude, seen=self.seen, stop=self.stop):
+            chunk.append(path)
+            if len(chunk) >= self.chunk_size or time.monotonic() - sent >= self.interval:
+                self.found.emit(chunk)
+                chunk = []
+                sent = time.monotonic()
+        if chunk and not self.stop.is_set():
+            self.found.emit(chunk)
+        self.finished.emit()
+
+    def cancel(self):
+        """Stop the walk before the next file."""
+        self.stop.set()
+
 
 class MainWindow(QtWidgets.QWidget):
     """This is a class to create the window of the application."""
 
+    fonts_loaded = QtCore.Signal()
+
+    thumbnail_loaded = QtCore.Signal(str, bytes)
+
     WATERMARK_POSITION = (
         "top left",
         "top right",
         "center",
         "bottom left",
         "bottom right",
+        "tiled",
     )
 
     DEFAULT_COLOR = "#000000"
 
+    DEFAULT_FONT = "Arial"
+
+    SCAN_CHUNK_SIZE = 500
+
+    SCAN_INTERVAL = 200
+
+    PREVIEW_DELAY = 150
+
+    PROGRESS_INTERVAL = 200
+
+    THUMBNAIL_SIZE = 64
+
+    THUMBNAIL_DELAY = 50
+
     def __init__(self, ctx):
         """The constructor of the window.
 
@@ -84,8 +158,13 @@ class MainWindow(QtWidgets.QWidget):
         super().__init__()
         self.ctx = ctx
         self.setWindowTitle("pyWatermark")
+        self.file_paths = set()
+        self.scans = []
         self.setup_ui()
         self.color = self.DEFAULT_COLOR
+        self.spec = None
+        self.thumbnails = None
+        self.load_fonts()
 
     def setup_ui(self):
         """Setup the user interface of the application."""
@@ -103,7 +182,7 @@ class MainWindow(QtWidgets.QWidget):
         self.lbl_text = QtWidgets.QLabel("Text:")
         self.le_text = QtWidgets.QLineEdit()
         self.lbl_font = QtWidgets.QLabel("Font:")
-        self.cb_font = QtWidgets.QFontComboBox()
+        self.cb_font = QtWidgets.QComboBox()
         self.lbl_size = QtWidgets.QLabel("Size:")
         self.spn_size = QtWidgets.QSpinBox()
         self.lbl_color = QtWidgets.QLabel("Color:")
@@ -118,15 +197,22 @@ class MainWindow(QtWidgets.QWidget):
         self.spn_margin = QtWidgets.QSpinBox()
         self.lbl_outputDir = QtWidgets.QLabel("Output Directory:")
         self.le_outputDir = QtWidgets.QLineEdit()
-        self.lw_files = QtWidgets.QListWidget()
+        self.files = FileListModel({FileListModel.PENDING: self.ctx.img_unchecked,
+                                    FileListModel.DONE: self.ctx.img_checked,
+                                    FileListModel.FAILED: self.ctx.img_failed}, self)
+        self.lw_files = QtWidgets.QListView()
+        self.btn_load_preset = QtWidgets.QPushButton("Load preset")
+        self.btn_save_preset = QtWidgets.QPushButton("Save preset")
         self.btn_process = QtWidgets.QPushButton("Process")
+        self.lbl_preview = QtWidgets.QLabel()
         self.lbl_dropInfo = QtWidgets.QLabel("^ Drop your images on the UI")
+        self.tmr_preview = QtCore.QTimer(self)
+        self.tmr_progress = QtCore.QTimer(self)
+        self.tmr_thumbnails = QtCore.QTimer(self)
 
     def modify_widgets(self):
         """Apply a CSS style sheet to the user interface of the application and modify the widgets."""
-        css_file = self.ctx.get_resource("style.css")
-        with open(css_file, "r") as f:
-            self.setStyleSheet(f.read())
+        self.setStyleSheet(self.ctx.stylesheet)
 
         # Alignment
         # self.le_text.setAlignment(QtCore.Qt.AlignRight)
@@ -145,7 +231,7 @@ class MainWindow(QtWidgets.QWidget):
         self.btn_color.setMaximumHeight(30)
         self.btn_color.setStyleSheet("background-color:%s;" % self.DEFAULT_COLOR)
 
-        self.fbw_logo.btn_file_browser.setIcon(QtGui.QIcon(self.ctx.get_resource("images/folder.svg")))
+        self.fbw_logo.btn_file_browser.setIcon(self.ctx.img_folder)
 
         # Divers
         self.cb_type.addItems(["text", "image"])
@@ -153,7 +239,7 @@ class MainWindow(QtWidgets.QWidget):
         self.hide_logo_widgets()
         self.le_text.setPlaceholderText("Your watermark")
         self.le_text.setText("watermark")
-        self.cb_font.setCurrentFont(QtGui.QFont("Arial"))
+        self.cb_font.addItem(self.DEFAULT_FONT)
         self.cb_position.addItems(self.WATERMARK_POSITION)
         self.le_outputDir.setPlaceholderText("Output directory")
         self.le_outputDir.setText("output")
@@ -162,13 +248,26 @@ class MainWindow(QtWidgets.QWidget):
         # Drag & Drop
         self.setAcceptDrops(True)
 
-        # List widget
+        # List view
+        self.lw_files.setModel(self.files)
+        self.lw_files.setUniformItemSizes(True)
         self.lw_files.setAlternatingRowColors(True)
-        self.lw_files.setSelectionMode(QtWidgets.QListWidget.ExtendedSelection)
+        self.lw_files.setSelectionMode(QtWidgets.QListView.ExtendedSelection)
+        self.tmr_progress.setInterval(self.PROGRESS_INTERVAL)
+        self.lw_files.setIconSize(QtCore.QSize(self.THUMBNAIL_SIZE, self.THUMBNAIL_SIZE))
+        self.tmr_thumbnails.setSingleShot(True)
+        self.tmr_thumbnails.setInterval(self.THUMBNAIL_DELAY)
+
+        # Preview
+        self.lbl_preview.setAlignment(QtCore.Qt.AlignCenter)
+        self.lbl_preview.setMinimumHeight(150)
+        self.tmr_preview.setSingleShot(True)
+        self.tmr_preview.setInterval(self.PREVIEW_DELAY)
 
     def create_layouts(self):
         """Create the grid layout of the user interface."""
         self.main_layout = QtWidgets.QGridLayout(self)
+        self.preset_layout = QtWidgets.QHBoxLayout()
 
     def add_widgets_to_layouts(self):
         """Add created widgets to the user interface layout."""
@@ -194,32 +293,53 @@ class MainWindow(QtWidgets.QWidget):
         self.main_layout.addWidget(self.lbl_outputDir, 8, 0, 1, 1)
         self.main_layout.addWidget(self.le_outputDir, 8, 1, 1, 1)
         self.main_layout.addWidget(self.lw_files, 9, 0, 1, 2)
-        self.main_layout.addWidget(self.lbl_dropInfo, 10, 0, 1, 2)
-        self.main_layout.addWidget(self.btn_process, 11, 0, 1, 2)
+        self.main_layout.addWidget(self.lbl_preview, 10, 0, 1, 2)
+        self.main_layout.addWidget(self.lbl_dropInfo, 11, 0, 1, 2)
+        self.preset_layout.addWidget(self.btn_load_preset)
+        self.preset_layout.addWidget(self.btn_save_preset)
+        self.main_layout.addLayout(self.preset_layout, 12, 0, 1, 2)
+        self.main_layout.addWidget(self.btn_process, 13, 0, 1, 2)
 
     def setup_connections(self):
         """Setup the connections."""
         QtWidgets.QShortcut(QtGui.QKeySequence('Backspace'), self.lw_files, self.delete_selected_items)
         self.cb_type.currentIndexChanged.connect(self.show_type_widgets)
         self.btn_color.clicked.connect(self.set_color)
+        self.btn_load_preset.clicked.connect(self.load_preset)
+        self.btn_save_preset.clicked.connect(self.save_preset)
         self.btn_process.clicked.connect(self.process_images)
+        self.tmr_progress.timeout.connect(self.update_progress)
+
+        # Live preview
+        for signal in (self.cb_type.currentIndexChanged, self.le_text.textChanged, self.cb_font.currentIndexChanged,
+                       self.spn_size.valueChanged, self.cb_position.currentIndexChanged, self.spn_margin.valueChanged,
+                       self.fbw_logo.le_file.textChanged, self.lw_files.selectionModel().currentChanged):
+            # The arguments of the signals must not reach QTimer.start(msec).
+            signal.connect(lambda *args: self.tmr_preview.start())
+        self.tmr_preview.timeout.connect(self.update_preview)
+
+        # Thumbnails of the visible images
+        scroll_bar = self.lw_files.verticalScrollBar()
+        for signal in (scroll_bar.valueChanged, scroll_bar.rangeChanged, self.files.rowsInserted,
+                       self.files.rowsRemoved):
+            signal.connect(lambda *args: self.tmr_thumbnails.start())
+        self.tmr_thumbnails.timeout.connect(self.request_thumbnails)
+        self.thumbnail_loaded.connect(self.show_thumbnail)
 
     def process_images(self):
         """Convert the images in the list using threading."""
-        watermark_type = self.cb_type.currentText()
-        text = self.le_text.text()
-        font = self.get_font_path()
-        size = int(self.spn_size.value())
-        color = self.color
-        folder = self.le_outputDir.text()
-        logo = self.fbw_logo.get_file_path()
-        position = self.cb_position.currentText()
+        from package.api.preset import compile_spec
 
-        if logo is None:
+        if self.cb_type.currentText() == "image" and self.fbw_logo.get_file_path() is None:
+            return False
+        try:
+            preset = compile_spec(self.get_spec())
+        except (OSError, ValueError) as e:
+            msg_box = QtWidgets.QMessageBox(QtWidgets.QMessageBox.Warning, "Invalid watermark", str(e))
+            msg_box.exec_()
             return False
 
-        lw_items = [self.lw_files.item(index) for index in range(self.lw_files.count())]
-        images_to_process = [1 for lw_item in lw_items if not lw_item.processed]
+        images_to_process = self.files.pending_paths()
         if not images_to_process:
             msg_box = QtWidgets.QMessageBox(QtWidgets.QMessageBox.Warning,
                                             "No image to process",
@@ -228,46 +348,73 @@ class MainWindow(QtWidgets.QWidget):
             return False
 
         self.thread = QtCore.QThread(self)
-
-        if watermark_type == "text":
-            self.worker = Worker(images_to_process=lw_items, pos=position, wt_type="text", text=text, font=font,
-                                 size=size, color=color, folder=folder)
-        elif watermark_type == "image":
-            self.worker = Worker(images_to_process=lw_items, pos=position,  wt_type="image", logo=logo, folder=folder)
-
+        self.worker = Worker(images_to_process=images_to_process, preset=preset)
         self.worker.moveToThread(self.thread)
-        self.worker.image_processed.connect(self.image_processed)
         self.thread.started.connect(self.worker.process_images)
         self.worker.finished.connect(self.thread.quit)
+        self.worker.finished.connect(self.processing_finished)
         self.thread.start()
 
-        self.prg_dialog = QtWidgets.QProgressDialog("Process images", "Cancel", 1, len(images_to_process))
+        self.progress = collections.Counter(total=len(images_to_process))
+        self.progress_start = time.monotonic()
+        self.failures = []
+        self.prg_dialog = QtWidgets.QProgressDialog("Process images", "Cancel", 0, len(images_to_process))
+        self.prg_dialog.setMinimumDuration(0)
         self.prg_dialog.canceled.connect(self.abort)
         self.prg_dialog.show()
+        self.tmr_progress.start()
 
     def abort(self):
         """Stop the thread."""
+        self.worker.cancel()
         self.thread.quit()
-        self.worker.runs = False
 
-    def image_processed(self, lw_item, success):
-        """Update the image item icon and the progress bar.
-
-        :param lw_item: The image item
-        :param success: True if the image is converted else False
-        :type lw_item: QWidgets.QListWidgetItem
-        :type success: bool
+    def update_progress(self):
+        """Apply the results queued by the worker since the last update to the list and the progress dialog.
+        Called from a timer, so the cost of the UI updates does not depend on the number of images.
         """
-        if success:
-            lw_item.setIcon(self.ctx.img_checked)
-            lw_item.processed = True
-            self.prg_dialog.setValue(self.prg_dialog.value() + 1)
+        results = self.worker.results
+        while results:
+            result = results.popleft()
+            if result.success:
+                self.files.set_status(result.path, FileListModel.DONE)
+                self.progress["done"] += 1
+            else:
+                self.files.set_status(result.path, FileListModel.FAILED, result.error)
+                self.failures.append(result)
+                self.progress["failed"] += 1
+        self.files.flush()
+
+        finished = self.progress["done"] + self.progress["failed"]
+        elapsed = time.monotonic() - self.progress_start
+        rate = finished / elapsed if elapsed else 0.0
+        remaining = self.progress["total"] - finished
+        eta = f"{remaining / rate:.0f}s left" if rate else "estimating"
+        failed = f", {self.progress['failed']} failed" if self.progress["failed"] else ""
+        self.prg_dialog.setLabelText(f"Process images: {finished}/{self.progress['total']}{failed}\n"
+                                     f"{rate:.1f} images/s, {eta}")
+        self.prg_dialog.setValue(finished)
+
+    def processing_finished(self):
+        """Apply the last results, close the progress dialog and report the failures."""
+        self.tmr_progress.stop()
+        self.update_progress()
+        self.prg_dialog.canceled.disconnect(self.abort)
+        self.prg_dialog.close()
+        if self.failures:
+            details = "\n".join(f"{result.path}: {result.error}" for result in self.failures[:10])
+            msg_box = QtWidgets.QMessageBox(QtWidgets.QMessageBox.Warning,
+                                            "Some images failed",
+                                            f"{len(self.failures)} image(s) could not be processed.")
+            msg_box.setDetailedText(details)
+            msg_box.exec_()
 
     def delete_selected_items(self):
         """Remove selected image item from the list."""
-        for lw_item in self.lw_files.selectedItems():
-            row = self.lw_files.row(lw_item)
-            self.lw_files.takeItem(row)
+        rows = [index.row() for index in self.lw_files.selectionModel().selectedRows()]
+        for row in rows:
+            self.file_paths.discard(self.files.paths[row])
+        self.files.remove_rows(rows)
 
     def dragEnterEvent(self, event):
         """Overload the dragEnterEvent method.
@@ -293,23 +440,56 @@ class MainWindow(QtWidgets.QWidget):
         :type event: QtGui.QDropEvent
         """
         event.accept()
-        for url in event.mimeData().urls():
-            self.add_file(path=url.toLocalFile())
+        self.add_files([url.toLocalFile() for url in event.mimeData().urls()])
 
         self.lbl_dropInfo.setVisible(False)
 
+    def add_files(self, paths):
+        """Scan files and directories in a thread and add the images found to the list.
+        The images are added by chunks as they are found, so the UI stays responsive with huge trees
+        and slow storage.
+
+        :param paths: The paths of the files or directories.
+        :type paths: list
+        """
+        thread = QtCore.QThread(self)
+        scanner = Scanner(paths, (self.le_outputDir.text(),), set(self.file_paths), self.SCAN_CHUNK_SIZE,
+                          self.SCAN_INTERVAL / 1000)
+        scanner.moveToThread(thread)
+        thread.started.connect(scanner.run)
+        scanner.found.connect(self.add_chunk)
+        scanner.finished.connect(thread.quit)
+        thread.finished.connect(lambda: self.scans.remove((thread, scanner)))
+        self.scans.append((thread, scanner))
+        thread.start()
+
+    def is_scanning(self):
+        """Check if dropped files are still scanned.
+
+        :return: True while a scan is in progress.
+        :rtype: bool
+        """
+        return bool(self.scans)
+
+    def add_chunk(self, paths):
+        """Add a chunk of scanned images to the list, skipping the images added since the scan started.
+
+        :param paths: The paths of the image files.
+        :type paths: list
+        """
+        paths = [path for path in paths if path not in self.file_paths]
+        self.file_paths.update(paths)
+        self.files.add_paths(paths)
+
     def add_file(self, path):
         """Add an image file in the image list to process.
 
         :param path: The path of the image file.
         :type path: str
         """
-        items = [self.lw_files.item(index).text() for index in range(self.lw_files.count())]
-        if path not in items:
-            lw_item = QtWidgets.QListWidgetItem(path)
-            lw_item.setIcon(self.ctx.img_unchecked)
-            lw_item.processed = False
-            self.lw_files.addItem(lw_item)
+        if path not in self.file_paths:
+            self.file_paths.add(path)
+            self.files.add_paths([path])
 
     def set_color(self):
         """Set the background color of the color button.
@@ -318,22 +498,190 @@ class MainWindow(QtWidgets.QWidget):
         self.color = QtWidgets.QColorDialog.getColor()
         if self.color.isValid():
             self.btn_color.setStyleSheet("background-color:%s;" % self.color.name())
+            self.tmr_preview.start()
+
+    def get_color(self):
+        """Get the watermark text color.
+
+        :return: The hexadecimal name of the color.
+        :rtype: str
+        """
+        return self.color.name() if isinstance(self.color, QtGui.QColor) else self.color
+
+    def update_preview(self):
+        """Render the watermark on a reduced resolution of the current image and show it."""
+        from package.api.image import CustomImage
+        from package.api.preset import compile_layer
+
+        path = self.lw_files.currentIndex().data(FileListModel.PathRole)
+        if path is None:
+            self.lbl_preview.clear()
+            return
+
+        position = self.cb_position.currentText()
+        try:
+            with CustomImage(path=path, margin=self.spn_margin.value()) as image:
+                reduce = next((r for r in (8, 4, 2) if image.width / r >= self.lbl_preview.width()), 1)
+                logo = self.fbw_logo.le_file.text()
+                if self.cb_type.currentText() == "text":
+                    preview = image.preview_text(self.le_text.text(), self.get_color(), self.get_font_path(),
+                                                 self.spn_size.value(), position, reduce=reduce)
+                elif self.cb_type.currentText() == "layers":
+                    layers = [compile_layer(layer) for layer in self.spec.layers or ()]
+                    preview = image.preview_layers(layers, reduce=reduce)
+                elif os.path.isfile(logo):
+                    preview = image.preview_image(logo, position, reduce=reduce)
+                else:
+                    preview = image.draft(reduce)
+        except (OSError, ValueError):
+            self.lbl_preview.clear()
+            return
+
+        data = preview.convert("RGBA").tobytes("raw", "RGBA")
+        qimage = QtGui.QImage(data, preview.width, preview.height, QtGui.QImage.Format_RGBA8888)
+        pixmap = QtGui.QPixmap.fromImage(qimage).scaled(self.lbl_preview.size(), QtCore.Qt.KeepAspectRatio,
+                                                       QtCore.Qt.SmoothTransformation)
+        self.lbl_preview.setPixmap(pixmap)
+
+    def request_thumbnails(self):
+        """Load the thumbnails of the visible images and of the next page, the other requests are dropped."""
+        viewport = self.lw_files.viewport().rect()
+        first = self.lw_files.indexAt(viewport.topLeft())
+        if not first.isValid():
+            return
+        last = self.lw_files.indexAt(viewport.bottomLeft())
+        last_row = last.row() if last.isValid() else self.files.rowCount() - 1
+        last_row = min(last_row + last_row - first.row() + 1, self.files.rowCount() - 1)
+        paths = [self.files.paths[row] for row in range(first.row(), last_row + 1)]
+
+        if self.thumbnails is None:
+            from package.api.thumbnail import ThumbnailService
+
+            self.thumbnails = ThumbnailService(size=self.THUMBNAIL_SIZE)
+        self.thumbnails.retain(set(paths))
+        for path in paths:
+            if not self.files.has_thumbnail(path):
+                self.thumbnails.request(path, self.thumbnail_loaded.emit)
+
+    def show_thumbnail(self, path, data):
+        """Show a thumbnail loaded by the thumbnail service.
+
+        :param path: The path of the image file.
+        :param data: The encoded thumbnail.
+        :type path: str
+        :type data: bytes
+        """
+        image = QtGui.QImage.fromData(data)
+        if not image.isNull():
+            self.files.set_thumbnail(path, QtGui.QPixmap.fromImage(image))
+
+    def closeEvent(self, event):
+        """Overload the closeEvent method to stop the scans and the thumbnail threads and save their cache."""
+        for thread, scanner in list(self.scans):
+            scanner.cancel()
+            thread.quit()
+            thread.wait()
+        if self.thumbnails is not None:
+            self.thumbnails.close()
+            self.thumbnails = None
+        super().closeEvent(event)
 
     def get_font_path(self):
-        """Get the path of the selected font.
+        """Get the path of the selected font from the font index.
 
         :return: The path of the selected font.
         :rtype: str
+
+        :raise OSError: The selected font is not installed in the indexed font directories.
         """
-        base_path = eval("QtCore.QStandardPaths().standardLocations(QtCore.QStandardPaths.FontsLocation)")
-        font = self.cb_font.currentFont()
+        from package.api.fonts import find_font
 
-        font_path = os.path.join(base_path[0], font.family() + ".ttf")
+        return find_font(self.cb_font.currentText())
 
-        if os.path.exists(font_path):
-            return font_path
-        else:
-            raise OSError(f"{font.family()} does not found : {font_path}")
+    def load_fonts(self):
+        """List the font families of the font index once it is loaded by a thread."""
+        self.font_thread = QtCore.QThread(self)
+        self.font_loader = FontLoader()
+        self.font_loader.moveToThread(self.font_thread)
+        self.font_thread.started.connect(self.font_loader.run)
+        self.font_loader.loaded.connect(self.font_thread.quit)
+        self.font_loader.loaded.connect(self.set_font_families)
+        self.font_thread.start()
+
+    def set_font_families(self, families):
+        """Fill the font list, the selected family is kept when it is installed.
+
+        :param families: The installed font families.
+        :type families: list
+        """
+        current = self.cb_font.currentText()
+        self.cb_font.blockSignals(True)
+        self.cb_font.clear()
+        self.cb_font.addItems(families)
+        self.cb_font.blockSignals(False)
+        index = self.cb_font.findText(current, QtCore.Qt.MatchFixedString)
+        self.cb_font.setCurrentIndex(max(index, 0))
+        self.fonts_loaded.emit()
+
+    def get_spec(self):
+        """Get the watermark settings of the widgets.
+        The settings without widget keep the value of the last loaded preset.
+
+        :return: The settings of the watermark.
+        :rtype: WatermarkSpec
+        """
+        from package.api.preset import WatermarkSpec
+
+        spec = self.spec if self.spec is not None else WatermarkSpec()
+        return spec._replace(wt_type=self.cb_type.currentText(), text=self.le_text.text(),
+                             font=self.cb_font.currentText(), size=self.spn_size.value(),
+                             color=self.get_color(), logo=self.fbw_logo.le_file.text() or None,
+                             pos=self.cb_position.currentText(), margin=self.spn_margin.value(),
+                             folder=self.le_outputDir.text())
+
+    def set_spec(self, spec):
+        """Show watermark settings in the widgets.
+
+        :param spec: The settings of the watermark.
+        :type spec: WatermarkSpec
+        """
+        self.spec = spec
+        if self.cb_type.findText(spec.wt_type) < 0:
+            # The layered watermarks are only defined in the presets.
+            self.cb_type.addItem(spec.wt_type)
+        self.cb_type.setCurrentText(spec.wt_type)
+        self.le_text.setText(spec.text)
+        if self.cb_font.findText(spec.font, QtCore.Qt.MatchFixedString) < 0:
+            self.cb_font.addItem(spec.font)
+        self.cb_font.setCurrentIndex(self.cb_font.findText(spec.font, QtCore.Qt.MatchFixedString))
+        self.spn_size.setValue(spec.size)
+        self.color = spec.color
+        self.btn_color.setStyleSheet("background-color:%s;" % spec.color)
+        self.fbw_logo.le_file.setText(spec.logo or "")
+        self.cb_position.setCurrentText(spec.pos)
+        self.spn_margin.setValue(spec.margin)
+        self.le_outputDir.setText(spec.folder)
+
+    def load_preset(self):
+        """Load the watermark settings of a preset file chosen by the user."""
+        from package.api import preset
+
+        path, _ = QtWidgets.QFileDialog.getOpenFileName(self, "Load preset", "", "Presets (*.json *.toml)")
+        if not path:
+            return
+        try:
+            self.set_spec(preset.load_preset(path))
+        except (OSError, ValueError, TypeError) as e:
+            msg_box = QtWidgets.QMessageBox(QtWidgets.QMessageBox.Warning, "Invalid preset", f"{path}: {e}")
+            msg_box.exec_()
+
+    def save_preset(self):
+        """Save the watermark settings in a preset file chosen by the user."""
+        from package.api import preset
+
+        path, _ = QtWidgets.QFileDialog.getSaveFileName(self, "Save preset", "preset.json", "Presets (*.json *.toml)")
+        if path:
+            preset.save_preset(self.get_spec(), path)
 
     def hide_logo_widgets(self):
         """Hide image watermark widgets.
@@ -380,3 +728,6 @@ class MainWindow(QtWidgets.QWidget):
         elif self.cb_type.currentText() == "image":
             self.show_logo_widgets()
             self.hide_text_widgets()
+        else:
+            self.hide_logo_widgets()
+            self.hide_text_widgets()
@@ -0,0 +1,86 @@
+import json
+import os
+import sys
+import time
+
+from PySide2 import QtCore
+
+
+STARTUP_TIMING_FLAG = "--startup-timing"
+
+STARTUP_TIMING_VARIABLE = "PYWATERMARK_STARTUP_TIMING"
+
+
+def startup_timing_enabled(argv=None):
+    """Check if the startup timings are requested, by the command line flag or the environment variable.
+
+    :param argv: The command line arguments, sys.argv if None.
+    :type argv: list
+
+    :return: True to measure the startup.
+    :rtype: bool
+    """
+    argv = sys.argv if argv is None else argv
+    return STARTUP_TIMING_FLAG in argv or bool(os.environ.get(STARTUP_TIMING_VARIABLE))
+
+
+class StartupTimer(QtCore.QObject):
+    """This is a class to measure the startup of the application, from the first import to the first paint
+    of the window and the end of the background loadings. The timings are written as JSON on stderr,
+    so they can be compared between versions.
+    """
+
+    finished = QtCore.Signal()
+
+    def __init__(self, start, until=("first_paint",)):
+        """The constructor of the timer.
+
+        :param start: The time of the first import of the application, from time.perf_counter.
+        :param until: The steps to wait for before the timings are complete.
+        :type start: float
+        :type until: tuple
+        """
+        super().__init__()
+        self.start = start
+        self.marks = {}
+        self.pending = set(until)
+
+    def mark(self, name):
+        """Record the time elapsed since the start at a step, only the first time.
+
+        :param name: The name of the step.
+        :type name: str
+        """
+        if name in self.marks:
+            return
+        self.marks[name] = time.perf_counter() - self.start
+        self.pending.discard(name)
+        if not self.pending:
+            self.finished.emit()
+
+    def watch(self, widget):
+        """Record the first paint of a widget as the "first_paint" step.
+
+        :param widget: The window of the application.
+        :type widget: QtWidgets.QWidget
+        """
+        widget.installEventFilter(self)
+
+    def eventFilter(self, watched, event):
+        """Overload the eventFilter method to catch the first paint event."""
+        if event.type() == QtCore.QEvent.Paint:
+            watched.removeEventFilter(self)
+            # Marked once the event loop is back, when the painting is done.
+            QtCore.QTimer.singleShot(0, lambda: self.mark("first_paint"))
+        return False
+
+    def report(self, stream=None):
+        """Write the timings as JSON.
+
+        :param stream: The output stream, sys.stderr if None.
+        :type stream: file
+        """
+        report = {"seconds": {name: round(value, 4) for name, value in self.marks.items()},
+                  "pil_imported": "PIL" in sys.modules,
+                  "modules": len(sys.modules)}
+        print(json.dumps(report, indent=2), file=stream or sys.stderr)
@@ -0,0 +1,23 @@
+import os
+import sys
+
+from PIL import ImageDraw, ImageFont
+import pytest
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "src", "main", "python")))
+
+
+FONT_CANDIDATES = ("DejaVuSans.ttf", "arial.ttf", "Arial.ttf", "LiberationSans-Regular.ttf")
+
+
+@pytest.fixture
+def font():
+    if not hasattr(ImageDraw.ImageDraw, "textsize"):
+        pytest.skip("the text watermarks need ImageDraw.textsize, removed from Pillow 10")
+    for name in FONT_CANDIDATES:
+        try:
+            ImageFont.truetype(name, 10)
+            return name
+        except OSError:
+            continue
+    pytest.skip("no TrueType font found")
@@ -0,0 +1,31 @@
+"""The reduced previews decode the sources given as an image, bytes or a path."""
+import io
+import warnings
+
+from PIL import Image
+import pytest
+
+from package.api.image import OUTPUT_IMAGE, CustomImage
+
+
+@pytest.fixture(params=["image", "bytes", "path"])
+def source(request, tmp_path):
+    image = Image.new("RGB", (801, 601), (200, 40, 40))
+    if request.param == "image":
+        return image
+    if request.param == "bytes":
+        buffer = io.BytesIO()
+        image.save(buffer, "JPEG")
+        return buffer.getvalue()
+    path = str(tmp_path / "source.jpg")
+    image.save(path)
+    return path
+
+
+def test_draft(source):
+    with warnings.catch_warnings():
+        warnings.simplefilter("error", ResourceWarning)
+        with CustomImage(source, output=OUTPUT_IMAGE) as image:
+            assert image.draft(4).size == (201, 151)
+            assert image.draft(8).size == (101, 76)
+            assert image.draft(1).size == (801, 601)
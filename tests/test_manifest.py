@@ -0,0 +1,16 @@
+"""The manifest skips an image only while all its outputs exist."""
+from package.api.manifest import Manifest
+
+
+def test_missing_rendition_is_not_up_to_date(tmp_path):
+    source = tmp_path / "photo.jpg"
+    source.write_bytes(b"source")
+    outputs = [tmp_path / "output" / "photo.jpg", tmp_path / "output" / "photo_small.jpg"]
+    with Manifest(str(tmp_path / "output")) as manifest:
+        manifest.record(str(source), "config", [str(output) for output in outputs])
+        for output in outputs:
+            output.write_bytes(b"output")
+        assert manifest.is_up_to_date(str(source), "config")
+        assert not manifest.is_up_to_date(str(source), "other config")
+        outputs[1].unlink()
+        assert not manifest.is_up_to_date(str(source), "config")
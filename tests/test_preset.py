@@ -0,0 +1,20 @@
+"""The compiled presets watermark the sources of every mode."""
+from PIL import Image
+import pytest
+
+from package.api.image import OUTPUT_IMAGE, CustomImage
+from package.api.preset import WatermarkSpec, compile_spec
+
+
+@pytest.mark.parametrize("mode", ["L", "LA", "I;16", "RGB"])
+def test_text_preset_on_any_mode(font, mode):
+    preset = compile_spec(WatermarkSpec(text="Preset", font=font, size=40, color="#ff0000", pos="center"))
+    with CustomImage(Image.new(mode, (300, 200)), output=OUTPUT_IMAGE) as image:
+        result = image.watermark_text(preset.text, preset.color, preset.font, preset.size, preset.pos).image
+    assert result.mode == mode
+    assert result.getextrema() != Image.new(mode, (300, 200)).getextrema()
+
+
+def test_invalid_color():
+    with pytest.raises(ValueError):
+        compile_spec(WatermarkSpec(text="Preset", font="DejaVu Sans", color="notacolor"))
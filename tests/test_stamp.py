@@ -0,0 +1,60 @@
+"""The stamps composite the watermarks on every mode, without changing the alpha of the opaque images."""
+from PIL import Image, ImageDraw
+import pytest
+
+from package.api.cache import clear_caches
+from package.api.image import OUTPUT_IMAGE, CustomImage
+from package.api.stamp import Layer
+
+
+@pytest.fixture
+def logo(tmp_path):
+    path = str(tmp_path / "logo.png")
+    image = Image.new("RGBA", (120, 60), (0, 0, 0, 0))
+    ImageDraw.Draw(image).ellipse((0, 0, 120, 60), fill=(30, 90, 200, 180))
+    image.save(path)
+    clear_caches()
+    return path
+
+
+def watermark(operation, mode="RGBA"):
+    source = Image.new("RGB", (400, 300), (20, 120, 40)).convert(mode)
+    with CustomImage(source, output=OUTPUT_IMAGE) as image:
+        return operation(image).image
+
+
+@pytest.mark.parametrize("pos_name", ["top left", "center", "tiled"])
+def test_logo_stamp_keeps_opaque_rgba_opaque(logo, pos_name):
+    result = watermark(lambda image: image.watermark_image(logo, pos_name, stamp=True))
+    assert result.getchannel("A").getextrema() == (255, 255)
+    assert result.getchannel("B").getextrema()[1] > 40
+
+
+def test_text_stamp_keeps_opaque_rgba_opaque(font):
+    result = watermark(lambda image: image.watermark_text("Stamp", (255, 255, 255), font, 60, "center", stamp=True))
+    assert result.getchannel("A").getextrema() == (255, 255)
+    assert result.getchannel("R").getextrema()[1] == 255
+
+
+def test_layers_keep_opaque_rgba_opaque(logo):
+    layers = [Layer("image", logo=logo, pos="bottom left"),
+              Layer("image", logo=logo, pos="top right", blend="multiply"),
+              Layer("image", logo=logo, pos="tiled", opacity=0.3)]
+    result = watermark(lambda image: image.watermark_layers(layers))
+    assert result.getchannel("A").getextrema() == (255, 255)
+
+
+@pytest.mark.parametrize("mode", ["L", "P"])
+@pytest.mark.parametrize("stamp", [False, True])
+def test_tiled_logo_on_single_band_and_palette_images(logo, mode, stamp):
+    result = watermark(lambda image: image.watermark_image(logo, "tiled", stamp=stamp), mode)
+    assert result.mode == mode
+    assert len(result.getcolors()) > 1
+
+
+@pytest.mark.parametrize("mode", ["L", "P"])
+@pytest.mark.parametrize("color", ["#ff0000", (255, 0, 0)])
+def test_tiled_text_on_single_band_and_palette_images(font, mode, color):
+    result = watermark(lambda image: image.watermark_text("Tiled", color, font, 40, "tiled", stamp=True), mode)
+    assert result.mode == mode
+    assert len(result.getcolors()) > 1